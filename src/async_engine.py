@@ -0,0 +1,139 @@
+import asyncio
+import sys
+
+from log import forwarding_log
+
+# data packets are dropped instead of queued once this many bytes wait in the socket's send buffer
+DEFAULT_MAX_QUEUED_BYTES = 1 << 20
+
+
+class SendQueue:
+    """
+    Non-blocking replacement for the node's socket on the send side. The asyncio transport sends
+    right away when the socket is writable and queues otherwise; the queue is bounded by dropping.
+    """
+
+    def __init__(self, transport, max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES):
+        self.transport = transport
+        self.max_queued_bytes = max_queued_bytes
+        self.dropped = 0
+
+    def sendto(self, data, address):
+        if self.transport.is_closing() or self.transport.get_write_buffer_size() > self.max_queued_bytes:
+            self.dropped += 1
+            return
+        self.transport.sendto(data, address)
+
+
+class NodeDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, node, max_queued_bytes, on_processed):
+        self.node = node
+        self.max_queued_bytes = max_queued_bytes
+        self.on_processed = on_processed
+
+    def connection_made(self, transport):
+        self.node.transport = SendQueue(transport, self.max_queued_bytes)
+
+    def datagram_received(self, data, address):
+        self.node.process_packet(data, address)
+        self.on_processed()
+
+    def error_received(self, exc):
+        forwarding_log.warning("Link socket error: %s", exc)
+
+
+class AsyncEngine:
+    """
+    Runs a Node on an asyncio event loop: packets are dispatched to the node's protocol_switcher
+    as soon as they arrive, CLI lines are read without blocking the loop and the node's scheduler
+    is woken exactly when its next timer is due.
+    """
+
+    def __init__(self, node, max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES):
+        self.node = node
+        self.max_queued_bytes = max_queued_bytes
+        self._timer_handle = None
+        self._armed_deadline = None
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self.node.socket.setblocking(False)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: NodeDatagramProtocol(self.node, self.max_queued_bytes, self._after_event),
+            sock=self.node.socket)
+        self._arm_timer()
+
+        lines, stdin_transport = await self._open_stdin(loop)
+        # the quit command closes the stats socket and the data plane before exiting,
+        # so keep the descriptors for cleanup
+        readers = {}
+        if self.node.stats_endpoint is not None:
+            readers[self.node.stats_endpoint.fileno()] = self.node.stats_endpoint.handle
+        if self.node.data_plane is not None:
+            readers[self.node.data_plane.fileno()] = self._process_handed_over_packet
+        for fd, callback in readers.items():
+            loop.add_reader(fd, callback)
+        try:
+            while True:
+                line = await lines.readline()
+                if not line:
+                    break
+                self.node.process_user_input(line.decode(errors='replace'))
+                self._after_event()
+        finally:
+            if stdin_transport is not None:
+                stdin_transport.close()
+            for fd in readers:
+                loop.remove_reader(fd)
+            if self._timer_handle is not None:
+                self._timer_handle.cancel()
+            transport.close()
+
+    def _process_handed_over_packet(self):
+        self.node.process_handed_over_packet()
+        self._after_event()
+
+    def _after_event(self):
+        if self.node.data_plane is not None:
+            # the workers forward with the routes this event left behind
+            self.node.data_plane.publish()
+        self._arm_timer()
+
+    def _arm_timer(self):
+        scheduler = self.node.scheduler
+        deadline = scheduler.next_deadline()
+        if deadline == self._armed_deadline:
+            return
+        if self._timer_handle is not None:
+            self._timer_handle.cancel()
+        self._armed_deadline = deadline
+        self._timer_handle = None if deadline is None else \
+            asyncio.get_running_loop().call_later(max(deadline - scheduler.clock(), 0), self._on_timer)
+
+    def _on_timer(self):
+        self._timer_handle = None
+        self._armed_deadline = None
+        self.node.scheduler.run_due()
+        self._after_event()
+
+    @staticmethod
+    async def _open_stdin(loop):
+        """
+        :return: a StreamReader of the CLI's lines, which hands out every line that arrived in one read,
+                 and the transport feeding it; None for a regular file, which is read whole instead
+        """
+        lines = asyncio.StreamReader()
+        try:
+            transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(lines), sys.stdin)
+        except ValueError:
+            # only pipes, sockets and character devices can be watched
+            lines.feed_data(sys.stdin.buffer.read())
+            lines.feed_eof()
+            return lines, None
+        return lines, transport
@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import routing_table
+import topologies
+from node import INFINITY
+from simulator import Simulator
+
+DEFAULT_TOPOLOGIES = ['ring', 'grid', 'tree', 'random', 'scale-free']
+DEFAULT_SIZES = [16, 64]
+# a scenario regresses when one of these grows by more than the --tolerance fraction
+COMPARED_METRICS = ['rounds', 'messages', 'bytes', 'peak_table_bytes', 'virtual_time']
+
+
+class Benchmark:
+    """
+    Drives a Simulator through bring-up, a link going down and coming back, and a node quitting and
+    restarting from its snapshot, recording what each of these costs the control plane until the
+    network has converged again.
+    """
+
+    def __init__(self, kind, size, seed=0, incremental_updates=True, infinity=None, link_state=False, summarize=True):
+        """
+        :param infinity: defaults to the larger of INFINITY and size + 1 so that no path is too long to advertise
+        """
+        self.kind = kind
+        self.seed = seed
+        self.names, self.links = topologies.generate(kind, size, seed)
+        self.options = {
+            'incremental_updates': incremental_updates,
+            'infinity': infinity if infinity is not None else max(INFINITY, len(self.names) + 1),
+            'link_state': link_state,
+            'summarize': summarize,
+        }
+        self.simulator = None
+
+    def run(self):
+        results = [self._measure('bring_up', self._bring_up)]
+        if self.links:
+            a, b = self._pick_link()
+            results.append(self._measure('link_down', lambda: self.simulator.link_down(a, b)))
+            results.append(self._measure('link_up', lambda: self.simulator.link_up(a, b)))
+        if len(self.names) > 1:
+            name = self._pick_node()
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, f"{name}.snapshot")
+                self.simulator.nodes[name].snapshot_path = path
+                results.append(self._measure('node_quit', lambda: self.simulator.remove_node(name)))
+                results.append(self._measure('node_restart',
+                                             lambda: self.simulator.restart_node(name, snapshot_path=path)))
+        return results
+
+    def _bring_up(self):
+        self.simulator = Simulator(self.names, self.links, seed=self.seed, **self.options)
+
+    def _pick_link(self):
+        # the middle link in generation order: away from the root of a tree and the hub of a scale-free graph
+        return self.links[len(self.links) // 2]
+
+    def _pick_node(self):
+        return self.names[len(self.names) // 2]
+
+    def _measure(self, scenario, action):
+        if self.simulator is not None:
+            self.simulator.reset_stats()
+            started_at = self.simulator.clock.now
+        else:
+            started_at = 0.0
+        wall_started_at = time.perf_counter()
+        action()
+        events = self.simulator.run_until_quiet()
+        wall_time = time.perf_counter() - wall_started_at
+
+        stats = self.simulator.stats
+        return {
+            'topology': self.kind,
+            'nodes': len(self.names),
+            'links': len(self.links),
+            'seed': self.seed,
+            'incremental_updates': self.options['incremental_updates'],
+            'link_state': self.options['link_state'],
+            'summarize': self.options['summarize'],
+            # tables are merged with numpy when it is installed, and by a merge join in Python otherwise
+            'merge': 'vectorized' if routing_table.numpy is not None else 'merge_join',
+            'scenario': scenario,
+            'converged': self.simulator.is_converged(),
+            'virtual_time': round(self.simulator.clock.now - started_at, 6),
+            'wall_time': round(wall_time, 6),
+            'events': events,
+            'rounds': stats.rounds,
+            'messages': stats.messages,
+            'bytes': stats.bytes,
+            'peak_table_bytes': stats.peak_table_bytes,
+        }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: a description of every metric that grew by more than tolerance over the baseline,
+             and of every scenario that no longer converges
+    """
+    def key(result):
+        return result['topology'], result['nodes'], result['seed'], result['incremental_updates'], \
+            result.get('link_state', False), result.get('summarize', True), result['scenario']
+
+    baseline_by_key = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(key(result))
+        if previous is None:
+            continue
+        name = "{} n={} {}".format(result['topology'], result['nodes'], result['scenario'])
+        if previous['converged'] and not result['converged']:
+            regressions.append(f"{name}: no longer converges")
+        for metric in COMPARED_METRICS:
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {result[metric]}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="py benchmark.py [options]")
+    parser.add_argument("--topologies", nargs="+", default=DEFAULT_TOPOLOGIES, choices=list(topologies.GENERATORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help="node counts to generate every topology at")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--full-table-updates", action="store_true")
+    parser.add_argument("--infinity", type=int, default=None)
+    parser.add_argument("--link-state", action="store_true")
+    parser.add_argument("--no-summarize", action="store_true")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--compare", help="a previous --output file to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="the fraction a metric may grow over the --compare baseline")
+    options = parser.parse_args()
+
+    results = []
+    for kind in options.topologies:
+        for size in options.sizes:
+            results.extend(Benchmark(kind, size, seed=options.seed,
+                                     incremental_updates=not options.full_table_updates,
+                                     infinity=options.infinity,
+                                     link_state=options.link_state,
+                                     summarize=not options.no_summarize).run())
+
+    print("Merging routing tables " + (f"with numpy {routing_table.numpy.__version__}"
+                                       if routing_table.numpy is not None else "in Python: numpy is not installed"),
+          file=sys.stderr)
+    output = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        exit(1 if regressions else 0)
@@ -0,0 +1,311 @@
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+from multiprocessing import shared_memory
+
+from fib import ADDRESS_BITS, PrefixTrie, ip_to_int
+from ip import IPHeader
+from log import forwarding_log
+from multipath import MAX_PATHS
+from protocols import DATA_PROTOCOLS
+
+# the most routes the shared forwarding table holds; workers hand packets for the others to the control process
+DEFAULT_CAPACITY = 1 << 16
+# packets a worker hands to the control process are prefixed with the address they came from
+SENDER_FORMAT = struct.Struct('!4sH')
+MAX_DATAGRAM_SIZE = 1 << 16
+# seconds a worker waits for a packet before checking that the control process is still alive
+WORKER_POLL_INTERVAL = 1.0
+NO_HOP = 0xFF
+
+
+class SharedForwardingTable:
+    """
+    A copy of the ForwardingTable in shared memory, written by the control process and read by the
+    workers. Writes are guarded by a sequence lock: the sequence is odd while the table is being
+    rewritten, and a reader that sees it change while copying the table starts over. Readers never
+    block the writer, so routes can be recomputed while the workers keep forwarding.
+
+    Layout, in native byte order: sequence and route count, then per-worker counters, then the
+    destination addresses, prefix lengths and up to max_paths next hops (interface indexes) per route.
+    """
+
+    HEADER_FORMAT = struct.Struct('=QI4x')
+    COUNTER_NAMES = ('received', 'forwarded', 'punted', 'punts_dropped')
+    COUNTERS_FORMAT = struct.Struct(f'={len(COUNTER_NAMES)}Q')
+
+    def __init__(self, capacity, workers, max_paths=MAX_PATHS, name=None):
+        """
+        :param name: the shared memory block to attach to; a new one is created if None
+        """
+        self.capacity = capacity
+        self.workers = workers
+        self.max_paths = max_paths
+        counters_size = workers * SharedForwardingTable.COUNTERS_FORMAT.size
+        size = SharedForwardingTable.HEADER_FORMAT.size + counters_size + capacity * (4 + 1 + max_paths)
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        buffer = self.memory.buf
+        offset = SharedForwardingTable.HEADER_FORMAT.size
+        self._counters_offset = offset
+        offset += counters_size
+        self.destinations = buffer[offset:offset + 4 * capacity].cast('I')
+        offset += 4 * capacity
+        self.lengths = buffer[offset:offset + capacity]
+        offset += capacity
+        self.hops = buffer[offset:offset + capacity * max_paths]
+        self.sequence = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def read_sequence(self):
+        return SharedForwardingTable.HEADER_FORMAT.unpack_from(self.memory.buf)[0]
+
+    def write(self, routes, interface_index):
+        """
+        :param routes: (address as int, prefix length, Interface or tuple of Interfaces) of every route
+        :param interface_index: maps an interface's my_virt_ip to the index the workers know it by
+        :return: the number of routes written, which is less than len(routes) if the table is full
+        """
+        count = min(len(routes), self.capacity)
+        self.sequence += 1
+        SharedForwardingTable.HEADER_FORMAT.pack_into(self.memory.buf, 0, self.sequence, 0)
+        hops = bytearray([NO_HOP]) * (count * self.max_paths)
+        for slot, (address, length, interfaces) in enumerate(routes[:count]):
+            self.destinations[slot] = address
+            self.lengths[slot] = length
+            if type(interfaces) is not tuple:
+                interfaces = interfaces,
+            for path, interface in enumerate(interfaces[:self.max_paths]):
+                hops[slot * self.max_paths + path] = interface_index[interface.my_virt_ip]
+        self.hops[:len(hops)] = hops
+        self.sequence += 1
+        SharedForwardingTable.HEADER_FORMAT.pack_into(self.memory.buf, 0, self.sequence, count)
+        return count
+
+    def read(self):
+        """
+        :return: the sequence the copy was taken at and (address, length, tuple of interface indexes) of every route
+        """
+        while True:
+            sequence, count = SharedForwardingTable.HEADER_FORMAT.unpack_from(self.memory.buf)
+            if sequence & 1:
+                os.sched_yield()
+                continue
+            destinations = self.destinations[:count].tolist()
+            lengths = bytes(self.lengths[:count])
+            hops = bytes(self.hops[:count * self.max_paths])
+            if self.read_sequence() == sequence:
+                break
+        routes = []
+        for slot, address in enumerate(destinations):
+            paths = hops[slot * self.max_paths:(slot + 1) * self.max_paths]
+            routes.append((address, lengths[slot], tuple(index for index in paths if index != NO_HOP)))
+        return sequence, routes
+
+    def counters(self, worker):
+        return SharedForwardingTable.COUNTERS_FORMAT.unpack_from(self.memory.buf, self._counters_offset
+                                                                 + worker * SharedForwardingTable.COUNTERS_FORMAT.size)
+
+    def write_counters(self, worker, values):
+        SharedForwardingTable.COUNTERS_FORMAT.pack_into(self.memory.buf, self._counters_offset
+                                                        + worker * SharedForwardingTable.COUNTERS_FORMAT.size, *values)
+
+    def close(self):
+        # the memoryviews into the block must be gone before it can be closed
+        self.destinations.release()
+        self.lengths.release()
+        self.hops.release()
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+class DataPlane:
+    """
+    A pool of worker processes forwarding data packets for a Node. Every worker binds its own socket
+    to the node's link port with SO_REUSEPORT, so the kernel spreads arriving datagrams over the
+    workers and the node's own socket by sender. Workers forward data packets for other nodes from
+    their copy of the SharedForwardingTable, and hand everything else (routing protocols, packets
+    for this node, destinations they have no route for) to the control process over a datagram socket.
+    """
+
+    def __init__(self, address, interfaces, fib, workers, capacity=DEFAULT_CAPACITY, max_paths=MAX_PATHS):
+        self.address = address
+        self.interfaces = interfaces
+        self.fib = fib
+        self._interface_index = {interface.my_virt_ip: index for index, interface in enumerate(interfaces)}
+        self.table = SharedForwardingTable(capacity, workers, max_paths)
+        self._published_version = None
+        self.truncated = False
+        self._control_socket, self._worker_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._control_socket.setblocking(False)
+        self.processes = [multiprocessing.Process(target=_run_worker, name=f"forwarding-worker-{index}", daemon=True,
+                                                  args=(index, self.table.name, capacity, workers, max_paths,
+                                                        address.to_tuple(),
+                                                        [interface.addr.to_tuple() for interface in interfaces],
+                                                        [interface.my_virt_ip for interface in interfaces],
+                                                        self._worker_socket))
+                          for index in range(workers)]
+
+    def start(self):
+        self.publish()
+        for process in self.processes:
+            process.start()
+        # only the workers send on this end
+        self._worker_socket.close()
+
+    def fileno(self):
+        return self._control_socket.fileno()
+
+    def publish(self):
+        """
+        Copies the forwarding table to shared memory if it changed since the last call.
+        """
+        if self.fib.version == self._published_version:
+            return
+        self._published_version = self.fib.version
+        routes = [(ip_to_int(destination), ADDRESS_BITS, interfaces) for destination, interfaces in self.fib.hosts.items()]
+        routes.extend(self.fib.prefixes.items())
+        written = self.table.write(routes, self._interface_index)
+        if written < len(routes) and not self.truncated:
+            forwarding_log.warning("Shared forwarding table holds %d of %d routes; workers hand the rest to the "
+                                   "control process", written, len(routes))
+        self.truncated = written < len(routes)
+
+    def receive(self):
+        """
+        :return: a packet a worker handed over and the (host, port) it came from, or None if there is none
+        """
+        try:
+            data = self._control_socket.recv(MAX_DATAGRAM_SIZE)
+        except BlockingIOError:
+            return None
+        host, port = SENDER_FORMAT.unpack_from(data)
+        return data[SENDER_FORMAT.size:], (socket.inet_ntoa(host), port)
+
+    def stats(self):
+        return [dict(zip(SharedForwardingTable.COUNTER_NAMES, self.table.counters(index)),
+                     alive=process.is_alive())
+                for index, process in enumerate(self.processes)]
+
+    def stop(self):
+        started = [process for process in self.processes if process.pid is not None]
+        for process in started:
+            if process.is_alive():
+                process.terminate()
+        for process in started:
+            process.join(timeout=1.0)
+        self._control_socket.close()
+        self.table.close()
+        self.table.unlink()
+
+
+def _run_worker(index, table_name, capacity, workers, max_paths, address, interface_addresses, local_ips,
+                control_socket):
+    # Ctrl-C at the prompt is for the control process, which stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    table = SharedForwardingTable(capacity, workers, max_paths, name=table_name)
+    link_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    link_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    link_socket.bind(address)
+    link_socket.settimeout(WORKER_POLL_INTERVAL)
+    control_socket.setblocking(False)
+    try:
+        Worker(index, table, link_socket, control_socket, interface_addresses, local_ips).run()
+    finally:
+        table.close()
+
+
+class Worker:
+    """
+    Forwarding loop of one DataPlane process.
+    """
+
+    def __init__(self, index, table, link_socket, control_socket, interface_addresses, local_ips):
+        self.index = index
+        self.table = table
+        self.link_socket = link_socket
+        self.control_socket = control_socket
+        self.interface_addresses = interface_addresses
+        self.local_addresses = frozenset(socket.inet_aton(ip) for ip in local_ips)
+        self.parent = os.getppid()
+        self.sequence = None
+        # packed destination address -> link address, or a list of them for equal-cost next hops
+        self.hosts = {}
+        self.prefixes = PrefixTrie()
+        self.received = 0
+        self.forwarded = 0
+        self.punted = 0
+        self.punts_dropped = 0
+
+    def run(self):
+        while os.getppid() == self.parent:
+            try:
+                packet_data, sender = self.link_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            self.received += 1
+            if not self._forward(memoryview(packet_data)):
+                self._punt(packet_data, sender)
+            # a handful of packets shows up in stats right away, not only after a burst or a quiet second
+            self._publish_counters()
+
+    def _forward(self, view):
+        """
+        :return: True if the packet was forwarded, False if the control process has to handle it
+        """
+        if not IPHeader.is_valid(view) or IPHeader.peek_protocol(view) not in DATA_PROTOCOLS:
+            return False
+        destination = bytes(view[IPHeader.DST_OFFSET:IPHeader.DST_OFFSET + 4])
+        if destination in self.local_addresses or IPHeader.peek_ttl(view) <= 1:
+            # the control process answers packets whose TTL runs out here
+            return False
+        if self.table.read_sequence() != self.sequence:
+            self._reload()
+        next_hop = self.hosts.get(destination)
+        if next_hop is None and self.prefixes.size:
+            next_hop = self.prefixes.longest_match(int.from_bytes(destination, 'big'))
+        if next_hop is None:
+            return False
+        if type(next_hop) is list:
+            next_hop = next_hop[IPHeader.peek_flow_hash(view) % len(next_hop)]
+        packet = bytearray(view)
+        IPHeader.decrement_ttl(packet)
+        self.link_socket.sendto(packet, next_hop)
+        self.forwarded += 1
+        return True
+
+    def _reload(self):
+        self.sequence, routes = self.table.read()
+        hosts = {}
+        prefixes = PrefixTrie()
+        for address, length, paths in routes:
+            if not paths:
+                continue
+            next_hop = self.interface_addresses[paths[0]] if len(paths) == 1 \
+                else [self.interface_addresses[path] for path in paths]
+            if length == ADDRESS_BITS:
+                hosts[address.to_bytes(4, 'big')] = next_hop
+            else:
+                prefixes.insert(address, length, next_hop)
+        self.hosts, self.prefixes = hosts, prefixes
+
+    def _punt(self, packet_data, sender):
+        try:
+            host = socket.inet_aton(sender[0])
+            self.control_socket.send(SENDER_FORMAT.pack(host, sender[1]) + packet_data)
+            self.punted += 1
+        except OSError:
+            # the control process is not keeping up; like a full socket buffer, the packet is lost
+            self.punts_dropped += 1
+
+    def _publish_counters(self):
+        self.table.write_counters(self.index, (self.received, self.forwarded, self.punted, self.punts_dropped))
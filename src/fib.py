@@ -0,0 +1,174 @@
+import socket
+import struct
+
+ADDRESS_BITS = 32
+
+
+def parse_prefix(prefix):
+    """
+    :param prefix: "a.b.c.d" for a host or "a.b.c.d/len" for a CIDR prefix
+    :return: the network address as an int (host bits cleared) and the prefix length
+    """
+    address, _, length = prefix.partition('/')
+    length = int(length) if length else ADDRESS_BITS
+    if not 0 <= length <= ADDRESS_BITS:
+        raise ValueError(f"bad prefix length in {prefix}")
+    mask = (0xFFFFFFFF << (ADDRESS_BITS - length)) & 0xFFFFFFFF
+    return ip_to_int(address) & mask, length
+
+
+def ip_to_int(address):
+    return struct.unpack('!I', socket.inet_aton(address))[0]
+
+
+def int_to_ip(address):
+    return socket.inet_ntoa(struct.pack('!I', address))
+
+
+class PrefixTrie:
+    """
+    Binary trie over address bits. Every node is a list [zero child, one child, value].
+    Longest-prefix match walks at most ADDRESS_BITS nodes whatever the number of prefixes.
+    """
+
+    ZERO, ONE, VALUE = 0, 1, 2
+
+    def __init__(self):
+        self.root = [None, None, None]
+        self.size = 0
+
+    def insert(self, address, length, value):
+        node = self.root
+        for bit_index in range(length):
+            bit = (address >> (ADDRESS_BITS - 1 - bit_index)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[PrefixTrie.VALUE] is None:
+            self.size += 1
+        node[PrefixTrie.VALUE] = value
+
+    def remove(self, address, length):
+        path = [self.root]
+        node = self.root
+        for bit_index in range(length):
+            node = node[(address >> (ADDRESS_BITS - 1 - bit_index)) & 1]
+            if node is None:
+                return
+            path.append(node)
+        if node[PrefixTrie.VALUE] is None:
+            return
+        node[PrefixTrie.VALUE] = None
+        self.size -= 1
+        # prune the branch that no longer leads to any value
+        for depth in range(length, 0, -1):
+            node = path[depth]
+            if node[PrefixTrie.ZERO] is not None or node[PrefixTrie.ONE] is not None \
+                    or node[PrefixTrie.VALUE] is not None:
+                break
+            path[depth - 1][(address >> (ADDRESS_BITS - depth)) & 1] = None
+
+    def longest_match(self, address):
+        node = self.root
+        best = node[PrefixTrie.VALUE]
+        for bit_index in range(ADDRESS_BITS):
+            node = node[(address >> (ADDRESS_BITS - 1 - bit_index)) & 1]
+            if node is None:
+                break
+            if node[PrefixTrie.VALUE] is not None:
+                best = node[PrefixTrie.VALUE]
+        return best
+
+    def items(self):
+        """
+        :return: (address, length, value) of every prefix in the trie
+        """
+        stack = [(self.root, 0, 0)]
+        while stack:
+            node, address, length = stack.pop()
+            if node[PrefixTrie.VALUE] is not None:
+                yield address, length, node[PrefixTrie.VALUE]
+            for bit in (PrefixTrie.ONE, PrefixTrie.ZERO):
+                if node[bit] is not None:
+                    stack.append((node[bit], address | (bit << (ADDRESS_BITS - 1 - length)), length + 1))
+
+    def clear(self):
+        self.root = [None, None, None]
+        self.size = 0
+
+
+class ForwardingTable:
+    """
+    Forwarding information base built from a RoutingTable, which it observes so that every route
+    change is applied as it happens. Host routes are answered from a dict; everything else falls
+    back to longest-prefix match in the trie. A destination with several equal-cost next hops maps
+    to a tuple of Interfaces, of which lookup() picks one by flow hash.
+    """
+
+    def __init__(self, resolve_interface, infinity):
+        """
+        :param resolve_interface: maps a route's forwarding_interface (a local virtual ip) to its Interface
+        :param infinity: routes at this distance are unreachable and kept out of the table
+        """
+        self.resolve_interface = resolve_interface
+        self.infinity = infinity
+        self.hosts = {}
+        self.prefixes = PrefixTrie()
+        # incremented on every change, so copies of the table can tell when they are stale
+        self.version = 0
+
+    def route_changed(self, destination, routing_table_item):
+        if routing_table_item.distance >= self.infinity:
+            self.route_removed(destination)
+            return
+        self._install(destination, self.resolve_interface(routing_table_item.forwarding_interface))
+
+    def set_next_hops(self, destination, forwarding_interfaces):
+        """
+        :param forwarding_interfaces: the my_virt_ip of every interface to spread destination's traffic over
+        """
+        interfaces = tuple(interface for interface in map(self.resolve_interface, forwarding_interfaces)
+                           if interface is not None)
+        if not interfaces:
+            return
+        self._install(destination, interfaces[0] if len(interfaces) == 1 else interfaces)
+
+    def _install(self, destination, interface):
+        self.version += 1
+        if '/' not in destination:
+            self.hosts[destination] = interface
+            return
+        address, length = parse_prefix(destination)
+        if length == ADDRESS_BITS:
+            self.hosts[int_to_ip(address)] = interface
+        else:
+            self.prefixes.insert(address, length, interface)
+
+    def route_removed(self, destination):
+        self.version += 1
+        if '/' not in destination:
+            self.hosts.pop(destination, None)
+            return
+        address, length = parse_prefix(destination)
+        if length == ADDRESS_BITS:
+            self.hosts.pop(int_to_ip(address), None)
+        else:
+            self.prefixes.remove(address, length)
+
+    def lookup(self, destination_ip, flow_hash=0):
+        """
+        :param flow_hash: picks one of several equal-cost next hops, so a flow always takes the same one
+        :return: the Interface to forward to, or None if no route covers destination_ip
+        """
+        interface = self.hosts.get(destination_ip)
+        if interface is None and self.prefixes.size:
+            try:
+                interface = self.prefixes.longest_match(ip_to_int(destination_ip))
+            except OSError:
+                return None
+        if type(interface) is tuple:
+            return interface[flow_hash % len(interface)]
+        return interface
+
+    def __len__(self):
+        return len(self.hosts) + self.prefixes.size
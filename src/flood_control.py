@@ -0,0 +1,94 @@
+import random
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+# seconds an event is remembered; longer than any flood takes to cross the network
+EVENT_TTL = 60
+# the most events remembered at once; the oldest are forgotten first
+MAX_EVENTS = 4096
+
+
+class FloodControl:
+    """
+    Decides whether an event flooded through the network (an interface going up or down) is new to
+    this node. Every event carries the router id of the node it happened at and a sequence number
+    that node gave it, and is remembered by that pair until it is EVENT_TTL old or MAX_EVENTS newer
+    ones have been seen. An event that comes back within that time is a duplicate and is neither
+    acted upon nor passed on again.
+    """
+
+    # origin router id, sequence number
+    EVENT_FORMAT = struct.Struct('!4sI')
+
+    def __init__(self, origin, clock=time.monotonic, ttl=EVENT_TTL, capacity=MAX_EVENTS):
+        """
+        :param origin: the router id of this node, which its own events carry
+        """
+        self.origin = origin
+        self.clock = clock
+        self.ttl = ttl
+        self.capacity = capacity
+        # a restarted node must not reuse the sequence numbers its neighbors still remember
+        self._next_sequence = random.getrandbits(32)
+        # (origin, sequence[, via]) -> expiry time, oldest first since every event lives ttl seconds
+        self._seen = OrderedDict()
+        self.duplicates = 0
+        self.evictions = 0
+
+    def originate(self):
+        """
+        :return: (origin, sequence) of a new event happening at this node, already marked as seen
+        """
+        event = (self.origin, self._next_sequence)
+        self._next_sequence = (self._next_sequence + 1) & 0xFFFFFFFF
+        self.is_new(*event)
+        return event
+
+    def is_new(self, origin, sequence, via=None):
+        """
+        Records the event as seen.
+        :param via: for an event that is acted upon once per link rather than once per node, the
+                    link it arrived over
+        :return: True if it was not seen within the last ttl seconds
+        """
+        now = self.clock()
+        self._expire(now)
+        key = (origin, sequence) if via is None else (origin, sequence, via)
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+        if len(self._seen) >= self.capacity:
+            self._seen.popitem(last=False)
+            self.evictions += 1
+        self._seen[key] = now + self.ttl
+        return True
+
+    def _expire(self, now):
+        while self._seen:
+            key, expires_at = next(iter(self._seen.items()))
+            if expires_at > now:
+                break
+            del self._seen[key]
+
+    def __len__(self):
+        return len(self._seen)
+
+    @staticmethod
+    def pack_event(origin, sequence):
+        return FloodControl.EVENT_FORMAT.pack(socket.inet_aton(origin), sequence)
+
+    @staticmethod
+    def unpack_event(buffer):
+        """
+        :return: (origin, sequence) of an event packed at the start of buffer and the number of bytes it took
+        """
+        if len(buffer) < FloodControl.EVENT_FORMAT.size:
+            raise ValueError("truncated event")
+        origin, sequence = FloodControl.EVENT_FORMAT.unpack_from(buffer)
+        return (socket.inet_ntoa(origin), sequence), FloodControl.EVENT_FORMAT.size
+
+    def as_dict(self):
+        self._expire(self.clock())
+        return {'remembered': len(self._seen), 'duplicates': self.duplicates, 'evictions': self.evictions}
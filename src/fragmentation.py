@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+
+from ip import IPHeader
+
+
+class PartialDatagram:
+    __slots__ = ('first_seen', 'fragments', 'size', 'total_length')
+
+    def __init__(self, first_seen):
+        self.first_seen = first_seen
+        self.fragments = {}
+        self.size = 0
+        self.total_length = None
+
+    def add(self, offset, payload, is_last):
+        """
+        :return: True if the fragment was added, False if it repeats one already held
+        :raise ValueError: if it overlaps a held fragment without repeating it, or disagrees on where the datagram ends
+        """
+        end = offset + len(payload)
+        if self.fragments.get(offset) == payload:
+            return False
+        # as in RFC 5722, overlapping fragments are never merged: they could hide different contents
+        if any(start < end and offset < start + len(held) for start, held in self.fragments.items()):
+            raise ValueError("overlapping fragment")
+        if self.total_length is not None and (is_last or end > self.total_length) \
+                or is_last and any(start + len(held) > end for start, held in self.fragments.items()):
+            raise ValueError("fragment disagrees on where the datagram ends")
+        self.fragments[offset] = payload
+        self.size += len(payload)
+        if is_last:
+            self.total_length = offset + len(payload)
+        return True
+
+    def is_complete(self):
+        return self.total_length is not None and self.size == self.total_length
+
+    def assemble(self):
+        return b"".join(self.fragments[offset] for offset in sorted(self.fragments))
+
+
+class Reassembler:
+    DEFAULT_MAX_BUFFERED_BYTES = 1 << 20
+    DEFAULT_TIMEOUT = 30.0
+
+    def __init__(self, max_buffered_bytes=DEFAULT_MAX_BUFFERED_BYTES, timeout=DEFAULT_TIMEOUT, clock=time.monotonic):
+        self.max_buffered_bytes = max_buffered_bytes
+        self.timeout = timeout
+        self.clock = clock
+        # (src, dst, protocol, identification) -> PartialDatagram, oldest first
+        self.pending = OrderedDict()
+        self.buffered_bytes = 0
+
+        self.reassembled = 0
+        self.dropped_fragments = 0
+        self.timed_out_datagrams = 0
+        self.evicted_datagrams = 0
+        self.overlapping_datagrams = 0
+
+    def add(self, header, payload):
+        """
+        :param header: the IPHeader of a fragment
+        :param payload: the fragment's payload
+        :return: the payload of the whole datagram once its last missing fragment arrives, otherwise None
+        """
+        now = self.clock()
+        self.expire(now)
+
+        if len(payload) > self.max_buffered_bytes \
+                or header.fragment_offset + len(payload) > IPHeader.MAX_TOTAL_LENGTH - IPHeader.LENGTH \
+                or (header.more_fragments and len(payload) % 8):
+            self.dropped_fragments += 1
+            return None
+
+        key = (header.src_addr, header.dst_addr, header.protocol, header.identification)
+        datagram = self.pending.get(key)
+        if datagram is None:
+            datagram = self.pending[key] = PartialDatagram(now)
+
+        try:
+            added = datagram.add(header.fragment_offset, payload, not header.more_fragments)
+        except ValueError:
+            # the whole datagram goes, since which of the overlapping fragments is genuine cannot be told
+            self.dropped_fragments += len(datagram.fragments) + 1
+            self.overlapping_datagrams += 1
+            self._discard(key)
+            return None
+        if not added:
+            self.dropped_fragments += 1
+            return None
+        self.buffered_bytes += len(payload)
+
+        if datagram.is_complete():
+            self._discard(key)
+            self.reassembled += 1
+            return datagram.assemble()
+
+        while self.buffered_bytes > self.max_buffered_bytes:
+            oldest_key = next(iter(self.pending))
+            self.dropped_fragments += len(self.pending[oldest_key].fragments)
+            self.evicted_datagrams += 1
+            self._discard(oldest_key)
+        return None
+
+    def expire(self, now=None):
+        now = self.clock() if now is None else now
+        while self.pending:
+            key, datagram = next(iter(self.pending.items()))
+            if now - datagram.first_seen < self.timeout:
+                break
+            self.dropped_fragments += len(datagram.fragments)
+            self.timed_out_datagrams += 1
+            self._discard(key)
+
+    def _discard(self, key):
+        self.buffered_bytes -= self.pending.pop(key).size
@@ -1,19 +1,191 @@
+import socket
+import struct
+import zlib
+
+from protocols import FLOW_ID_PROTOCOLS, FLOW_ID_SIZE
+
+
+class MalformedPacketError(ValueError):
+    pass
+
+
 class IPHeader:
 
     ROUTING_PROTOCOL = 200
     PRINT_PROTOCOL = 0
 
-    def __init__(self, src_ip, dest_ip, protocol):
-        self.version = 4
+    VERSION = 4
+    DEFAULT_TTL = 16
+    # version/ihl, tos, total length, identification, flags/fragment offset, ttl, protocol, checksum, src, dst
+    FORMAT = struct.Struct('!BBHHHBBH4s4s')
+    LENGTH = FORMAT.size
+    MORE_FRAGMENTS = 0x2000
+    FRAGMENT_OFFSET_MASK = 0x1FFF
+    MAX_TOTAL_LENGTH = 0xFFFF
+    MAX_PROTOCOL = 0xFF
+    FLAGS_OFFSET = 6
+    TTL_OFFSET = 8
+    PROTOCOL_OFFSET = 9
+    CHECKSUM_OFFSET = 10
+    SRC_OFFSET = 12
+    DST_OFFSET = 16
+
+    def __init__(self, src_ip, dest_ip, protocol, ttl=DEFAULT_TTL,
+                 identification=0, more_fragments=False, fragment_offset=0):
+        self.version = IPHeader.VERSION
         self.protocol = protocol
         self.src_addr = src_ip
         self.dst_addr = dest_ip
+        self.ttl = ttl
+        self.identification = identification
+        self.more_fragments = more_fragments
+        # in bytes; always a multiple of 8 on the wire
+        self.fragment_offset = fragment_offset
+
+    @property
+    def is_fragment(self):
+        return self.more_fragments or self.fragment_offset > 0
 
     def set_protocol(self, protocol):
         self.protocol = protocol
 
+    def pack(self, payload_length):
+        header = bytearray(IPHeader.FORMAT.pack((self.version << 4) | (IPHeader.LENGTH // 4),
+                                                0,
+                                                IPHeader.LENGTH + payload_length,
+                                                self.identification,
+                                                (IPHeader.MORE_FRAGMENTS if self.more_fragments else 0)
+                                                | (self.fragment_offset // 8),
+                                                self.ttl,
+                                                int(self.protocol),
+                                                0,
+                                                socket.inet_aton(self.src_addr),
+                                                socket.inet_aton(self.dst_addr)))
+        struct.pack_into('!H', header, 10, IPHeader.checksum(header))
+        return header
+
+    @classmethod
+    def unpack(cls, buffer):
+        if len(buffer) < cls.LENGTH:
+            raise MalformedPacketError(f"packet too short ({len(buffer)} bytes)")
+        version_ihl, _, total_length, identification, fragment, ttl, protocol, _, src, dst = \
+            cls.FORMAT.unpack_from(buffer)
+        if version_ihl >> 4 != cls.VERSION:
+            raise MalformedPacketError(f"unsupported IP version {version_ihl >> 4}")
+        if cls.checksum(buffer[:cls.LENGTH]) != 0:
+            raise MalformedPacketError("bad header checksum")
+        if total_length != len(buffer):
+            raise MalformedPacketError(f"length mismatch ({total_length} != {len(buffer)})")
+        return cls(socket.inet_ntoa(src), socket.inet_ntoa(dst), protocol, ttl=ttl,
+                   identification=identification,
+                   more_fragments=bool(fragment & cls.MORE_FRAGMENTS),
+                   fragment_offset=(fragment & cls.FRAGMENT_OFFSET_MASK) * 8)
+
+    @staticmethod
+    def checksum(header):
+        """
+        :param header: the header bytes, with or without a checksum filled in
+        :return: the internet checksum; zero when verifying a header that already carries a valid one
+        """
+        total = sum(struct.unpack(f'!{len(header) // 2}H', header))
+        while total >> 16:
+            total = (total & 0xFFFF) + (total >> 16)
+        return ~total & 0xFFFF
+
+    @staticmethod
+    def peek_protocol(view):
+        return view[IPHeader.PROTOCOL_OFFSET]
+
+    @staticmethod
+    def peek_ttl(view):
+        return view[IPHeader.TTL_OFFSET]
+
+    @staticmethod
+    def decrement_ttl(packet):
+        """
+        Decrements the TTL of a packed header in place, updating the checksum incrementally (RFC 1624):
+        the TTL is the high byte of its 16-bit word, so the checksum grows by 0x100 in one's complement.
+        :param packet: a bytearray starting with a valid header whose TTL is at least 1
+        """
+        packet[IPHeader.TTL_OFFSET] -= 1
+        checksum = int.from_bytes(packet[IPHeader.CHECKSUM_OFFSET:IPHeader.CHECKSUM_OFFSET + 2], 'big') + 0x100
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        packet[IPHeader.CHECKSUM_OFFSET:IPHeader.CHECKSUM_OFFSET + 2] = checksum.to_bytes(2, 'big')
+
+    @staticmethod
+    def peek_destination(view):
+        return socket.inet_ntoa(view[IPHeader.DST_OFFSET:IPHeader.DST_OFFSET + 4])
+
+    @staticmethod
+    def flow_hash(src_ip, dest_ip, protocol, payload=b""):
+        """
+        :param payload: the payload of an unfragmented packet, whose flow id is hashed too if the protocol has one
+        :return: a hash of (src, dst, protocol, flow id) that is the same for every packet of a flow
+        """
+        key = socket.inet_aton(src_ip) + socket.inet_aton(dest_ip)
+        if protocol in FLOW_ID_PROTOCOLS:
+            key += bytes(payload[:FLOW_ID_SIZE])
+        return zlib.crc32(key, protocol)
+
+    @staticmethod
+    def peek_flow_hash(view):
+        protocol = view[IPHeader.PROTOCOL_OFFSET]
+        # the payload follows the destination; a fragment is hashed without it, as its flow id may be elsewhere
+        end = IPHeader.DST_OFFSET + 4
+        if protocol in FLOW_ID_PROTOCOLS \
+                and not int.from_bytes(view[IPHeader.FLAGS_OFFSET:IPHeader.TTL_OFFSET], 'big') \
+                & (IPHeader.MORE_FRAGMENTS | IPHeader.FRAGMENT_OFFSET_MASK):
+            end += FLOW_ID_SIZE
+        return zlib.crc32(view[IPHeader.SRC_OFFSET:end], protocol)
+
+    @staticmethod
+    def is_valid(view):
+        return (len(view) >= IPHeader.LENGTH
+                and view[0] >> 4 == IPHeader.VERSION
+                and IPHeader.checksum(view[:IPHeader.LENGTH]) == 0)
+
 
 class IPPacket:
-    def __init__(self, src_ip, dest_ip, protocol_num, payload):
-        self.header = IPHeader(src_ip, dest_ip, protocol_num)
+    def __init__(self, src_ip, dest_ip, protocol_num, payload, ttl=IPHeader.DEFAULT_TTL):
+        self.header = IPHeader(src_ip, dest_ip, protocol_num, ttl=ttl)
         self.payload = payload
+
+    def to_bytes(self):
+        return bytes(self.header.pack(len(self.payload))) + self.payload
+
+    def to_fragments(self, mtu, identification):
+        """
+        Splits the packet into datagrams of at most mtu bytes each.
+        :param identification: the id shared by all fragments of this packet
+        :return: a list of packed datagrams; a single one if the packet already fits
+        """
+        if IPHeader.LENGTH + len(self.payload) <= mtu:
+            return [self.to_bytes()]
+        if IPHeader.LENGTH + len(self.payload) > IPHeader.MAX_TOTAL_LENGTH:
+            raise ValueError(f"payload of {len(self.payload)} bytes exceeds the maximum datagram size")
+
+        fragment_size = (mtu - IPHeader.LENGTH) // 8 * 8
+        payload = memoryview(self.payload)
+        fragments = []
+        for offset in range(0, len(payload), fragment_size):
+            chunk = payload[offset:offset + fragment_size]
+            header = IPHeader(self.header.src_addr, self.header.dst_addr, self.header.protocol,
+                              ttl=self.header.ttl,
+                              identification=identification,
+                              more_fragments=offset + fragment_size < len(payload),
+                              fragment_offset=offset)
+            fragments.append(bytes(header.pack(len(chunk))) + chunk)
+        return fragments
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        view = memoryview(buffer)
+        header = IPHeader.unpack(view)
+        packet = cls.__new__(cls)
+        packet.header = header
+        packet.payload = bytes(view[IPHeader.LENGTH:])
+        return packet
+
+    def __repr__(self):
+        return f"IPPacket({self.header.src_addr} -> {self.header.dst_addr}, " \
+               f"protocol={self.header.protocol}, ttl={self.header.ttl}, {len(self.payload)} bytes)"
@@ -0,0 +1,358 @@
+import heapq
+import random
+import socket
+import struct
+
+from fib import ip_to_int
+from routing_table import RoutingTableItem
+
+# seconds
+LSA_REFRESH_INTERVAL = 30
+# an LSA its origin stopped refreshing is dropped after this long
+LSA_MAX_AGE = 4 * LSA_REFRESH_INTERVAL
+LINK_COST = 1
+# updates carrying several LSAs are split so that each fits in one datagram
+MAX_UPDATE_BYTES = 1300
+
+
+class LinkStateAdvertisement:
+    # origin router id, sequence number, number of links
+    HEADER_FORMAT = struct.Struct('!4sIH')
+    # local address, peer address, cost
+    LINK_FORMAT = struct.Struct('!4s4sH')
+
+    def __init__(self, origin, sequence, links):
+        """
+        :param origin: the router id of the node that describes its links
+        :param links: {local virtual ip: (peer virtual ip, cost)} for every up interface of the origin
+        """
+        self.origin = origin
+        self.sequence = sequence
+        self.links = links
+
+    def to_bytes(self):
+        return LinkStateAdvertisement.HEADER_FORMAT.pack(socket.inet_aton(self.origin), self.sequence,
+                                                         len(self.links)) \
+               + b"".join(LinkStateAdvertisement.LINK_FORMAT.pack(socket.inet_aton(local_ip),
+                                                                  socket.inet_aton(peer_ip), cost)
+                          for local_ip, (peer_ip, cost) in sorted(self.links.items()))
+
+    @classmethod
+    def from_bytes(cls, buffer, offset=0):
+        """
+        :return: the LSA and the offset just past it
+        """
+        if len(buffer) < offset + cls.HEADER_FORMAT.size:
+            raise ValueError("truncated link state advertisement")
+        origin, sequence, count = cls.HEADER_FORMAT.unpack_from(buffer, offset)
+        offset += cls.HEADER_FORMAT.size
+        if len(buffer) < offset + count * cls.LINK_FORMAT.size:
+            raise ValueError("truncated link state advertisement")
+        links = {}
+        for _ in range(count):
+            local_ip, peer_ip, cost = cls.LINK_FORMAT.unpack_from(buffer, offset)
+            links[socket.inet_ntoa(local_ip)] = (socket.inet_ntoa(peer_ip), cost)
+            offset += cls.LINK_FORMAT.size
+        return cls(socket.inet_ntoa(origin), sequence, links), offset
+
+    @staticmethod
+    def pack_all(advertisements):
+        return struct.pack('!H', len(advertisements)) + b"".join(lsa.to_bytes() for lsa in advertisements)
+
+    @staticmethod
+    def unpack_all(buffer):
+        if len(buffer) < 2:
+            raise ValueError("truncated link state update")
+        count, = struct.unpack_from('!H', buffer)
+        offset = 2
+        advertisements = []
+        for _ in range(count):
+            lsa, offset = LinkStateAdvertisement.from_bytes(buffer, offset)
+            advertisements.append(lsa)
+        return advertisements
+
+    def __repr__(self):
+        return f"LSA({self.origin} #{self.sequence}, {len(self.links)} links)"
+
+
+class LinkState:
+    """
+    Link-state routing: every node floods a sequence-numbered LSA listing its up interfaces, keeps
+    the newest LSA of every node in its database, and computes shortest paths over the links both
+    ends advertise. The routes to the addresses of those links go into the node's RoutingTable.
+
+    Dijkstra is only rerun when a change can move the shortest-path tree: a new link that shortens
+    no path, or a lost link the tree does not use, only adds or removes the routes to that link's
+    two addresses.
+    """
+
+    def __init__(self, interfaces, routing_table, scheduler, send, infinity):
+        """
+        :param send: send(interface, payload) hands a link state update to one neighbor
+        :param infinity: routes at least this long are left out, as the forwarding table would drop them
+        """
+        self.interfaces = interfaces
+        self.routing_table = routing_table
+        self.scheduler = scheduler
+        self.send = send
+        self.infinity = infinity
+        # the lowest interface address identifies the node; it does not change when interfaces go down
+        self.router_id = min((interface.my_virt_ip for interface in interfaces), key=ip_to_int, default=None)
+        self.sequence = 0
+        # origin -> its newest LinkStateAdvertisement
+        self.database = {}
+        # origin -> timer dropping its LSA at LSA_MAX_AGE
+        self._expiry_timers = {}
+        # interface address -> the origin whose LSA lists it
+        self._owners = {}
+        # results of the last shortest-path computation, keyed by router id
+        self.distances = {self.router_id: 0}
+        # router -> (parent router, the parent's local address on the link to it)
+        self._parents = {}
+        # router -> the my_virt_ip of our interface on the way to it
+        self._first_hops = {self.router_id: None}
+        self.full_computations = 0
+        self.incremental_computations = 0
+
+    def start(self):
+        if self.router_id is None:
+            return
+        self.originate()
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        self.scheduler.call_later(LSA_REFRESH_INTERVAL * random.uniform(0.85, 1.0), self._refresh)
+
+    def _refresh(self):
+        self.originate()
+        self._schedule_refresh()
+
+    def originate(self, also_to=None, links=None):
+        """
+        Floods a new LSA describing our up interfaces.
+        :param also_to: an interface that is no longer up but must still hear the news
+        :param links: the links to advertise instead of those of the up interfaces
+        """
+        if self.router_id is None:
+            return
+        if links is None:
+            links = {interface.my_virt_ip: (interface.peer_virt_ip, LINK_COST)
+                     for interface in self.interfaces if interface.is_up}
+        self.sequence += 1
+        lsa = LinkStateAdvertisement(self.router_id, self.sequence, links)
+        self._install([lsa])
+        recipients = [interface for interface in self.interfaces if interface.is_up]
+        if also_to is not None and also_to not in recipients:
+            recipients.append(also_to)
+        for interface in recipients:
+            self._send_advertisements(interface, [lsa])
+
+    def withdraw(self):
+        """
+        Tells every neighbor we are leaving by flooding an LSA without links.
+        """
+        self.originate(links={})
+
+    def receive(self, payload, interface):
+        """
+        Handles a link state update that arrived on interface.
+        """
+        newer = []
+        for lsa in LinkStateAdvertisement.unpack_all(payload):
+            known = self.database.get(lsa.origin)
+            if lsa.origin == self.router_id:
+                if lsa.sequence > self.sequence or (lsa.sequence == self.sequence and known is not None
+                                                    and lsa.links != known.links):
+                    # our LSA from before a restart is still around; outnumber it
+                    self.sequence = lsa.sequence
+                    self.originate()
+                continue
+            if known is None or self._is_newer(lsa, known):
+                newer.append(lsa)
+            elif self._is_newer(known, lsa):
+                # the neighbor missed something; send it what we know
+                self._send_advertisements(interface, [known])
+        if not newer:
+            return
+        for other in self.interfaces:
+            if other.is_up and other is not interface:
+                self._send_advertisements(other, newer)
+        self._install(newer)
+
+    @staticmethod
+    def _is_newer(lsa, known):
+        if lsa.sequence != known.sequence:
+            return lsa.sequence > known.sequence
+        # one number for different links only happens when an origin restarts from an old sequence;
+        # as with OSPF's checksum rule, either copy may win as long as every node picks the same one
+        return lsa.links != known.links and lsa.to_bytes() > known.to_bytes()
+
+    def _send_advertisements(self, interface, advertisements):
+        batch = []
+        size = 0
+        for lsa in advertisements:
+            lsa_size = LinkStateAdvertisement.HEADER_FORMAT.size + len(lsa.links) * LinkStateAdvertisement.LINK_FORMAT.size
+            if batch and size + lsa_size > MAX_UPDATE_BYTES:
+                self.send(interface, LinkStateAdvertisement.pack_all(batch))
+                batch = []
+                size = 0
+            batch.append(lsa)
+            size += lsa_size
+        if batch:
+            self.send(interface, LinkStateAdvertisement.pack_all(batch))
+
+    def _install(self, advertisements):
+        changes = []
+        for lsa in advertisements:
+            previous = self.database.get(lsa.origin)
+            old_links = previous.links if previous is not None else {}
+            touched = set(old_links) | set(lsa.links)
+            before = {local_ip: self._link_is_up(lsa.origin, local_ip) for local_ip in touched}
+            for local_ip in old_links:
+                if self._owners.get(local_ip) == lsa.origin:
+                    del self._owners[local_ip]
+            self.database[lsa.origin] = lsa
+            for local_ip in lsa.links:
+                self._owners[local_ip] = lsa.origin
+            for local_ip in touched:
+                after = self._link_is_up(lsa.origin, local_ip)
+                if after != before[local_ip]:
+                    links = lsa.links if after else old_links
+                    peer_ip, cost = links[local_ip]
+                    changes.append((lsa.origin, local_ip, self._owners.get(peer_ip), peer_ip, cost, after))
+            if lsa.origin != self.router_id:
+                self._restart_expiry(lsa.origin)
+        if changes:
+            self._apply(changes)
+
+    def _restart_expiry(self, origin):
+        timer = self._expiry_timers.get(origin)
+        if timer is not None:
+            self.scheduler.cancel(timer)
+        self._expiry_timers[origin] = self.scheduler.call_later(LSA_MAX_AGE, self._expire, origin)
+
+    def _expire(self, origin):
+        del self._expiry_timers[origin]
+        lsa = self.database.get(origin)
+        if lsa is not None:
+            # installing an LSA without links takes all of the origin's links down, then it is forgotten
+            self._install([LinkStateAdvertisement(origin, lsa.sequence, {})])
+            self.scheduler.cancel(self._expiry_timers.pop(origin))
+            del self.database[origin]
+
+    def _link_is_up(self, origin, local_ip):
+        """
+        :return: True if origin lists local_ip and the owner of the peer address lists the way back
+        """
+        lsa = self.database.get(origin)
+        if lsa is None or local_ip not in lsa.links:
+            return False
+        peer_ip, _ = lsa.links[local_ip]
+        peer = self.database.get(self._owners.get(peer_ip))
+        return peer is not None and peer.links.get(peer_ip, (None,))[0] == local_ip
+
+    def _apply(self, changes):
+        """
+        :param changes: (router, local ip, peer router, peer ip, cost, is now up) for every link that came up or went down
+        """
+        if any(self._moves_tree(*change) for change in changes):
+            self._compute()
+        else:
+            self.incremental_computations += 1
+            for router, local_ip, peer, peer_ip, _, is_up in changes:
+                if is_up:
+                    self._set_route(local_ip, router)
+                    self._set_route(peer_ip, peer)
+                else:
+                    self._remove_route(local_ip)
+                    self._remove_route(peer_ip)
+        self._adjacencies_changed(changes)
+
+    def _moves_tree(self, router, local_ip, peer, peer_ip, cost, is_up):
+        if is_up:
+            unreachable = float('inf')
+            return (router in self.distances and self.distances[router] + cost < self.distances.get(peer, unreachable)) \
+                or (peer in self.distances and self.distances[peer] + cost < self.distances.get(router, unreachable))
+        return self._parents.get(peer) == (router, local_ip) or self._parents.get(router) == (peer, peer_ip)
+
+    def _compute(self):
+        """
+        Dijkstra from our own router over the links both ends advertise, then brings the routing
+        table in line with the result.
+        """
+        self.full_computations += 1
+        distances = {self.router_id: 0}
+        parents = {}
+        first_hops = {self.router_id: None}
+        heap = [(0, self.router_id)]
+        while heap:
+            distance, router = heapq.heappop(heap)
+            if distance > distances[router]:
+                continue
+            for local_ip, (peer_ip, cost) in self.database[router].links.items():
+                peer = self._owners.get(peer_ip)
+                if peer is None or not self._link_is_up(router, local_ip):
+                    continue
+                candidate = distance + cost
+                if peer not in distances or candidate < distances[peer]:
+                    distances[peer] = candidate
+                    parents[peer] = (router, local_ip)
+                    first_hops[peer] = local_ip if router == self.router_id else first_hops[router]
+                    heapq.heappush(heap, (candidate, peer))
+        self.distances, self._parents, self._first_hops = distances, parents, first_hops
+
+        wanted = {}
+        for router in distances:
+            for local_ip in self.database[router].links:
+                if self._link_is_up(router, local_ip):
+                    route = self._route(local_ip, router)
+                    if route is not None:
+                        wanted[local_ip] = route
+        for destination in [destination for destination in self.routing_table if destination not in wanted]:
+            del self.routing_table[destination]
+        for destination, (distance, forwarding_interface) in wanted.items():
+            current = self.routing_table.get(destination)
+            if current is None or current.distance != distance or current.forwarding_interface != forwarding_interface:
+                self.routing_table[destination] = RoutingTableItem(distance=distance,
+                                                                   forwarding_interface=forwarding_interface)
+
+    def _route(self, address, router):
+        """
+        :return: (distance, forwarding interface) of the route to address on router, or None if it is out of reach
+        """
+        distance = self.distances.get(router)
+        if distance is None or distance >= self.infinity:
+            return None
+        return distance, address if router == self.router_id else self._first_hops[router]
+
+    def _set_route(self, address, router):
+        route = self._route(address, router)
+        if route is None:
+            self._remove_route(address)
+            return
+        distance, forwarding_interface = route
+        self.routing_table[address] = RoutingTableItem(distance=distance, forwarding_interface=forwarding_interface)
+
+    def _remove_route(self, address):
+        if address in self.routing_table:
+            del self.routing_table[address]
+
+    def _adjacencies_changed(self, changes):
+        """
+        Sends the whole database to every neighbor whose link to us just came up, since it may have
+        missed any number of LSAs while the link was down.
+        """
+        if self.router_id is None:
+            return
+        for router, local_ip, peer, peer_ip, _, is_up in changes:
+            if not is_up:
+                continue
+            if router == self.router_id:
+                self._send_database(local_ip)
+            elif peer == self.router_id:
+                self._send_database(peer_ip)
+
+    def _send_database(self, local_ip):
+        for interface in self.interfaces:
+            if interface.my_virt_ip == local_ip and interface.is_up:
+                self._send_advertisements(interface, list(self.database.values()))
@@ -0,0 +1,163 @@
+import argparse
+import json
+import sys
+import time
+from collections import deque
+
+from metrics import Histogram
+from simulator import Simulator, parse_net_file
+
+DEFAULT_NET_FILE = '../nets/loop.net'
+# virtual seconds given to the last packets to arrive after the generator stops
+DRAIN_TIME = 1.0
+# a run regresses when one of these grows by more than the --tolerance fraction
+COMPARED_INCREASES = ['lost', 'reordered', 'forwarding_mean_us']
+# and when one of these shrinks by more than it
+COMPARED_DECREASES = ['forwarded_per_second']
+
+
+def farthest_pair(names, links):
+    """
+    :return: the two nodes with the most hops between them, the first in file order on ties
+    """
+    neighbors = {name: [] for name in names}
+    for a, b in links:
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    best = (-1, None, None)
+    for start in names:
+        hops = {start: 0}
+        frontier = deque([start])
+        while frontier:
+            name = frontier.popleft()
+            for peer in neighbors[name]:
+                if peer not in hops:
+                    hops[peer] = hops[name] + 1
+                    frontier.append(peer)
+        for name in names:
+            if hops.get(name, -1) > best[0]:
+                best = (hops[name], start, name)
+    return best[1], best[2]
+
+
+class LoadTest:
+    """
+    Converges a network from a .net file in the Simulator, then has one node send generated traffic
+    to another across it and reports what the sink saw and what forwarding cost the nodes in between.
+    The sink's one-way latency is in virtual time, so it grows with the path; the nodes' forwarding
+    latency and the forwarding rate are measured on the wall clock.
+    """
+
+    def __init__(self, net_file, rate, size, flows, duration, source=None, destination=None, **node_options):
+        self.net_file = net_file
+        self.names, self.links = parse_net_file(net_file)
+        if source is None or destination is None:
+            source, destination = farthest_pair(self.names, self.links)
+        self.source = source
+        self.destination = destination
+        self.rate = rate
+        self.size = size
+        self.flows = flows
+        self.duration = duration
+        self.node_options = node_options
+
+    def run(self):
+        simulator = Simulator(self.names, self.links, **self.node_options)
+        simulator.run_until_quiet()
+        # any address of the destination will do; the sink counts what reaches the node
+        destination_ip = simulator.nodes[self.destination].interfaces[0].my_virt_ip
+        simulator.reset_stats()
+        for node in simulator.nodes.values():
+            node.metrics.forwarding_latency = Histogram()
+
+        started_at = simulator.clock.now
+        wall_started_at = time.perf_counter()
+        output = simulator.command(self.source, f"traffic {destination_ip} {self.rate} {self.size} {self.flows} "
+                                                f"{self.duration}")
+        if not output.startswith("Sending"):
+            raise ValueError(f"{self.source} cannot send to {self.destination}: {output.strip()}")
+        simulator.run_until(started_at + self.duration + DRAIN_TIME)
+        simulator.run_until_quiet()
+        wall_time = time.perf_counter() - wall_started_at
+
+        sink = simulator.nodes[self.destination].traffic_sink.as_dict()
+        forwarding = Histogram()
+        for name, node in simulator.nodes.items():
+            if name != self.source:
+                forwarding.merge(node.metrics.forwarding_latency)
+        forwarding_stats = forwarding.as_dict()
+        sent = int(self.rate * self.duration)
+        return {
+            'net_file': self.net_file,
+            'source': self.source,
+            'destination': self.destination,
+            'rate': self.rate,
+            'size': self.size,
+            'flows': self.flows,
+            'duration': self.duration,
+            'link_state': self.node_options.get('link_state', False),
+            'sent': sent,
+            'received': sink['received'],
+            'lost': sent - sink['received'],
+            'reordered': sink['reordered'],
+            'duplicates': sink['duplicates'],
+            'latency_us': sink['latency_us'],
+            'forwarded': forwarding.count,
+            'forwarding_p50_us': forwarding_stats['p50'],
+            'forwarding_p99_us': forwarding_stats['p99'],
+            'forwarding_mean_us': round(forwarding_stats['mean'], 3) if forwarding.count else None,
+            'virtual_time': round(simulator.clock.now - started_at, 6),
+            'wall_time': round(wall_time, 6),
+            'forwarded_per_second': round(forwarding.count / wall_time, 1) if wall_time else None,
+        }
+
+
+def compare(result, baseline, tolerance):
+    """
+    :return: a description of every metric that got worse by more than tolerance over the baseline
+    """
+    regressions = []
+    for metric in COMPARED_INCREASES:
+        if baseline.get(metric) is not None and result[metric] is not None \
+                and result[metric] > baseline[metric] * (1 + tolerance):
+            regressions.append(f"{metric} {baseline[metric]} -> {result[metric]}")
+    for metric in COMPARED_DECREASES:
+        if baseline.get(metric) and result[metric] < baseline[metric] * (1 - tolerance):
+            regressions.append(f"{metric} {baseline[metric]} -> {result[metric]}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="py loadtest.py [options]")
+    parser.add_argument("--net", default=DEFAULT_NET_FILE, help="the .net topology to run on")
+    parser.add_argument("--source", help="the sending node; defaults to one end of the longest shortest path")
+    parser.add_argument("--destination", help="the receiving node; defaults to the other end")
+    parser.add_argument("--rate", type=float, default=2000, help="packets per second")
+    parser.add_argument("--size", type=int, default=512, help="bytes per packet, IP header included")
+    parser.add_argument("--flows", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of virtual time to send for")
+    parser.add_argument("--link-state", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the result to this file instead of stdout")
+    parser.add_argument("--compare", help="a previous --output file to check the result against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="the fraction a metric may get worse than the --compare baseline")
+    options = parser.parse_args()
+
+    result = LoadTest(options.net, options.rate, options.size, options.flows, options.duration,
+                      source=options.source, destination=options.destination,
+                      link_state=options.link_state, seed=options.seed).run()
+
+    output = json.dumps(result, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(result, json.load(f), options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        exit(1 if regressions else 0)
@@ -0,0 +1,95 @@
+import logging
+import sys
+import time
+
+ROOT_LOGGER_NAME = 'node'
+# routing table exchange, link state, timers
+control_log = logging.getLogger(f'{ROOT_LOGGER_NAME}.control')
+# packet dispatch, forwarding and drops
+forwarding_log = logging.getLogger(f'{ROOT_LOGGER_NAME}.forwarding')
+# commands typed at the prompt
+cli_log = logging.getLogger(f'{ROOT_LOGGER_NAME}.cli')
+
+SUBSYSTEMS = {
+    'control': control_log,
+    'forwarding': forwarding_log,
+    'cli': cli_log,
+}
+DEFAULT_LEVEL = logging.INFO
+DEFAULT_TRACE_RATE = 50
+LOG_FORMAT = '%(levelname)s %(name)s: %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket over records below WARNING: at most rate of them per second pass, with bursts of up
+    to burst. Warnings and errors always pass. The first record let through after some were dropped
+    says how many.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.clock = clock
+        self.tokens = self.burst
+        self.last_refill = clock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        if self.suppressed:
+            record.msg = f"({self.suppressed} messages suppressed) {record.msg}"
+            self.suppressed = 0
+        return True
+
+
+def parse_levels(specs):
+    """
+    :param specs: strings like "DEBUG" for every subsystem or "control=DEBUG" for one of them
+    :return: the level for all subsystems (None if not given) and a dict of per-subsystem levels
+    """
+    level = None
+    subsystem_levels = {}
+    for spec in specs:
+        subsystem, _, name = spec.rpartition('=')
+        value = logging.getLevelName(name.upper())
+        if not isinstance(value, int):
+            raise ValueError(f"unknown log level {name}")
+        if not subsystem:
+            level = value
+        elif subsystem in SUBSYSTEMS:
+            subsystem_levels[subsystem] = value
+        else:
+            raise ValueError(f"unknown subsystem {subsystem}, expected one of {', '.join(SUBSYSTEMS)}")
+    return level, subsystem_levels
+
+
+def configure_logging(level=DEFAULT_LEVEL, subsystem_levels=None, trace=False, trace_rate=DEFAULT_TRACE_RATE,
+                      stream=sys.stdout, filename=None):
+    """
+    :param subsystem_levels: {subsystem name: level} overriding level for that subsystem
+    :param trace: log everything at DEBUG, limited to trace_rate records per second
+    """
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.FileHandler(filename) if filename else logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if trace:
+        handler.addFilter(RateLimitFilter(trace_rate))
+        level = logging.DEBUG
+    root.addHandler(handler)
+    root.setLevel(level)
+    # records stop at the node logger instead of also reaching whatever the root logger prints to
+    root.propagate = False
+    for name, logger in SUBSYSTEMS.items():
+        logger.setLevel((subsystem_levels or {}).get(name, logging.NOTSET))
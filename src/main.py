@@ -1,19 +1,63 @@
+import argparse
+
+from async_engine import AsyncEngine
+from log import DEFAULT_LEVEL, DEFAULT_TRACE_RATE, configure_logging, parse_levels
 from node import *
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Run as follows: py main.py <node_name>")
-        exit(0)
+    parser = argparse.ArgumentParser(usage="py main.py <node_name> [options]")
+    parser.add_argument("node_name")
+    parser.add_argument("--full-table-updates", action="store_true",
+                        help="advertise the whole routing table on every change instead of deltas")
+    parser.add_argument("--infinity", type=int, default=INFINITY,
+                        help="the distance at which a destination counts as unreachable")
+    parser.add_argument("--max-paths", type=int, default=MAX_PATHS,
+                        help="the most equal-cost next hops to spread a destination's traffic over; 1 disables multipath")
+    parser.add_argument("--link-state", action="store_true",
+                        help="flood link state advertisements and run shortest paths instead of distance vector")
+    parser.add_argument("--no-summarize", action="store_true",
+                        help="advertise every route on its own instead of summarizing them into CIDR prefixes")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="forward data packets in this many extra processes sharing the link port")
+    parser.add_argument("--snapshot", metavar="PATH",
+                        help="restart from the routing snapshot at PATH and keep saving one there")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run the node on an asyncio event loop instead of the select loop")
+    parser.add_argument("--log-level", action="append", default=[], metavar="[SUBSYSTEM=]LEVEL",
+                        help="e.g. DEBUG, or control=DEBUG for one of the control, forwarding and cli subsystems; "
+                             "may be repeated")
+    parser.add_argument("--trace", action="store_true",
+                        help="log everything at debug level, rate-limited to --trace-rate messages per second")
+    parser.add_argument("--trace-rate", type=float, default=DEFAULT_TRACE_RATE)
+    parser.add_argument("--stats-socket", metavar="PATH",
+                        help="serve the node's stats as JSON to every connection to this UNIX socket")
+    parser.add_argument("--log-file", help="write log messages to this file instead of stdout")
+    options = parser.parse_args()
+
+    try:
+        level, subsystem_levels = parse_levels(options.log_level)
+    except ValueError as e:
+        parser.error(str(e))
+    configure_logging(level=DEFAULT_LEVEL if level is None else level,
+                      subsystem_levels=subsystem_levels,
+                      trace=options.trace,
+                      trace_rate=options.trace_rate,
+                      filename=options.log_file)
 
-    node_name = sys.argv[1]
-    node = Node(node_name)
+    node = Node(options.node_name,
+                incremental_updates=not options.full_table_updates,
+                infinity=options.infinity,
+                max_paths=options.max_paths,
+                link_state=options.link_state,
+                workers=options.workers,
+                snapshot_path=options.snapshot,
+                summarize=not options.no_summarize)
 
-    node.register_handler(protocol_num=PRINT_PROTOCOL, handler=node.print_handler)
-    node.register_handler(protocol_num=ROUTE_PROTOCOL, handler=node.route_handler)
-    node.register_handler(protocol_num=ROUTING_TABLE_UPDATE_PROTOCOL, handler=node.routing_table_update_handler)
-    node.register_handler(protocol_num=TRACEROUTE_PROTOCOL, handler=node.rcv_traceroute_handler)
-    node.register_handler(protocol_num=TRACEROUTE_PROTOCOL_RESULT, handler=node.traceroute_result_handler)
-    node.register_handler(protocol_num=DOWN_PROTOCOL, handler=node.down_update_handler)
-    node.register_handler(protocol_num=UP_PROTOCOL, handler=node.up_update_handler)
+    node.register_default_handlers()
+    if options.stats_socket:
+        node.serve_stats(options.stats_socket)
 
-    node.run()
+    if options.asyncio:
+        AsyncEngine(node).run()
+    else:
+        node.run()
@@ -0,0 +1,232 @@
+import bisect
+import json
+import os
+import socket
+import time
+from collections import Counter, deque
+
+from protocols import PROTOCOL_NAMES
+
+# upper bounds of the latency histogram buckets, in microseconds; the last bucket takes everything above
+LATENCY_BUCKETS_US = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+# route changes further apart than this belong to different convergence events
+CONVERGENCE_QUIET_PERIOD = 1.0
+MAX_CONVERGENCE_EVENTS = 32
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: recording a value is a binary search over the bucket bounds and two additions.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS_US):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        """
+        Adds the values recorded by another histogram with the same bounds.
+        """
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, fraction):
+        """
+        :return: the upper bound of the bucket holding the given fraction of values, None if there are none
+        """
+        if not self.count:
+            return None
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return self.bounds[index] if index < len(self.bounds) else float('inf')
+        return float('inf')
+
+    def _label(self, bound):
+        # JSON has no infinity
+        return f">{self.bounds[-1]}" if bound == float('inf') else bound
+
+    def describe(self, fraction):
+        """
+        :return: the percentile as text, e.g. "<= 50" or ">50000"
+        """
+        bound = self.percentile(fraction)
+        return self._label(bound) if bound == float('inf') else f"<= {bound}"
+
+    def as_dict(self):
+        buckets = {f"le_{bound}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets['inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self._label(self.percentile(0.5)),
+            'p90': self._label(self.percentile(0.9)),
+            'p99': self._label(self.percentile(0.99)),
+            'buckets': buckets,
+        }
+
+
+class InterfaceCounters:
+    __slots__ = ('tx_packets', 'tx_bytes', 'rx_packets', 'rx_bytes', 'drops')
+
+    def __init__(self):
+        self.tx_packets = 0
+        self.tx_bytes = 0
+        self.rx_packets = 0
+        self.rx_bytes = 0
+        self.drops = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in InterfaceCounters.__slots__}
+
+
+class Metrics:
+    """
+    Counters a Node updates as it works. Every update is a few integer additions, so they stay on
+    in production. Observes the node's RoutingTable to count churn and group route changes into
+    convergence events.
+    """
+
+    def __init__(self, interfaces, clock=time.monotonic):
+        self.clock = clock
+        self.started_at = clock()
+        self.protocol_packets = Counter()
+        self.protocol_bytes = Counter()
+        # microseconds from receiving a packet to handing it to the socket or finishing its handler
+        self.forwarding_latency = Histogram()
+        self.handler_latency = Histogram()
+        self.interfaces = {interface.my_virt_ip: InterfaceCounters() for interface in interfaces}
+        # reason -> packets dropped for it
+        self.drops = Counter()
+        self.route_changes = 0
+        self.route_removals = 0
+        # [started at, last change at, number of changes], most recent last
+        self.convergence_events = deque(maxlen=MAX_CONVERGENCE_EVENTS)
+
+    def received(self, interface, size):
+        if interface is not None:
+            counters = self.interfaces[interface.my_virt_ip]
+            counters.rx_packets += 1
+            counters.rx_bytes += size
+
+    def sent(self, interface, size):
+        counters = self.interfaces[interface.my_virt_ip]
+        counters.tx_packets += 1
+        counters.tx_bytes += size
+
+    def dropped(self, reason, interface=None):
+        self.drops[reason] += 1
+        if interface is not None:
+            self.interfaces[interface.my_virt_ip].drops += 1
+
+    def handled(self, protocol, size):
+        self.protocol_packets[protocol] += 1
+        self.protocol_bytes[protocol] += size
+
+    def route_changed(self, node, routing_table_item):
+        self.route_changes += 1
+        self._churn()
+
+    def route_removed(self, node):
+        self.route_removals += 1
+        self._churn()
+
+    def _churn(self):
+        now = self.clock()
+        if self.convergence_events and now - self.convergence_events[-1][1] <= CONVERGENCE_QUIET_PERIOD:
+            event = self.convergence_events[-1]
+            event[1] = now
+            event[2] += 1
+        else:
+            self.convergence_events.append([now, now, 1])
+
+    def as_dict(self, routing_table_size=None):
+        now = self.clock()
+        return {
+            'uptime': now - self.started_at,
+            'routes': routing_table_size,
+            'protocols': {PROTOCOL_NAMES.get(protocol, str(protocol)): {'packets': packets,
+                                                                       'bytes': self.protocol_bytes[protocol]}
+                          for protocol, packets in self.protocol_packets.items()},
+            'forwarding_latency_us': self.forwarding_latency.as_dict(),
+            'handler_latency_us': self.handler_latency.as_dict(),
+            'interfaces': {ip: counters.as_dict() for ip, counters in self.interfaces.items()},
+            'drops': dict(self.drops),
+            'route_changes': self.route_changes,
+            'route_removals': self.route_removals,
+            'convergence_events': [{'started_ago': now - started_at,
+                                    'duration': last_change_at - started_at,
+                                    'changes': changes}
+                                   for started_at, last_change_at, changes in self.convergence_events],
+        }
+
+    def __str__(self):
+        stats = self.as_dict()
+        lines = [f"Uptime {stats['uptime']:.1f}s, {self.route_changes} route changes, "
+                 f"{self.route_removals} removals, {len(self.convergence_events)} convergence events"]
+        lines.append("PROTOCOL\t\tPACKETS\tBYTES")
+        lines.extend(f"{name}\t\t{counters['packets']}\t{counters['bytes']}"
+                     for name, counters in stats['protocols'].items())
+        lines.append("INTERFACE\t\tTX\tTX BYTES\tRX\tRX BYTES\tDROPS")
+        lines.extend(f"{ip}\t\t{c.tx_packets}\t{c.tx_bytes}\t\t{c.rx_packets}\t{c.rx_bytes}\t\t{c.drops}"
+                     for ip, c in self.interfaces.items())
+        for name, histogram in (('Forwarding', self.forwarding_latency), ('Handler', self.handler_latency)):
+            if not histogram.count:
+                lines.append(f"{name} latency: no packets")
+                continue
+            lines.append(f"{name} latency: {histogram.count} packets, "
+                         f"p50 {histogram.describe(0.5)}us, p99 {histogram.describe(0.99)}us")
+        if self.drops:
+            lines.append("Drops: " + ", ".join(f"{reason}={count}" for reason, count in self.drops.items()))
+        return "\n".join(lines)
+
+
+class StatsEndpoint:
+    """
+    UNIX stream socket that answers every connection with the node's stats as one JSON document and
+    closes it. Meant to be polled from the node's event loop whenever fileno() is readable.
+    """
+
+    def __init__(self, path, get_stats):
+        """
+        :param get_stats: returns the dict to serve
+        """
+        self.path = path
+        self.get_stats = get_stats
+        if os.path.exists(path):
+            os.unlink(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen()
+        self.socket.setblocking(False)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def handle(self):
+        try:
+            connection, _ = self.socket.accept()
+        except BlockingIOError:
+            return
+        with connection:
+            connection.setblocking(True)
+            connection.settimeout(1.0)
+            try:
+                connection.sendall(json.dumps(self.get_stats()).encode() + b"\n")
+            except OSError:
+                pass
+
+    def close(self):
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
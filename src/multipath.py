@@ -0,0 +1,82 @@
+MAX_PATHS = 4
+
+
+class EqualCostPaths:
+    """
+    Tracks, for every destination, all up interfaces whose neighbor offers it at our own distance
+    minus one, and installs them in the ForwardingTable when there is more than one. The routing
+    table keeps its single forwarding_interface, which is what gets advertised and poisoned.
+    Observes the routing table so that the paths follow every change of the best route.
+    """
+
+    def __init__(self, routing_table, neighbor_tables, interfaces, fib, infinity, max_paths=MAX_PATHS):
+        """
+        :param neighbor_tables: the node's {my_virt_ip: RoutingTable} of what each neighbor advertises
+        :param max_paths: at most this many next hops are used per destination; 1 turns multipath off
+        """
+        self.routing_table = routing_table
+        self.neighbor_tables = neighbor_tables
+        self.interfaces = interfaces
+        self.fib = fib
+        self.infinity = infinity
+        self.max_paths = max_paths
+        # destination -> tuple of the my_virt_ip of every next hop, only for destinations with several
+        self.paths = {}
+
+    def route_changed(self, destination, routing_table_item):
+        self.update(destination)
+
+    def route_removed(self, destination):
+        self.update(destination)
+
+    def uses(self, destination, forwarding_interface):
+        paths = self.paths.get(destination)
+        return paths is not None and forwarding_interface in paths
+
+    def next_hops(self, destination):
+        """
+        :return: the my_virt_ip of every interface packets for destination are spread over
+        """
+        paths = self.paths.get(destination)
+        if paths is not None:
+            return paths
+        routing_table_item = self.routing_table.get(destination)
+        if routing_table_item is None or routing_table_item.distance >= self.infinity:
+            return ()
+        return routing_table_item.forwarding_interface,
+
+    def update(self, destination):
+        if self.max_paths < 2:
+            return
+        routing_table_item = self.routing_table.get(destination)
+        paths = ()
+        if routing_table_item is not None and 0 < routing_table_item.distance < self.infinity:
+            paths = self._equal_cost_interfaces(destination, routing_table_item)
+        if len(paths) > 1:
+            if self.paths.get(destination) != paths:
+                self.paths[destination] = paths
+                self.fib.set_next_hops(destination, paths)
+        elif self.paths.pop(destination, None) is not None and routing_table_item is not None:
+            # back to the single best route
+            self.fib.route_changed(destination, routing_table_item)
+
+    def _equal_cost_interfaces(self, destination, routing_table_item):
+        paths = [routing_table_item.forwarding_interface]
+        for interface in self.interfaces:
+            if len(paths) >= self.max_paths:
+                break
+            if not interface.is_up or interface.my_virt_ip == routing_table_item.forwarding_interface:
+                continue
+            neighbor_routing_table = self.neighbor_tables.get(interface.my_virt_ip)
+            offered = neighbor_routing_table.lookup(destination) if neighbor_routing_table is not None else None
+            if offered is not None and offered.distance + 1 == routing_table_item.distance:
+                paths.append(interface.my_virt_ip)
+        return tuple(sorted(paths))
+
+    def neighbor_forgotten(self, interface):
+        """
+        Drops the paths through a neighbor whose table is gone.
+        """
+        for destination in [destination for destination, paths in self.paths.items()
+                            if interface.my_virt_ip in paths]:
+            self.update(destination)
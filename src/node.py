@@ -1,30 +1,154 @@
+import random
 import select
 import sys
 import socket
+import struct
 import time
-import pickle
+from itertools import chain
 from address import Address
-from ip import IPPacket
+from dataplane import DataPlane
+from fib import ForwardingTable, ip_to_int
+from flood_control import FloodControl
+from fragmentation import Reassembler
+from ip import IPHeader, IPPacket, MalformedPacketError
+from link_state import LinkState
+from log import cli_log, control_log, forwarding_log
+from metrics import Metrics, StatsEndpoint
+from multipath import MAX_PATHS, EqualCostPaths
 from protocols import *
 from util import Util
 from routing_table import *
+from scheduler import TimerWheel
+from snapshot import MAX_SNAPSHOT_AGE, SNAPSHOT_INTERVAL, Snapshot
+from traceroute import Traceroute
+from traffic import TrafficGenerator, TrafficSink
 
 LNX_FILES_ROOT = '../tools/'
 MAX_TRANSMISSION_UNIT = 1400
 IP_PREFIX = '192.168.0'
+# a full table is sent instead of a delta after this many consecutive deltas
+FULL_SYNC_EVERY = 20
+# seconds
+UPDATE_INTERVAL = 10
+ROUTE_TIMEOUT = 6 * UPDATE_INTERVAL
+HOLD_DOWN_TIME = ROUTE_TIMEOUT
+GARBAGE_COLLECTION_TIME = 4 * UPDATE_INTERVAL
+# routes loaded from a snapshot that no neighbor has confirmed by then are invalidated
+PROVISIONAL_ROUTE_TIMEOUT = 2 * UPDATE_INTERVAL
+# the distance at which a destination counts as unreachable
+INFINITY = 16
+# the source address locally originated packets are hashed with, since theirs depends on the path chosen
+UNSPECIFIED_SOURCE = '0.0.0.0'
+# payload bytes of an expired packet quoted in the time exceeded message, as ICMP does
+TIME_EXCEEDED_QUOTE = 8
+# what parsing a truncated or garbled control payload raises
+PAYLOAD_ERRORS = (struct.error, ValueError, IndexError)
 
 
 class Node:
-    def __init__(self, name):
+    def __init__(self, name, incremental_updates=True, clock=time.monotonic, infinity=INFINITY,
+                 links=None, transport=None, max_paths=MAX_PATHS, link_state=False, workers=0, snapshot_path=None,
+                 summarize=True):
+        """
+        :param links: (Address, [Interface]) to use instead of reading <name>.lnx
+        :param transport: anything with sendto(data, address) to use instead of a bound UDP socket
+        :param max_paths: the most equal-cost next hops traffic to one destination is spread over
+        :param link_state: route with flooded link state advertisements instead of distance vectors
+        :param workers: number of processes to forward data packets in, next to this one; needs a UDP socket
+        :param snapshot_path: file to restart from and to save the routing table and interface states to
+        :param summarize: advertise routes through one neighbor that cover a whole CIDR block as one prefix
+        """
         self.name = name
-        self.addr, self.interfaces = self._read_links()
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind(self.addr.to_tuple())
+        self.infinity = infinity
+        # every reachable destination is fewer than infinity hops away
+        self.initial_ttl = max(IPHeader.DEFAULT_TTL, infinity)
+        self.addr, self.interfaces = self._read_links() if links is None else links
+        self._interfaces_by_local_ip = {interface.my_virt_ip: interface for interface in self.interfaces}
+        self._interfaces_by_peer_ip = {interface.peer_virt_ip: interface for interface in self.interfaces}
+        # the UDP address a datagram came from -> the interfaces it may have arrived on, several for parallel links
+        self._interfaces_by_address = {}
+        for interface in self.interfaces:
+            addresses = [interface.addr.to_tuple()]
+            try:
+                addresses.append((socket.gethostbyname(interface.addr.ip), interface.addr.port))
+            except OSError:
+                pass
+            for address in addresses:
+                interfaces = self._interfaces_by_address.setdefault(address, [])
+                if interface not in interfaces:
+                    interfaces.append(interface)
+        if transport is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if workers:
+                # the workers bind the same port
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.socket.bind(self.addr.to_tuple())
+            # replaced by the asyncio engine's send queue
+            self.transport = self.socket
+        else:
+            self.socket = None
+            self.transport = transport
+        self.scheduler = TimerWheel(clock=clock)
+        self.reassembler = Reassembler(clock=clock)
+        self.scheduler.call_every(self.reassembler.timeout / 2, self.reassembler.expire)
+        self._next_identification = 0
 
         self.routing_table = RoutingTable()
+        self.fib = ForwardingTable(resolve_interface=self._interfaces_by_local_ip.get, infinity=infinity)
+        self.routing_table.add_observer(self.fib)
+        self.metrics = Metrics(self.interfaces, clock=clock)
+        self.routing_table.add_observer(self.metrics)
+        self.stats_endpoint = None
+        self.data_plane = None
+        self.incremental_updates = incremental_updates
+        # keyed by the my_virt_ip of the interface the neighbor is reached through
+        self.neighbor_tables = {}
+        self.multipath = EqualCostPaths(self.routing_table, self.neighbor_tables, self.interfaces, self.fib,
+                                        infinity=infinity, max_paths=max_paths)
+        self.routing_table.add_observer(self.multipath)
+        self._sent_sequence = {}
+        self._expected_sequence = {}
+        # interface my_virt_ip -> (sequence, chunks received so far) of a table sent in several chunks
+        self._table_chunks = {}
+        # destination -> (distance, forwarding interface) as of the last advertisement
+        self._advertised = {}
+        self.summarize = summarize
+        # whether neighbors were last sent a table with prefixes in it
+        self._summarized = False
+        self._deltas_since_full_sync = 0
+        # destination -> expiry timer of a learned route, or garbage collection timer of an unreachable one
+        self._route_timers = {}
+        # interface my_virt_ip -> timer that forgets the neighbor's table if it goes silent
+        self._neighbor_timers = {}
+        # my_virt_ip of the interfaces taken down because their neighbor went silent, until it is heard from again
+        self._silent_neighbors = set()
+        # destination -> (distance before the route expired, timer ending the hold-down)
+        self._hold_down = {}
+        # traceroute id -> the Traceroute waiting for answers to its probes
+        self.traceroutes = {}
+        self._next_traceroute_id = 0
+        # interface up and down events, numbered by the node they happened at so that each floods once
+        self.flood_control = FloodControl(min((interface.my_virt_ip for interface in self.interfaces), key=ip_to_int,
+                                              default=UNSPECIFIED_SOURCE),
+                                          clock=self.scheduler.clock)
+        # generated traffic that reached this node, and the generators this node is running
+        self.traffic_sink = TrafficSink(self.scheduler.clock)
+        self.traffic_generators = []
+        self.snapshot_path = snapshot_path
+        # destination -> forwarding interface of a route loaded from the snapshot that no neighbor confirmed yet
+        self._provisional_routes = {}
+        self.link_state = LinkState(self.interfaces, self.routing_table, self.scheduler, send=self._send_link_state,
+                                    infinity=infinity) if link_state else None
+        if snapshot_path is not None:
+            self._restore_snapshot()
+            self.scheduler.call_every(SNAPSHOT_INTERVAL, self.save_snapshot)
         self.bring_up()
+        if self.link_state is None:
+            self._schedule_periodic_update()
         self.protocol_switcher = {}
-        self.down_interfaces_list = []
+        if workers and self.socket is not None:
+            self.data_plane = DataPlane(self.addr, self.interfaces, self.fib, workers, max_paths=max(max_paths, 1))
+            self.data_plane.start()
         
 
         print(f"Node {self.name} started.")
@@ -36,37 +160,533 @@ class Node:
     def up_interfaces(self):
         return [interface for interface in self.interfaces if interface.is_up]
 
-    def _broadcast_routing_table_to_neighbors(self, protocol):
+    def _broadcast_routing_table_to_neighbors(self, protocol, summarize=False):
+        """
+        :param summarize: send the routing table summarized afresh instead of the routes neighbors already know
+        """
         #print("BROADCASTING MY ROUTING TABLE TO MY NEIGHBORS")
         #print(self.routing_table)
+        routes = self._mark_advertised(summarize)
         for interface in self.up_interfaces:
+            self._send_routing_table(interface, protocol, routes)
+
+    def _send_routing_table(self, interface, protocol, routes=None, prefix=b""):
+        """
+        :param prefix: what precedes the table in the packet of the given protocol; all but the last chunk
+                       of a table too large for one datagram go ahead of it as routing table updates
+        """
+        chunks = self._routing_table_payload(interface, self._advertised_table() if routes is None else routes)
+        for index, chunk in enumerate(chunks):
+            is_last = index == len(chunks) - 1
             ip_packet = IPPacket(src_ip=interface.my_virt_ip,
                                  dest_ip=interface.peer_virt_ip,
-                                 protocol_num=protocol,
-                                 payload=pickle.dumps(self.routing_table))
-            self.socket.sendto(pickle.dumps(ip_packet),
-                               interface.addr.to_tuple())
+                                 protocol_num=protocol if is_last else ROUTING_TABLE_UPDATE_PROTOCOL,
+                                 payload=prefix + chunk if is_last else chunk)
+            self._send_packet(ip_packet, interface)
+
+    def _next_sequence(self, interface):
+        sequence = (self._sent_sequence.get(interface.my_virt_ip, 0) + 1) & 0xFFFFFFFF
+        self._sent_sequence[interface.my_virt_ip] = sequence
+        return sequence
+
+    def _routing_table_payload(self, interface, routes):
+        """
+        :return: the payloads of the chunks the table is sent in, each under the datagram size limit
+        """
+        sequence = self._next_sequence(interface)
+        table = routes.to_bytes(poisoned_interface=interface.my_virt_ip, infinity=self.infinity)
+        count = max(1, -(-len(table) // TABLE_CHUNK_SIZE))
+        return [TABLE_CHUNK_FORMAT.pack(sequence, index, count)
+                + table[index * TABLE_CHUNK_SIZE:(index + 1) * TABLE_CHUNK_SIZE] for index in range(count)]
+
+    def _unpack_routing_table(self, interface_to_neighbor, payload):
+        """
+        Records a full table received from a neighbor as the new baseline for its deltas.
+        :param payload: one chunk of the table
+        :return: the neighbor's table with its prefixes expanded into host routes, and the addresses
+                 it no longer advertises; None for both until the last missing chunk arrives
+        """
+        sequence, index, count = TABLE_CHUNK_FORMAT.unpack_from(payload)
+        if not index < count <= MAX_TABLE_CHUNKS:
+            raise ValueError(f"bad routing table chunk {index} of {count}")
+        chunk = payload[TABLE_CHUNK_FORMAT.size:]
+        if count > 1:
+            # chunks of an older table are dropped once one of a newer arrives
+            buffered_sequence, chunks = self._table_chunks.get(interface_to_neighbor.my_virt_ip, (None, []))
+            if buffered_sequence != sequence or len(chunks) != count:
+                chunks = [None] * count
+                self._table_chunks[interface_to_neighbor.my_virt_ip] = (sequence, chunks)
+            chunks[index] = chunk
+            if None in chunks:
+                return None, None
+            del self._table_chunks[interface_to_neighbor.my_virt_ip]
+            chunk = b"".join(chunks)
+        neighbor_routing_table = RoutingTable.from_bytes(chunk)
+        previous = self.neighbor_tables.get(interface_to_neighbor.my_virt_ip)
+        withdrawn = []
+        if previous:
+            # a destination that went into a prefix is still offered
+            _, withdrawn = neighbor_routing_table.host_routes([node for node in previous
+                                                               if node not in neighbor_routing_table])
+        expanded = neighbor_routing_table.expanded()
+        # prefixes pay for the length every route then carries only if they stand for enough routes
+        if expanded.memory_size() <= neighbor_routing_table.memory_size():
+            neighbor_routing_table = expanded
+        self.neighbor_tables[interface_to_neighbor.my_virt_ip] = neighbor_routing_table
+        self._expected_sequence[interface_to_neighbor.my_virt_ip] = (sequence + 1) & 0xFFFFFFFF
+        return expanded, withdrawn
+
+    def _forget_neighbor(self, interface):
+        self.neighbor_tables.pop(interface.my_virt_ip, None)
+        self.multipath.neighbor_forgotten(interface)
+        self._expected_sequence.pop(interface.my_virt_ip, None)
+        self._table_chunks.pop(interface.my_virt_ip, None)
+        timer = self._neighbor_timers.pop(interface.my_virt_ip, None)
+        if timer is not None:
+            self.scheduler.cancel(timer)
+
+    def _mark_advertised(self, summarize=False):
+        """
+        Records that neighbors are about to get a full table. Summaries are only made afresh for the
+        periodic update: in between, neighbors keep the prefixes they have and hear about changes to
+        the routes inside them as host routes, which longest-prefix match puts first.
+        :param summarize: send the routing table summarized instead of the routes neighbors already know
+        :return: the table to send
+        """
+        self._deltas_since_full_sync = 0
+        if self._summarized and not summarize:
+            self._collect_changes()
+            return self._advertised_table()
+        self.routing_table.pop_changes()
+        routes = self.routing_table.summarize(self.infinity) if summarize else self.routing_table
+        self._summarized = routes is not self.routing_table
+        self._advertised = {node: (routing_table_item.distance, routing_table_item.forwarding_interface)
+                            for node, routing_table_item in routes.items()}
+        return routes
+
+    def _advertised_table(self):
+        """
+        :return: the routes as neighbors know them, from the last full table and every delta since
+        """
+        if not self._summarized:
+            return self.routing_table
+        routes = RoutingTable()
+        for node in sorted(self._advertised, key=parse_destination):
+            distance, forwarding_interface = self._advertised[node]
+            routes[node] = RoutingTableItem(distance=distance, forwarding_interface=forwarding_interface)
+        return routes
+
+    def _schedule_periodic_update(self):
+        # jittered so that neighbors do not synchronize their updates
+        self.scheduler.call_later(UPDATE_INTERVAL * random.uniform(0.85, 1.0), self._periodic_update)
+
+    def _periodic_update(self):
+        self._broadcast_routing_table_to_neighbors(ROUTING_TABLE_UPDATE_PROTOCOL, summarize=self.summarize)
+        # a neighbor that only lost touch with us for a while has taken its end of the link down too
+        for interface in self.interfaces:
+            if interface.my_virt_ip in self._silent_neighbors:
+                self._send_routing_table(interface, ROUTING_TABLE_UPDATE_PROTOCOL)
+        self._schedule_periodic_update()
+
+    def _refresh_route(self, node):
+        timer = self._route_timers.get(node)
+        if timer is not None:
+            self.scheduler.cancel(timer)
+        self._route_timers[node] = self.scheduler.call_later(ROUTE_TIMEOUT, self._expire_route, node)
+
+    def _expire_route(self, node):
+        del self._route_timers[node]
+        routing_table_item = self.routing_table.get(node)
+        if routing_table_item is None or not 0 < routing_table_item.distance < self.infinity:
+            return
+        neighbor_timer = self._neighbor_timers.get(routing_table_item.forwarding_interface)
+        if neighbor_timer is not None and neighbor_timer.deadline <= self.scheduler.clock():
+            # the whole neighbor went silent, not just this route: its routes are moved to other neighbors
+            self._expire_neighbor(self._interfaces_by_local_ip[routing_table_item.forwarding_interface])
+            return
+        control_log.info("Route to %s timed out", node)
+        self._start_hold_down(node, routing_table_item.distance)
+        self._mark_unreachable(node)
+        self._advertise_changes()
+
+    def _mark_unreachable(self, node):
+        """
+        Keeps the route at distance infinity so that neighbors hear it is gone, and deletes it
+        once GARBAGE_COLLECTION_TIME passes without it becoming reachable again.
+        """
+        routing_table_item = self.routing_table[node]
+        self.routing_table[node] = RoutingTableItem(distance=self.infinity,
+                                                    forwarding_interface=routing_table_item.forwarding_interface)
+        self._cancel_route_timer(node)
+        self._route_timers[node] = self.scheduler.call_later(GARBAGE_COLLECTION_TIME, self._collect_route, node)
+
+    def _collect_route(self, node):
+        del self._route_timers[node]
+        if node in self.routing_table and self.routing_table[node].distance >= self.infinity:
+            del self.routing_table[node]
+            self._advertise_changes()
+
+    def _cancel_route_timer(self, node):
+        timer = self._route_timers.pop(node, None)
+        if timer is not None:
+            self.scheduler.cancel(timer)
+
+    def _invalidate_route(self, node, lost_interface):
+        """
+        Replaces a route that went through lost_interface with the best one another neighbor still
+        offers, or marks it unreachable if there is none. Other routes are left alone.
+        """
+        best = self._best_offer(node, lost_interface)
+        if best is None:
+            self._mark_unreachable(node)
+        else:
+            self.routing_table[node] = best
+            self._refresh_route(node)
+
+    def _best_offer(self, node, lost_interface=None):
+        """
+        :return: a RoutingTableItem for the shortest route to node that a neighbor other than the one
+                 behind lost_interface offers and that is not held down, or None if there is none
+        """
+        best = None
+        for interface in self.up_interfaces:
+            neighbor_routing_table = self.neighbor_tables.get(interface.my_virt_ip)
+            offered = neighbor_routing_table.lookup(node) if neighbor_routing_table is not None else None
+            if interface is lost_interface or offered is None:
+                continue
+            distance = offered.distance + 1
+            if distance < self.infinity and (best is None or distance < best.distance) \
+                    and not self._is_held_down(node, distance):
+                best = RoutingTableItem(distance=distance, forwarding_interface=interface.my_virt_ip)
+        return best
+
+    def _restore_route(self, node):
+        """
+        Takes the shortest route neighbors offer to a destination we have no route to.
+        :return: True if the routing table changed
+        """
+        routing_table_item = self.routing_table.get(node)
+        if routing_table_item is not None and routing_table_item.distance < self.infinity:
+            return False
+        best = self._best_offer(node)
+        if best is None:
+            return False
+        self.routing_table[node] = best
+        self._refresh_route(node)
+        return True
+
+    def _withdraw_routes(self, nodes, interface_to_neighbor):
+        """
+        :return: True if the routing table changed
+        """
+        changed = False
+        for node in nodes:
+            if node not in self.routing_table:
+                continue
+            routing_table_item = self.routing_table[node]
+            if routing_table_item.forwarding_interface == interface_to_neighbor.my_virt_ip \
+                    and 0 < routing_table_item.distance < self.infinity:
+                self._invalidate_route(node, interface_to_neighbor)
+                changed = True
+            elif self.multipath.uses(node, interface_to_neighbor.my_virt_ip):
+                self.multipath.update(node)
+        return changed
+
+    def _set_local_route(self, interface):
+        """
+        :return: True if the routing table changed
+        """
+        if interface.my_virt_ip in self.routing_table and self.routing_table[interface.my_virt_ip].distance == 0:
+            return False
+        self._cancel_route_timer(interface.my_virt_ip)
+        self.routing_table[interface.my_virt_ip] = RoutingTableItem(distance=0,
+                                                                    forwarding_interface=interface.my_virt_ip)
+        return True
+
+    def _lose_interface(self, lost_interface):
+        """
+        Takes lost_interface down, makes its own address unreachable and reroutes or invalidates
+        only the routes that used it.
+        """
+        lost_interface.down()
+        self._forget_neighbor(lost_interface)
+        if lost_interface.my_virt_ip in self.routing_table:
+            self._mark_unreachable(lost_interface.my_virt_ip)
+        affected = [node for node, routing_table_item in self.routing_table.items()
+                    if routing_table_item.forwarding_interface == lost_interface.my_virt_ip
+                    and 0 < routing_table_item.distance < self.infinity]
+        for node in affected:
+            self._invalidate_route(node, lost_interface)
+
+    def _start_hold_down(self, node, distance):
+        """
+        For HOLD_DOWN_TIME after a route is lost, only strictly shorter routes to it are accepted, so
+        stale paths still circulating among neighbors cannot bring it back.
+        """
+        if node in self._hold_down:
+            self.scheduler.cancel(self._hold_down[node][1])
+        self._hold_down[node] = (distance, self.scheduler.call_later(HOLD_DOWN_TIME, self._hold_down.pop, node))
+
+    def _is_held_down(self, node, distance):
+        return node in self._hold_down and distance >= self._hold_down[node][0]
+
+    def _hold_down_link(self, addresses):
+        """
+        The addresses of a link that went down are unreachable by any path, so until the link comes
+        back up no route to them is accepted: otherwise neighbors that have not heard yet keep offering
+        them to each other, one hop longer every round, until they reach infinity.
+        """
+        for address in addresses:
+            self._start_hold_down(address, 0)
+
+    def _end_hold_down(self, addresses):
+        """
+        Lets the routes neighbors offer to addresses that came back up in again.
+        :return: the addresses that were held down
+        """
+        released = [address for address in addresses if address in self._hold_down]
+        for address in released:
+            self.scheduler.cancel(self._hold_down.pop(address)[1])
+        return released
+
+    def _refresh_neighbor(self, interface):
+        timer = self._neighbor_timers.get(interface.my_virt_ip)
+        if timer is not None:
+            self.scheduler.cancel(timer)
+        self._neighbor_timers[interface.my_virt_ip] = self.scheduler.call_later(ROUTE_TIMEOUT,
+                                                                                self._expire_neighbor,
+                                                                                interface)
+
+    def _expire_neighbor(self, interface):
+        """
+        A neighbor that sent nothing for ROUTE_TIMEOUT crashed or can no longer be reached, so its link
+        is taken down as if it failed. It comes back up when the neighbor is heard from again.
+        """
+        control_log.info("Neighbor %s went silent", interface.peer_virt_ip)
+        self._forget_neighbor(interface)
+        if interface.is_up:
+            self._silent_neighbors.add(interface.my_virt_ip)
+            self._lose_interface(interface)
+            self._advertise_changes()
+
+    def _revive_interface(self, interface):
+        """
+        Brings back up the link to a neighbor that went silent and is heard from again.
+        :return: True if the routing table changed
+        """
+        if interface.my_virt_ip not in self._silent_neighbors:
+            return False
+        control_log.info("Neighbor %s is back", interface.peer_virt_ip)
+        self._silent_neighbors.discard(interface.my_virt_ip)
+        interface.up()
+        # it forgot our routes or timed them out, like we did its own
+        self._send_routing_table(interface, ROUTING_TABLE_UPDATE_PROTOCOL)
+        return self._set_local_route(interface)
+
+    def _collect_changes(self):
+        """
+        Brings what neighbors were told up to date with the routes that changed since.
+        :return: a RoutingTable of the routes to advertise and the destinations to withdraw
+        """
+        changed = RoutingTable()
+        withdrawn = []
+        for node in self.routing_table.pop_changes():
+            if node in self.routing_table:
+                routing_table_item = self.routing_table[node]
+                entry = (routing_table_item.distance, routing_table_item.forwarding_interface)
+                if self._advertised.get(node) != entry:
+                    self._advertised[node] = entry
+                    changed[node] = routing_table_item
+                continue
+            prefix = None
+            if self._summarized:
+                prefix = next((prefix for prefix in covering_prefixes(node) if prefix in self._advertised), None)
+            if prefix is None:
+                if self._advertised.pop(node, None) is not None:
+                    withdrawn.append(node)
+            elif self._advertised.get(node, (0,))[0] < self.infinity:
+                # withdrawing it would leave neighbors with the prefix it was summarized into
+                forwarding_interface = self._advertised[prefix][1]
+                self._advertised[node] = (self.infinity, forwarding_interface)
+                changed[node] = RoutingTableItem(distance=self.infinity, forwarding_interface=forwarding_interface)
+        return changed, withdrawn
+
+    def _advertise_changes(self):
+        """
+        Sends neighbors the routes that changed since the last advertisement. A full table is sent
+        instead when incremental updates are off, when a periodic full sync is due, or when the
+        delta would not be smaller than the table or not fit in one datagram.
+        """
+        changed, withdrawn = self._collect_changes()
+        if not changed and not withdrawn:
+            return
+        if not self.incremental_updates \
+                or self._deltas_since_full_sync >= FULL_SYNC_EVERY \
+                or len(changed) + len(withdrawn) >= len(self.routing_table):
+            self._broadcast_routing_table_to_neighbors(ROUTING_TABLE_UPDATE_PROTOCOL)
+            return
+
+        deltas = []
+        for interface in self.up_interfaces:
+            delta = RoutingTableDelta(self._next_sequence(interface), changed, withdrawn)
+            deltas.append((interface, delta.to_bytes(poisoned_interface=interface.my_virt_ip, infinity=self.infinity)))
+            if len(deltas[-1][1]) > TABLE_CHUNK_SIZE:
+                # the full table can be split into chunks, the delta cannot
+                self._broadcast_routing_table_to_neighbors(ROUTING_TABLE_UPDATE_PROTOCOL)
+                return
+        self._deltas_since_full_sync += 1
+        for interface, payload in deltas:
+            ip_packet = IPPacket(src_ip=interface.my_virt_ip,
+                                 dest_ip=interface.peer_virt_ip,
+                                 protocol_num=ROUTING_TABLE_DELTA_PROTOCOL,
+                                 payload=payload)
+            self._send_packet(ip_packet, interface)
+
+    def _send_packet(self, ip_packet, interface):
+        self._next_identification = (self._next_identification + 1) & 0xFFFF
+        try:
+            fragments = ip_packet.to_fragments(MAX_TRANSMISSION_UNIT, self._next_identification)
+        except ValueError as e:
+            forwarding_log.warning("Dropped packet to %s: %s", ip_packet.header.dst_addr, e)
+            self.metrics.dropped('oversize', interface)
+            return
+        for fragment in fragments:
+            self.transport.sendto(fragment, interface.addr.to_tuple())
+            self.metrics.sent(interface, len(fragment))
 
     def bring_up(self):
-        for interface in self.interfaces:
-            interface.up()
+        """
+        Announces the interfaces that are up; all of them, unless a snapshot said otherwise.
+        """
+        if self.link_state is not None:
+            self.link_state.start()
+            return
+        up_interface_addresses = []
+        for interface in self.up_interfaces:
             self.routing_table[interface.my_virt_ip] = RoutingTableItem(distance=0,
                                                                         forwarding_interface=interface.my_virt_ip)
-        self._broadcast_routing_table_to_neighbors(UP_PROTOCOL)
+            up_interface_addresses.append(interface.my_virt_ip)
+            up_interface_addresses.append(interface.peer_virt_ip)
+        self._broadcast_change_interface_to_neighbors(changed_interface_addresses=up_interface_addresses,
+                                                      protocol=UP_PROTOCOL, event=self.flood_control.originate())
+
+    def save_snapshot(self):
+        # a link is only saved as down if it was taken down on purpose
+        snapshot = Snapshot({interface.my_virt_ip: interface.is_up or interface.my_virt_ip in self._silent_neighbors
+                             for interface in self.interfaces},
+                            self.routing_table,
+                            link_state_sequence=self.link_state.sequence if self.link_state is not None else 0)
+        try:
+            snapshot.save(self.snapshot_path)
+        except OSError as e:
+            control_log.warning("Could not save snapshot to %s: %s", self.snapshot_path, e)
+
+    def _restore_snapshot(self):
+        """
+        Brings the interfaces that were down before the restart down again and, with distance
+        vector, loads the learned routes as provisional ones. The first full table from each
+        neighbor confirms or invalidates the provisional routes through it.
+        """
+        try:
+            snapshot = Snapshot.load(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            control_log.warning("Ignoring snapshot %s: %s", self.snapshot_path, e)
+            return
+        if snapshot is None:
+            return
+        for interface in self.interfaces:
+            if not snapshot.interfaces.get(interface.my_virt_ip, True):
+                interface.down()
+        if self.link_state is not None:
+            # our old LSAs may still be around; start numbering after them
+            self.link_state.sequence = snapshot.link_state_sequence
+            return
+        if snapshot.age > MAX_SNAPSHOT_AGE:
+            control_log.info("Snapshot %s is %.0fs old, not using its routes", self.snapshot_path, snapshot.age)
+            return
+        for node, routing_table_item in snapshot.routing_table.items():
+            interface = self._interfaces_by_local_ip.get(routing_table_item.forwarding_interface)
+            if not 0 < routing_table_item.distance < self.infinity or interface is None or not interface.is_up \
+                    or self._is_my_packet(node):
+                continue
+            self.routing_table[node] = routing_table_item
+            self._refresh_route(node)
+            self._provisional_routes[node] = routing_table_item.forwarding_interface
+        if self._provisional_routes:
+            control_log.info("Loaded %d provisional routes from %s", len(self._provisional_routes), self.snapshot_path)
+            self.scheduler.call_later(PROVISIONAL_ROUTE_TIMEOUT, self._expire_provisional_routes)
+
+    def _confirm_provisional_routes(self, interface_to_neighbor, neighbor_routing_table):
+        """
+        Checks the provisional routes through a neighbor against the full table it sent: the ones it
+        no longer offers are invalidated, the others become ordinary routes.
+        :return: True if the routing table changed
+        """
+        if not self._provisional_routes:
+            return False
+        via = interface_to_neighbor.my_virt_ip
+        changed = False
+        for node in [node for node, forwarding_interface in self._provisional_routes.items() if forwarding_interface == via]:
+            del self._provisional_routes[node]
+            if node not in neighbor_routing_table and self._is_provisional_route_current(node, via):
+                self._invalidate_route(node, interface_to_neighbor)
+                changed = True
+        return changed
+
+    def _is_provisional_route_current(self, node, forwarding_interface):
+        current = self.routing_table.get(node)
+        return current is not None and current.forwarding_interface == forwarding_interface \
+            and 0 < current.distance < self.infinity
+
+    def _expire_provisional_routes(self):
+        changed = False
+        for node, forwarding_interface in self._provisional_routes.items():
+            if self._is_provisional_route_current(node, forwarding_interface):
+                self._invalidate_route(node, self._interfaces_by_local_ip[forwarding_interface])
+                changed = True
+        self._provisional_routes.clear()
+        if changed:
+            self._advertise_changes()
 
     def up_update_handler(self, ip_packet):
         interface_to_neighbor = self._find_interface(dest_ip=ip_packet.header.src_addr)
+        if interface_to_neighbor is None:
+            return
+        try:
+            event, event_size = FloodControl.unpack_event(ip_packet.payload)
+            up_interface_addresses, table_offset = Util.unpack_addresses(ip_packet.payload[event_size:])
+            # the event is passed on without a routing table
+            table_payload = ip_packet.payload[event_size + table_offset:]
+            neighbor_routing_table, withdrawn = self._unpack_routing_table(interface_to_neighbor, table_payload) \
+                if table_payload else (None, None)
+        except PAYLOAD_ERRORS as e:
+            self._drop_malformed(ip_packet, interface_to_neighbor, e)
+            return
+        # every copy brings up the link it came over, parallel links to the neighbor included
+        if not self.flood_control.is_new(*event, via=interface_to_neighbor.my_virt_ip):
+            return
+        was_up = interface_to_neighbor.is_up
         interface_to_neighbor.up()
-        self.routing_table.clear()
-        for interface in self.up_interfaces:
-            self.routing_table[interface.my_virt_ip] = RoutingTableItem(distance=0,
-                                                                        forwarding_interface=interface.my_virt_ip)
-
-        neighbor_routing_table = pickle.loads(ip_packet.payload)
-        changed = self._update_routing_table(neighbor_routing_table, interface_to_neighbor)
+        self._silent_neighbors.discard(interface_to_neighbor.my_virt_ip)
+        changed = self._set_local_route(interface_to_neighbor)
+        # the event only has to go as far as the link it announces was held down
+        released = self._end_hold_down(up_interface_addresses) if self.flood_control.is_new(*event) else []
+        for address in released:
+            changed = self._restore_route(address) or changed
+        if neighbor_routing_table is not None:
+            changed = self._withdraw_routes(withdrawn, interface_to_neighbor) or changed
+            changed = self._confirm_provisional_routes(interface_to_neighbor, neighbor_routing_table) or changed
+            changed = self._update_routing_table(neighbor_routing_table, interface_to_neighbor) or changed
+
+        if released:
+            self._broadcast_change_interface_to_neighbors(changed_interface_addresses=up_interface_addresses,
+                                                          protocol=UP_PROTOCOL, event=event, with_routing_table=False)
+        if not was_up or (ip_packet.header.src_addr in up_interface_addresses
+                          and event[0] != self.flood_control.origin):
+            # the neighbor just started or re-enabled the link, so it has none of our routes yet
+            self._send_routing_table(interface_to_neighbor, ROUTING_TABLE_UPDATE_PROTOCOL)
         if changed:
-            self._broadcast_routing_table_to_neighbors(ROUTING_TABLE_UPDATE_PROTOCOL)
-
+            self._advertise_changes()
 
     def _read_links(self):
         with open(f'{LNX_FILES_ROOT}{self.name}.lnx') as f:
@@ -79,24 +699,76 @@ class Node:
                 exit(0)
 
     def _bring_all_interfaces_down(self):
+        if self.link_state is not None:
+            self.link_state.withdraw()
+            for interface in self.up_interfaces:
+                interface.down()
+            self.routing_table.clear()
+            return
+        down_interface_addresses = []
         for interface in self.up_interfaces:
-            self.down_interfaces_list.append(interface.my_virt_ip)
-            self.down_interfaces_list.append(interface.peer_virt_ip)
+            down_interface_addresses.append(interface.my_virt_ip)
+            down_interface_addresses.append(interface.peer_virt_ip)
 
         self.routing_table.clear()
 
-        self._broadcast_change_interface_to_neighbors(changed_interface_addresses=self.down_interfaces_list,
-                                                      protocol=DOWN_PROTOCOL)
+        self._broadcast_change_interface_to_neighbors(changed_interface_addresses=down_interface_addresses,
+                                                      protocol=DOWN_PROTOCOL, event=self.flood_control.originate())
 
         for interface in self.up_interfaces:
             interface.down()
 
     def _quit_handler(self):
         print("Exiting...")
-        self._bring_all_interfaces_down()
-        self.socket.close()
+        self.shutdown()
         exit(0)
 
+    def shutdown(self):
+        if self.snapshot_path is not None:
+            self.save_snapshot()
+        self._bring_all_interfaces_down()
+        if self.socket is not None:
+            self.socket.close()
+        if self.stats_endpoint is not None:
+            self.stats_endpoint.close()
+        if self.data_plane is not None:
+            self.data_plane.stop()
+
+    def serve_stats(self, path):
+        """
+        Answers connections to the UNIX socket at path with stats() as JSON.
+        """
+        self.stats_endpoint = StatsEndpoint(path, self.stats)
+
+    def stats(self):
+        stats = self.metrics.as_dict(routing_table_size=len(self.routing_table))
+        stats['node'] = self.name
+        stats['reassembly'] = {
+            'reassembled': self.reassembler.reassembled,
+            'dropped_fragments': self.reassembler.dropped_fragments,
+            'timed_out_datagrams': self.reassembler.timed_out_datagrams,
+            'evicted_datagrams': self.reassembler.evicted_datagrams,
+            'overlapping_datagrams': self.reassembler.overlapping_datagrams,
+        }
+        stats['send_queue_drops'] = getattr(self.transport, 'dropped', 0)
+        stats['flood_control'] = self.flood_control.as_dict()
+        if self.data_plane is not None:
+            stats['workers'] = self.data_plane.stats()
+        if self.traffic_sink.flows:
+            stats['traffic'] = self.traffic_sink.as_dict()
+        if self.link_state is not None:
+            stats['link_state'] = {
+                'advertisements': len(self.link_state.database),
+                'full_computations': self.link_state.full_computations,
+                'incremental_computations': self.link_state.incremental_computations,
+            }
+        return stats
+
+    def _stats_handler(self):
+        print(f"Stats for {self.name}:")
+        print(self.metrics)
+        print("---------------------")
+
     def _interfaces_handler(self):
         print(f"Showing interfaces for {self.addr}")
         for interface in self.interfaces:
@@ -105,21 +777,31 @@ class Node:
 
     def _routes_handler(self):
         print(f"Routing table for {self.name} is:")
-        print(self.routing_table)
+        print("DEST\t\tDISTANCE\tFORWARDING INTERFACE")
+        for node, routing_table_item in self.routing_table.items():
+            next_hops = self.multipath.next_hops(node) or (routing_table_item.forwarding_interface,)
+            print(f"{node}\t\t{routing_table_item.distance}\t{', '.join(next_hops)}")
         print("---------------------")
 
-    def _broadcast_change_interface_to_neighbors(self, changed_interface_addresses, protocol):
-        payload = {
-            'routing_table': pickle.dumps(self.routing_table),
-            'interfaces': changed_interface_addresses,
-        }
+    def _broadcast_change_interface_to_neighbors(self, changed_interface_addresses, protocol, event,
+                                                 with_routing_table=True):
+        """
+        :param event: (origin, sequence) of the change, kept unchanged as it is passed on
+        :param with_routing_table: follow the addresses with our routing table; without it, neighbors
+                                   hear about the routes that change through the usual updates
+        """
+        addresses = FloodControl.pack_event(*event) + Util.pack_addresses(changed_interface_addresses)
+        if with_routing_table:
+            routes = self._mark_advertised()
+            for interface in self.up_interfaces:
+                self._send_routing_table(interface, protocol, routes, prefix=addresses)
+            return
         for interface in self.up_interfaces:
             ip_packet = IPPacket(src_ip=interface.my_virt_ip,
                                  dest_ip=interface.peer_virt_ip,
                                  protocol_num=protocol,
-                                 payload=payload)
-            self.socket.sendto(pickle.dumps(ip_packet),
-                               interface.addr.to_tuple())
+                                 payload=addresses)
+            self._send_packet(ip_packet, interface)
 
     def _down_handler(self, *args):
         try:
@@ -129,66 +811,68 @@ class Node:
             return
         interface_ip = f"{IP_PREFIX}.{interface_id}" if not interface_id.startswith(IP_PREFIX) else interface_id
         interface = self._find_interface(src_ip=interface_ip)
+        if interface is None or not interface.is_up:
+            print(f"No up interface {interface_ip}")
+            return
         self.bring_interface_down(interface)
         print(f"{interface_id} is down.")
 
     def bring_interface_down(self, down_interface):
-        self.down_interfaces_list.append(down_interface.my_virt_ip)
-        self.down_interfaces_list.append(down_interface.peer_virt_ip)
-        self.routing_table.clear()
-        for interface in self.up_interfaces:
-            if interface == down_interface:
-                continue
-            self.routing_table[interface.my_virt_ip] = RoutingTableItem(distance=0,
-                                                                        forwarding_interface=interface.my_virt_ip)
+        if self.link_state is not None:
+            down_interface.down()
+            # the peer still has to hear that we no longer use the link
+            self.link_state.originate(also_to=down_interface)
+            return
+        # the peer learns the link is down from our own address being unreachable in this table
+        self._mark_unreachable(down_interface.my_virt_ip)
         down_interface_addresses = [down_interface.my_virt_ip, down_interface.peer_virt_ip]
+        self._hold_down_link(down_interface_addresses)
         self._broadcast_change_interface_to_neighbors(changed_interface_addresses=down_interface_addresses,
-                                                      protocol=DOWN_PROTOCOL)
-        down_interface.down()
+                                                      protocol=DOWN_PROTOCOL, event=self.flood_control.originate())
+        self._lose_interface(down_interface)
+        self._advertise_changes()
 
     def _is_neighbor_interface_down(self, neighbor_routing_table, source_ip):
-        for node, routing_table_item in neighbor_routing_table.items():
-            if routing_table_item.distance == 0 and node == source_ip:
-                return False
-        return True
+        return source_ip not in neighbor_routing_table or neighbor_routing_table[source_ip].distance != 0
 
     def down_update_handler(self, ip_packet):
-        neighbor_routing_table = pickle.loads(ip_packet.payload['routing_table'])
-
         interface_to_neighbor = self._find_interface(dest_ip=ip_packet.header.src_addr)
-        if self._is_neighbor_interface_down(neighbor_routing_table, ip_packet.header.src_addr):
-            interface_to_neighbor.down()
-
-        down_interface_addresses = ip_packet.payload['interfaces']
-
-        #checked_before = all(address in self.down_interfaces_list for address in down_interface_addresses)
-        should_check = False
-
-        for address in down_interface_addresses:
-            if address in self.down_interfaces_list:
-                continue
-            else:
-                should_check = True
+        if interface_to_neighbor is None:
+            return
+        try:
+            event, event_size = FloodControl.unpack_event(ip_packet.payload)
+            down_interface_addresses, table_offset = Util.unpack_addresses(ip_packet.payload[event_size:])
+            neighbor_routing_table, withdrawn = self._unpack_routing_table(
+                interface_to_neighbor, ip_packet.payload[event_size + table_offset:])
+        except PAYLOAD_ERRORS as e:
+            self._drop_malformed(ip_packet, interface_to_neighbor, e)
+            return
 
-        if should_check:
-            
-            for interface_address in down_interface_addresses:
-                self.down_interfaces_list.append(interface_address)
+        changed = False
+        if ip_packet.header.src_addr in down_interface_addresses if neighbor_routing_table is None \
+                else self._is_neighbor_interface_down(neighbor_routing_table, ip_packet.header.src_addr):
+            if interface_to_neighbor.is_up:
+                self._lose_interface(interface_to_neighbor)
+                changed = True
 
-            self.routing_table.clear()
-            for interface in self.up_interfaces:
-                self.routing_table[interface.my_virt_ip] = RoutingTableItem(distance=0,
-                                                                            forwarding_interface=interface.my_virt_ip)
+        is_new = self.flood_control.is_new(*event)
+        if is_new:
+            self._hold_down_link(down_interface_addresses)
+            for address in down_interface_addresses:
+                if address in self.routing_table \
+                        and 0 < self.routing_table[address].distance < self.infinity:
+                    self._mark_unreachable(address)
+                    changed = True
 
-            changed = self._update_routing_table(neighbor_routing_table, interface_to_neighbor)
-            if changed:
-                self._broadcast_change_interface_to_neighbors(changed_interface_addresses=down_interface_addresses,
-                                                              protocol=DOWN_PROTOCOL)
-        else:
-            changed = self._update_routing_table(neighbor_routing_table, interface_to_neighbor)
-            if changed:
-                self._broadcast_routing_table_to_neighbors(ROUTING_TABLE_UPDATE_PROTOCOL)
+        if interface_to_neighbor.is_up and neighbor_routing_table is not None:
+            changed = self._withdraw_routes(withdrawn, interface_to_neighbor) or changed
+            changed = self._update_routing_table(neighbor_routing_table, interface_to_neighbor) or changed
 
+        if is_new:
+            self._broadcast_change_interface_to_neighbors(changed_interface_addresses=down_interface_addresses,
+                                                          protocol=DOWN_PROTOCOL, event=event)
+        elif changed:
+            self._advertise_changes()
 
     def _up_handler(self, *args):
         try:
@@ -197,30 +881,34 @@ class Node:
             print("Bad input")
             return
 
-        
-        self.routing_table.clear()  # TODO: test
-        self.down_interfaces_list.clear()
         interface_ip = f"{IP_PREFIX}.{interface_id}" if not interface_id.startswith(IP_PREFIX) else interface_id
         interface = self._find_interface(src_ip=interface_ip)
+        if interface is None:
+            print(f"No interface {interface_ip}")
+            return
         interface.up()
-        for interface in self.up_interfaces:
-            self.routing_table[interface.my_virt_ip] = RoutingTableItem(distance=0,
-                                                                        forwarding_interface=interface.my_virt_ip)
-
-        self._broadcast_routing_table_to_neighbors(protocol=UP_PROTOCOL)
+        self._silent_neighbors.discard(interface.my_virt_ip)
+        if self.link_state is not None:
+            self.link_state.originate()
+            return
+        self._set_local_route(interface)
+        up_interface_addresses = [interface.my_virt_ip, interface.peer_virt_ip]
+        self._end_hold_down(up_interface_addresses)
+        self._broadcast_change_interface_to_neighbors(changed_interface_addresses=up_interface_addresses,
+                                                      protocol=UP_PROTOCOL, event=self.flood_control.originate())
 
     def _find_interface(self, dest_ip=None, src_ip=None):
-        for interface in self.interfaces:
-            if dest_ip is not None and interface.peer_virt_ip == dest_ip:
-                return interface
-            if src_ip is not None and interface.my_virt_ip == src_ip:
-                return interface
+        if dest_ip is not None:
+            return self._interfaces_by_peer_ip.get(dest_ip)
+        return self._interfaces_by_local_ip.get(src_ip)
 
     def _send_handler(self, *args):
         try:
             virtual_ip, protocol_num, *payload = args
             payload = " ".join(payload)
-        except ValueError:
+            ip_to_int(virtual_ip)
+            protocol_num = int(protocol_num)
+        except (ValueError, OSError):
             print("Bad input")
             return
 
@@ -229,18 +917,25 @@ class Node:
             print(payload)
             return
 
+        if not 0 <= protocol_num <= IPHeader.MAX_PROTOCOL:
+            print(f"Bad input: protocol must be between 0 and {IPHeader.MAX_PROTOCOL}")
+            return
         interface = self._find_route(virtual_ip)
         if interface is None:
             print(f"No route to {virtual_ip}")
             return
+        data = payload.encode()
+        if self.multipath.paths:
+            interface = self._find_route(virtual_ip,
+                                         IPHeader.flow_hash(UNSPECIFIED_SOURCE, virtual_ip, protocol_num, data))
 
         ip_packet = IPPacket(interface.my_virt_ip,
                              virtual_ip,
                              protocol_num,
-                             payload)
+                             data,
+                             ttl=self.initial_ttl)
 
-        self.socket.sendto(pickle.dumps(ip_packet),
-                           interface.addr.to_tuple())
+        self._send_packet(ip_packet, interface)
 
         print(f'Sent "{payload}" to {virtual_ip} with proto num {protocol_num}')
 
@@ -256,146 +951,467 @@ class Node:
             "up": self._up_handler,
             "send": self._send_handler,
             "traceroute": self._traceroute_handler,
+            "stats": self._stats_handler,
+            "traffic": self._traffic_handler,
+            "traffic-stats": self._traffic_stats_handler,
         }
+        cli_log.debug("Command %s %s", cmd, args)
         result = switcher.get(cmd, self._default_cmd)(*args)
         Util.print_last_line_of_output()
         return result
 
-    def _traceroute_handler(self, virtual_ip):
+    def _traffic_handler(self, *args):
+        try:
+            virtual_ip, rate, size, flows, duration = args
+            rate, size, flows, duration = float(rate), int(size), int(flows), float(duration)
+        except ValueError:
+            print("Bad input")
+            return
         next_interface = self._find_route(virtual_ip)
-        print(f"‫‪Traceroute‬‬ to {virtual_ip}")
-        path = [next_interface.my_virt_ip]
-        ip_packet = IPPacket(next_interface.my_virt_ip, virtual_ip, TRACEROUTE_PROTOCOL, path)
-        self.socket.sendto(pickle.dumps(ip_packet),
-                           next_interface.addr.to_tuple())
+        if next_interface is None:
+            print(f"No route to {virtual_ip}")
+            return
+        source_ip = next_interface.my_virt_ip
 
-    def rcv_traceroute_handler(self, ip_packet):
-        ip_packet.payload.append(self._find_route(ip_packet.header.dst_addr).my_virt_ip)
-        if self._is_my_packet(ip_packet.header.dst_addr):
-            newpacket = IPPacket(src_ip=ip_packet.header.dst_addr,
-                                 dest_ip=ip_packet.header.src_addr,
-                                 protocol_num=TRACEROUTE_PROTOCOL_RESULT,
-                                 payload=ip_packet.payload)
-            self.socket.sendto(pickle.dumps(newpacket),
-                               self._find_route(newpacket.header.dst_addr).addr.to_tuple())
-        else:
-            self.socket.sendto(pickle.dumps(ip_packet),
-                               self._find_route(ip_packet.header.dst_addr).addr.to_tuple())
+        def send(payload):
+            self._send_towards(IPPacket(source_ip, virtual_ip, TRAFFIC_PROTOCOL, payload, ttl=self.initial_ttl))
 
-    def traceroute_result_handler(self, ip_packet):
-        if self._is_my_packet(ip_packet.header.dst_addr):
-            path = ip_packet.payload
-            print("\n".join([f"{index + 1} {item}" for index, item in enumerate(path)]))
-            print(f"Traceroute finished in {len(ip_packet.payload)} hops")
+        try:
+            generator = TrafficGenerator(virtual_ip, rate, size, flows, duration, send, self.scheduler,
+                                         on_finished=self._traffic_finished)
+        except ValueError as e:
+            print(f"Bad input: {e}")
+            return
+        self.traffic_generators.append(generator)
+        print(f"Sending {rate:g} packets/s of {size} bytes to {virtual_ip} in {flows} flows for {duration:g}s")
+        generator.start()
+
+    def _traffic_finished(self, generator):
+        self.traffic_generators.remove(generator)
+        print(generator.summary())
+        Util.print_last_line_of_output()
+
+    def _traffic_stats_handler(self):
+        print(self.traffic_sink)
+        for generator in self.traffic_generators:
+            print(f"Sending to {generator.destination}: {generator.sent} packets so far")
+
+    def traffic_handler(self, ip_packet):
+        if not self._is_my_packet(ip_packet.header.dst_addr):
+            self._forward(ip_packet)
+            return
+        self.traffic_sink.receive(ip_packet.header.src_addr, ip_packet.payload)
+
+    def _traceroute_handler(self, *args):
+        try:
+            virtual_ip, = args
+            ip_to_int(virtual_ip)
+        except (ValueError, OSError):
+            print("Bad input")
+            return
+        next_interface = self._find_route(virtual_ip)
+        if next_interface is None:
+            print(f"No route to {virtual_ip}")
+            return
+        print(f"Traceroute to {virtual_ip}")
+        identifier = self._next_traceroute_id
+        self._next_traceroute_id = (self._next_traceroute_id + 1) & 0xFFFF
+        source_ip = next_interface.my_virt_ip
+
+        def send_probe(ttl, payload):
+            self._send_towards(IPPacket(source_ip, virtual_ip, TRACEROUTE_PROTOCOL, payload, ttl=ttl))
+
+        traceroute = Traceroute(identifier, virtual_ip, send_probe, self.scheduler, self._traceroute_finished,
+                                max_hops=self.initial_ttl)
+        self.traceroutes[identifier] = traceroute
+        traceroute.start()
+
+    def _traceroute_finished(self, traceroute):
+        self.traceroutes.pop(traceroute.identifier, None)
+        print("\n".join(traceroute.lines()))
+        if traceroute.reached_at is None:
+            print(f"Traceroute did not reach {traceroute.destination} in {traceroute.max_hops} hops")
         else:
-            self.socket.sendto(pickle.dumps(ip_packet),
-                               self._find_route(ip_packet.header.dst_addr).addr.to_tuple())
+            print(f"Traceroute finished in {traceroute.reached_at} hops")
+        Util.print_last_line_of_output()
 
-    def _update_routing_table(self, neighbor_routing_table, interface_to_neighbor):
+    def rcv_traceroute_handler(self, ip_packet):
+        if not self._is_my_packet(ip_packet.header.dst_addr):
+            self._forward(ip_packet)
+            return
+        # the probe reached us: echo it back so that its sender can time it
+        self._send_towards(IPPacket(src_ip=ip_packet.header.dst_addr,
+                                    dest_ip=ip_packet.header.src_addr,
+                                    protocol_num=TRACEROUTE_PROTOCOL_RESULT,
+                                    payload=ip_packet.payload,
+                                    ttl=self.initial_ttl))
 
-        if not interface_to_neighbor.is_up:
-            return True
+    def traceroute_result_handler(self, ip_packet):
+        if not self._is_my_packet(ip_packet.header.dst_addr):
+            self._forward(ip_packet)
+            return
+        self._answer_probe(ip_packet.payload, ip_packet.header.src_addr, reached=True)
 
-        if interface_to_neighbor is None or not interface_to_neighbor.is_up:
-            print("@@@@@@@@@@@@@@@@@@@ interface to neighbor has issues")
-            print(interface_to_neighbor)
-            return False
+    def _answer_probe(self, payload, address, reached):
+        try:
+            identifier, sequence = Traceroute.parse_probe(payload)
+        except ValueError:
+            return
+        traceroute = self.traceroutes.get(identifier)
+        if traceroute is not None:
+            traceroute.answer(sequence, address, reached)
 
-        print("----------------------")
-        print("NEIGHBOR ROUTING TABLE:")
-        print(neighbor_routing_table)
-        print("ROUTING TABLE BEFORE UPDATE:")
-        print(self.routing_table)
-        print("----------------------")
-        changed = False
-        for node, routing_table_item in neighbor_routing_table.items():
-            if node in self.routing_table:
-                if routing_table_item.distance + 1 < self.routing_table[node].distance:
-                    changed = True
-                    self.routing_table[node] = RoutingTableItem(distance=routing_table_item.distance + 1,
-                                                                forwarding_interface=interface_to_neighbor.my_virt_ip)
-            else:
-                changed = True
-                self.routing_table[node] = RoutingTableItem(distance=routing_table_item.distance + 1,
-                                                            forwarding_interface=interface_to_neighbor.my_virt_ip)
+    def time_exceeded_handler(self, ip_packet):
+        if not self._is_my_packet(ip_packet.header.dst_addr):
+            self._forward(ip_packet)
+            return
+        quoted = ip_packet.payload
+        if len(quoted) < IPHeader.LENGTH:
+            return
+        protocol = IPHeader.peek_protocol(quoted)
+        if protocol == TRACEROUTE_PROTOCOL:
+            self._answer_probe(quoted[IPHeader.LENGTH:], ip_packet.header.src_addr, reached=False)
+        else:
+            forwarding_log.info("TTL of a packet to %s ran out at %s", IPHeader.peek_destination(quoted),
+                                ip_packet.header.src_addr)
+
+    def _forward(self, ip_packet):
+        """
+        Sends a packet for another node on towards its destination, one hop closer to running out of TTL.
+        """
+        if ip_packet.header.ttl <= 1:
+            self.metrics.dropped('ttl_exceeded')
+            if ip_packet.header.protocol != TIME_EXCEEDED_PROTOCOL:
+                self._send_time_exceeded(bytes(ip_packet.header.pack(len(ip_packet.payload)))
+                                         + ip_packet.payload[:TIME_EXCEEDED_QUOTE])
+            return
+        ip_packet.header.ttl -= 1
+        self._send_towards(ip_packet)
+
+    def _send_time_exceeded(self, quoted):
+        """
+        :param quoted: the header of the expired packet and the start of its payload
+        """
+        source_ip = socket.inet_ntoa(quoted[IPHeader.SRC_OFFSET:IPHeader.SRC_OFFSET + 4])
+        interface = self._find_route(source_ip)
+        if interface is None:
+            return
+        self._send_towards(IPPacket(src_ip=interface.my_virt_ip,
+                                    dest_ip=source_ip,
+                                    protocol_num=TIME_EXCEEDED_PROTOCOL,
+                                    payload=quoted,
+                                    ttl=self.initial_ttl))
 
-        print("ROUTING TABLE AFTER UPDATE:")
-        print(self.routing_table)
-        print("----------------------")
-       
+    def _update_routing_table(self, neighbor_routing_table, interface_to_neighbor):
+        """
+        Merges a neighbor's table, or the changed part of it, into ours in one batch.
+        :return: the destinations whose routes changed
+        """
+        if not interface_to_neighbor.is_up:
+            return set()
+
+        # the tables are only turned into strings if debug logging is on
+        control_log.debug("Update from %s\nNEIGHBOR ROUTING TABLE:\n%s\nROUTING TABLE BEFORE UPDATE:\n%s",
+                          interface_to_neighbor.peer_virt_ip, neighbor_routing_table, self.routing_table)
+        self._refresh_neighbor(interface_to_neighbor)
+        via = interface_to_neighbor.my_virt_ip
+        merge = self.routing_table.merge(neighbor_routing_table, via, self.infinity)
+        changed = set()
+        # our next hop's word is final, even when the route got longer or unreachable
+        for node in [format_destination(*key) for key in merge.lost]:
+            self._invalidate_route(node, interface_to_neighbor)
+            changed.add(node)
+        improved = merge.improved
+        if self._hold_down:
+            improved = [(address, length, distance) for address, length, distance in improved
+                        if not self._is_held_down(format_destination(address, length), distance)]
+        if merge.updated or improved:
+            changed |= self.routing_table.update_many(sorted(merge.updated + improved), via)
+        for address, length in chain(merge.refreshed, (route[:2] for route in improved)):
+            self._refresh_route(format_destination(address, length))
+        # another neighbor started or stopped offering an equal-cost path
+        for node in [format_destination(*key) for key in merge.equal_cost]:
+            self.multipath.update(node)
+        for node in [node for node, paths in self.multipath.paths.items() if via in paths]:
+            if node not in changed and node in neighbor_routing_table:
+                self.multipath.update(node)
+
+        control_log.debug("ROUTING TABLE AFTER UPDATE:\n%s", self.routing_table)
 
         return changed
 
+    def register_default_handlers(self):
+        self.register_handler(protocol_num=PRINT_PROTOCOL, handler=self.print_handler)
+        self.register_handler(protocol_num=ROUTE_PROTOCOL, handler=self.route_handler)
+        if self.link_state is not None:
+            self.register_handler(protocol_num=TRACEROUTE_PROTOCOL, handler=self.rcv_traceroute_handler)
+            self.register_handler(protocol_num=TRACEROUTE_PROTOCOL_RESULT, handler=self.traceroute_result_handler)
+            self.register_handler(protocol_num=TIME_EXCEEDED_PROTOCOL, handler=self.time_exceeded_handler)
+            self.register_handler(protocol_num=TRAFFIC_PROTOCOL, handler=self.traffic_handler)
+            self.register_handler(protocol_num=LINK_STATE_PROTOCOL, handler=self.link_state_handler)
+            return
+        self.register_handler(protocol_num=ROUTING_TABLE_UPDATE_PROTOCOL, handler=self.routing_table_update_handler)
+        self.register_handler(protocol_num=ROUTING_TABLE_DELTA_PROTOCOL, handler=self.routing_table_delta_handler)
+        self.register_handler(protocol_num=ROUTING_TABLE_REQUEST_PROTOCOL, handler=self.routing_table_request_handler)
+        self.register_handler(protocol_num=TRACEROUTE_PROTOCOL, handler=self.rcv_traceroute_handler)
+        self.register_handler(protocol_num=TRACEROUTE_PROTOCOL_RESULT, handler=self.traceroute_result_handler)
+        self.register_handler(protocol_num=TIME_EXCEEDED_PROTOCOL, handler=self.time_exceeded_handler)
+        self.register_handler(protocol_num=TRAFFIC_PROTOCOL, handler=self.traffic_handler)
+        self.register_handler(protocol_num=DOWN_PROTOCOL, handler=self.down_update_handler)
+        self.register_handler(protocol_num=UP_PROTOCOL, handler=self.up_update_handler)
+
     def register_handler(self, protocol_num, handler):
         if protocol_num in self.protocol_switcher:
-            print(f"handler for {protocol_num} protocol number already exists.")
+            control_log.warning("handler for %d protocol number already exists.", protocol_num)
             return
 #        print(f"handler for {protocol_num} registered.")
         self.protocol_switcher[protocol_num] = handler
 
     def run_handler(self, ip_packet):
         protocol_number = int(ip_packet.header.protocol)
-        print(f"Running handler for protocol {protocol_number}.")
-        self.protocol_switcher.get(protocol_number, lambda _: print('handler not registered'))(ip_packet)
-        Util.print_last_line_of_output()
+        forwarding_log.debug("Running handler for protocol %d.", protocol_number)
+        self.metrics.handled(protocol_number, IPHeader.LENGTH + len(ip_packet.payload))
+        handler = self.protocol_switcher.get(protocol_number)
+        if handler is None:
+            forwarding_log.debug("No handler registered for protocol %d", protocol_number)
+            self.metrics.dropped('no_handler')
+            return
+        handler(ip_packet)
 
     def print_handler(self, ip_packet):
-        print("PRINT HANDLER CALLED")
-        print(ip_packet.payload)
-        print("-------------------------")
+        forwarding_log.debug("Print handler called on %s", ip_packet)
+        print(ip_packet.payload.decode(errors='replace'))
+        Util.print_last_line_of_output()
 
     def route_handler(self, ip_packet):
-        print(f"ROUTE HANDLER CALLED ON {ip_packet}")
+        forwarding_log.debug("Route handler called on %s", ip_packet)
         destination_ip = ip_packet.header.dst_addr
         if self._is_my_packet(destination_ip):
             print("My Packet Received:")
-            print(ip_packet.payload)
+            print(ip_packet.payload.decode(errors='replace'))
+            Util.print_last_line_of_output()
             return
-        interface = self._find_route(destination_ip)
-        print(interface)
-        print("-------------------------")
-
-        self.socket.sendto(pickle.dumps(ip_packet),
-                           interface.addr.to_tuple())
+        forwarding_log.debug("Forwarding to %s", destination_ip)
+        self._forward(ip_packet)
 
     def routing_table_update_handler(self, ip_packet):
-        self.down_interfaces_list.clear()
         interface_to_neighbor = self._find_interface(dest_ip=ip_packet.header.src_addr)
-        neighbor_routing_table = pickle.loads(ip_packet.payload)
-        changed = self._update_routing_table(neighbor_routing_table, interface_to_neighbor)
+        if interface_to_neighbor is None:
+            return
+        try:
+            neighbor_routing_table, withdrawn = self._unpack_routing_table(interface_to_neighbor, ip_packet.payload)
+        except PAYLOAD_ERRORS as e:
+            self._drop_malformed(ip_packet, interface_to_neighbor, e)
+            return
+        if neighbor_routing_table is None:
+            return
+        changed = not interface_to_neighbor.is_up and self._revive_interface(interface_to_neighbor)
+        changed = self._withdraw_routes(withdrawn, interface_to_neighbor) or changed
+        changed = self._confirm_provisional_routes(interface_to_neighbor, neighbor_routing_table) or changed
+        changed = self._update_routing_table(neighbor_routing_table, interface_to_neighbor) or changed
         if changed:
-            self._broadcast_routing_table_to_neighbors(ROUTING_TABLE_UPDATE_PROTOCOL)
+            self._advertise_changes()
+
+    def routing_table_delta_handler(self, ip_packet):
+        interface_to_neighbor = self._find_interface(dest_ip=ip_packet.header.src_addr)
+        if interface_to_neighbor is None or not interface_to_neighbor.is_up:
+            return
+        try:
+            delta = RoutingTableDelta.from_bytes(ip_packet.payload)
+        except PAYLOAD_ERRORS as e:
+            # the changes it carried are lost as surely as if it never arrived
+            self._drop_malformed(ip_packet, interface_to_neighbor, e)
+            self._request_routing_table(interface_to_neighbor)
+            return
+        expected = self._expected_sequence.get(interface_to_neighbor.my_virt_ip)
+        if delta.sequence != expected:
+            control_log.info("Update %d from %s is out of sequence (expected %s), requesting full table",
+                             delta.sequence, ip_packet.header.src_addr, expected)
+            self._request_routing_table(interface_to_neighbor)
+            return
+        self._expected_sequence[interface_to_neighbor.my_virt_ip] = (delta.sequence + 1) & 0xFFFFFFFF
+
+        neighbor_routing_table = self.neighbor_tables[interface_to_neighbor.my_virt_ip]
+        for node, routing_table_item in delta.changed.items():
+            neighbor_routing_table[node] = routing_table_item
+        for node in delta.withdrawn:
+            if node in neighbor_routing_table:
+                del neighbor_routing_table[node]
+
+        changed_routes, withdrawn = delta.changed, delta.withdrawn
+        if neighbor_routing_table.has_prefixes():
+            # a prefix stands for the host routes it covers, which are what our own table holds
+            try:
+                changed_routes, withdrawn = neighbor_routing_table.host_routes(chain(delta.changed, delta.withdrawn))
+            except ValueError as e:
+                self._drop_malformed(ip_packet, interface_to_neighbor, e)
+                self._request_routing_table(interface_to_neighbor)
+                return
+        changed = self._withdraw_routes(withdrawn, interface_to_neighbor)
+        changed = self._update_routing_table(changed_routes, interface_to_neighbor) or changed
+        if changed:
+            self._advertise_changes()
+
+    def _request_routing_table(self, interface_to_neighbor):
+        ip_packet = IPPacket(src_ip=interface_to_neighbor.my_virt_ip,
+                             dest_ip=interface_to_neighbor.peer_virt_ip,
+                             protocol_num=ROUTING_TABLE_REQUEST_PROTOCOL,
+                             payload=b"")
+        self._send_packet(ip_packet, interface_to_neighbor)
+
+    def link_state_handler(self, ip_packet):
+        interface = self._find_interface(dest_ip=ip_packet.header.src_addr)
+        if interface is None or not interface.is_up:
+            return
+        try:
+            self.link_state.receive(ip_packet.payload, interface)
+        except ValueError as e:
+            self._drop_malformed(ip_packet, interface, e)
+
+    def _drop_malformed(self, ip_packet, interface, error):
+        control_log.warning("Dropping malformed %s from %s: %s", PROTOCOL_NAMES.get(ip_packet.header.protocol),
+                            ip_packet.header.src_addr, error)
+        self.metrics.dropped('malformed', interface)
+
+    def _send_link_state(self, interface, payload):
+        ip_packet = IPPacket(src_ip=interface.my_virt_ip,
+                             dest_ip=interface.peer_virt_ip,
+                             protocol_num=LINK_STATE_PROTOCOL,
+                             payload=payload)
+        self._send_packet(ip_packet, interface)
+
+    def routing_table_request_handler(self, ip_packet):
+        interface_to_neighbor = self._find_interface(dest_ip=ip_packet.header.src_addr)
+        if interface_to_neighbor is None or not interface_to_neighbor.is_up:
+            return
+        self._send_routing_table(interface_to_neighbor, ROUTING_TABLE_UPDATE_PROTOCOL)
 
-    def process_user_input(self):
+    def process_user_input(self, line=None):
         try:
-            cmd, *args = input().split()
+            cmd, *args = (input() if line is None else line).split()
         except ValueError:
             print("Please enter a command.")
             return
         self.cmd_handler(cmd, args)
 
     def process_socket_reply(self):
-        packet_data, _ = self.socket.recvfrom(MAX_TRANSMISSION_UNIT)
-        ip_packet = pickle.loads(packet_data)
+        packet_data, sender = self.socket.recvfrom(MAX_TRANSMISSION_UNIT)
+        self.process_packet(packet_data, sender)
+
+    def process_handed_over_packet(self):
+        handed_over = self.data_plane.receive()
+        if handed_over is not None:
+            self.process_packet(*handed_over)
+
+    def process_packet(self, packet_data, sender=None):
+        """
+        :param sender: the (host, port) the datagram came from, used to count it against an interface
+        """
+        received_at = time.perf_counter_ns()
+        view = memoryview(packet_data)
+        incoming_interface = self._receiving_interface(view, sender)
+        self.metrics.received(incoming_interface, len(packet_data))
+        if self._fast_forward(view, received_at, incoming_interface):
+            return
+        try:
+            ip_packet = IPPacket.from_bytes(view)
+        except MalformedPacketError as e:
+            forwarding_log.warning("Dropped malformed packet: %s", e)
+            self.metrics.dropped('malformed', incoming_interface)
+            return
+        if ip_packet.header.is_fragment:
+            ip_packet.payload = self.reassembler.add(ip_packet.header, ip_packet.payload)
+            if ip_packet.payload is None:
+                return
+            ip_packet.header.more_fragments = False
+            ip_packet.header.fragment_offset = 0
         self.run_handler(ip_packet)
+        self.metrics.handler_latency.observe((time.perf_counter_ns() - received_at) // 1000)
+
+    def _receiving_interface(self, view, sender):
+        """
+        :return: the interface a datagram arrived on, None if its sender is no neighbor. Of parallel links
+                 to one neighbor it is the one the packet is addressed across; data passing through names
+                 no link, so it is counted against the first of them
+        """
+        interfaces = self._interfaces_by_address.get(sender)
+        if interfaces is None:
+            return None
+        if len(interfaces) > 1 and IPHeader.is_valid(view):
+            interface = self._interfaces_by_local_ip.get(IPHeader.peek_destination(view))
+            if interface in interfaces:
+                return interface
+        return interfaces[0]
+
+    def _fast_forward(self, view, received_at, incoming_interface):
+        """
+        Forwards a data packet that is not addressed to us by looking only at its header.
+        The received bytes are sent out with just the TTL and checksum updated; the payload is never parsed.
+        :return: True if the packet was forwarded (or dropped) here, False if it needs the full handler
+        """
+        if not IPHeader.is_valid(view) or IPHeader.peek_protocol(view) not in DATA_PROTOCOLS:
+            return False
+        destination_ip = IPHeader.peek_destination(view)
+        if self._is_my_packet(destination_ip):
+            return False
+        if IPHeader.peek_ttl(view) <= 1:
+            self.metrics.dropped('ttl_exceeded', incoming_interface)
+            self._send_time_exceeded(bytes(view[:IPHeader.LENGTH + TIME_EXCEEDED_QUOTE]))
+            return True
+        flow_hash = IPHeader.peek_flow_hash(view) if self.multipath.paths else 0
+        interface = self._find_route(destination_ip, flow_hash)
+        if interface is None:
+            forwarding_log.debug("No route to %s, packet dropped", destination_ip)
+            self.metrics.dropped('no_route', incoming_interface)
+            return True
+        packet = bytearray(view)
+        IPHeader.decrement_ttl(packet)
+        self.transport.sendto(packet, interface.addr.to_tuple())
+        self.metrics.sent(interface, len(packet))
+        self.metrics.forwarding_latency.observe((time.perf_counter_ns() - received_at) // 1000)
+        return True
 
     def run(self):
         while True:
-            input_ready, _, _ = select.select([self.socket, sys.stdin], [], [])
+            readers = [self.socket, sys.stdin]
+            if self.stats_endpoint is not None:
+                readers.append(self.stats_endpoint)
+            if self.data_plane is not None:
+                self.data_plane.publish()
+                readers.append(self.data_plane)
+            input_ready, _, _ = select.select(readers, [], [], self.scheduler.next_timeout())
             for sender in input_ready:
                 if sender == sys.stdin:
                     self.process_user_input()
                 elif sender == self.socket:
                     self.process_socket_reply()
-            time.sleep(0.1)
-
-    def _find_route(self, virtual_ip):
-        for interface in self.interfaces:
-            if interface.my_virt_ip == self.routing_table[virtual_ip].forwarding_interface:
-                return interface
+                elif sender == self.stats_endpoint:
+                    self.stats_endpoint.handle()
+                elif sender == self.data_plane:
+                    self.process_handed_over_packet()
+            self.scheduler.run_due()
+
+    def _find_route(self, virtual_ip, flow_hash=0):
+        """
+        :param flow_hash: chooses among equal-cost next hops; packets of one flow should pass the same value
+        :return: the interface to forward packets for virtual_ip to, or None if there is no route
+        """
+        return self.fib.lookup(virtual_ip, flow_hash)
+
+    def _flow_hash(self, ip_packet):
+        if not self.multipath.paths:
+            return 0
+        header = ip_packet.header
+        return IPHeader.flow_hash(header.src_addr, header.dst_addr, int(header.protocol),
+                                  b"" if header.is_fragment else ip_packet.payload)
+
+    def _send_towards(self, ip_packet):
+        interface = self._find_route(ip_packet.header.dst_addr, self._flow_hash(ip_packet))
+        if interface is None:
+            forwarding_log.debug("No route to %s, packet dropped", ip_packet.header.dst_addr)
+            self.metrics.dropped('no_route')
+            return
+        self._send_packet(ip_packet, interface)
 
     def _is_my_packet(self, destination_ip):
-        for interface in self.interfaces:
-            if interface.my_virt_ip == destination_ip:
-                return True
-        return False
+        return destination_ip in self._interfaces_by_local_ip
@@ -5,3 +5,22 @@ TRACEROUTE_PROTOCOL = 111
 TRACEROUTE_PROTOCOL_RESULT = 112
 DOWN_PROTOCOL = 114
 UP_PROTOCOL = 115
+ROUTING_TABLE_DELTA_PROTOCOL = 116
+ROUTING_TABLE_REQUEST_PROTOCOL = 117
+LINK_STATE_PROTOCOL = 118
+# tells the source of a packet that its TTL ran out; carries the packet's header and first 8 payload bytes
+TIME_EXCEEDED_PROTOCOL = 119
+# generated load: flow id, sequence number and send time, padded to the requested size
+TRAFFIC_PROTOCOL = 120
+
+# payloads of these protocols start with a 16-bit flow id, which is hashed like a transport port so that
+# the flows between two nodes spread over equal-cost paths
+FLOW_ID_PROTOCOLS = frozenset({TRAFFIC_PROTOCOL})
+FLOW_ID_SIZE = 2
+
+# packets of these protocols are forwarded hop by hop without being parsed
+DATA_PROTOCOLS = frozenset({PRINT_PROTOCOL, ROUTE_PROTOCOL, TRACEROUTE_PROTOCOL, TRACEROUTE_PROTOCOL_RESULT,
+                            TRAFFIC_PROTOCOL})
+
+# protocol number -> the name of its constant, for stats output
+PROTOCOL_NAMES = {value: name for name, value in list(globals().items()) if name.isupper() and isinstance(value, int)}
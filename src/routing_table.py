@@ -1,4 +1,22 @@
+import bisect
+import functools
+import struct
+import sys
+from array import array
+from itertools import chain, repeat
+
+import fib
+from fib import ADDRESS_BITS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 class RoutingTableItem:
+    __slots__ = ('distance', 'forwarding_interface')
+
     def __init__(self, distance, forwarding_interface):
         self.distance = distance
         self.forwarding_interface = forwarding_interface
@@ -7,33 +25,717 @@ class RoutingTableItem:
         return f"with distance={self.distance} using interface {self.forwarding_interface}"
 
 
+# a full table goes out in chunks small enough for one datagram each: its sequence number, the
+# chunk's index and the number of chunks precede each
+TABLE_CHUNK_FORMAT = struct.Struct('!IHH')
+TABLE_CHUNK_SIZE = 60000
+# a neighbor's table is not buffered beyond this many chunks
+MAX_TABLE_CHUNKS = 256
+# a network has few enough addresses that converting each of them once is enough
+ip_to_int = functools.lru_cache(maxsize=1 << 16)(fib.ip_to_int)
+int_to_ip = functools.lru_cache(maxsize=1 << 16)(fib.int_to_ip)
+# array type codes of the sizes the wire format uses
+ADDRESS_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+DISTANCE_TYPECODE = 'H'
+LENGTH_TYPECODE = 'B'
+# a prefix on the wire: its position among the routes and its length
+PREFIX_SIZE = 3
+# prefix lengths fit in the low bits of a sort key, below the address
+LENGTH_BITS = 6
+# smaller tables are merged in Python; converting them to numpy arrays would cost more than it saves
+VECTORIZE_THRESHOLD = 64
+# inserting more routes than this at once rebuilds the arrays instead of shifting them for every route
+MAX_SINGLE_INSERTS = 32
+# routes are never summarized into, nor accepted as, prefixes shorter than this: a neighbor's prefix
+# is expanded into the addresses it covers
+MIN_PREFIX_LENGTH = 16
+# a neighbor's prefixes are never expanded into more host routes than this, however many it sends
+MAX_EXPANDED_ROUTES = 1 << 16
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def parse_destination(node):
+    """
+    :param node: "a.b.c.d" for a host or "a.b.c.d/len" for a CIDR prefix
+    :return: the network address as an int and the prefix length
+    """
+    if '/' in node:
+        return fib.parse_prefix(node)
+    return ip_to_int(node), ADDRESS_BITS
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def format_destination(address, length):
+    if length == ADDRESS_BITS:
+        return int_to_ip(address)
+    return f"{int_to_ip(address)}/{length}"
+
+
+def _mask(length):
+    return (0xFFFFFFFF << (ADDRESS_BITS - length)) & 0xFFFFFFFF
+
+
+def covering_prefixes(node):
+    """
+    :param node: an address or prefix, as a string
+    :return: the prefixes node falls in that routes may be summarized into, longest first
+    """
+    address, length = parse_destination(node)
+    return [format_destination(address & _mask(prefix_length), prefix_length)
+            for prefix_length in range(length - 1, MIN_PREFIX_LENGTH - 1, -1)]
+
+
+def _to_network_order(values):
+    if sys.byteorder == 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_network_order(typecode, buffer):
+    values = array(typecode)
+    values.frombytes(buffer)
+    if sys.byteorder == 'little' and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+
+class DistanceVectorMerge:
+    """
+    What a neighbor's distance vector means for our routes, destination by destination. Destinations
+    are (address as int, prefix length) and distances include the hop to the neighbor.
+    """
+
+    __slots__ = ('improved', 'updated', 'lost', 'refreshed', 'equal_cost')
+
+    def __init__(self, improved=None, updated=None, lost=None, refreshed=None, equal_cost=None):
+        # (address, length, distance) of routes we lack, or have only longer or unreachable through another neighbor
+        self.improved = improved if improved is not None else []
+        # (address, length, distance) of routes through the neighbor whose distance changed but stayed finite
+        self.updated = updated if updated is not None else []
+        # destinations we route through the neighbor that it now says are unreachable
+        self.lost = lost if lost is not None else []
+        # destinations we route through the neighbor that it still reaches
+        self.refreshed = refreshed if refreshed is not None else []
+        # destinations the neighbor reaches as cheaply as the neighbor we route them through
+        self.equal_cost = equal_cost if equal_cost is not None else []
+
+
 class RoutingTable:
+    """
+    Routes kept in parallel arrays sorted by destination: the network address as a 32-bit integer,
+    the prefix length, the distance, and the index of the forwarding interface in a small table of
+    interned interfaces. A route costs 8 bytes and no Python objects, 9 once the table holds a prefix;
+    lookups are a binary search. The dict-like API still takes and returns destinations as strings,
+    "a.b.c.d" for a host and "a.b.c.d/len" for a prefix, and RoutingTableItems, built on demand.
+    """
+
+    # number of routes, number of interned forwarding interfaces, number of routes that are not host routes
+    HEADER_FORMAT = struct.Struct('!IHH')
+
     def __init__(self):
-        self.table = {}
+        self.destinations = array(ADDRESS_TYPECODE)
+        # None while every route is a host route
+        self.lengths = None
+        self.distances = array(DISTANCE_TYPECODE)
+        self.hops = array('H')
+        # interned forwarding interfaces, referred to by their index in hops
+        self.hop_addresses = []
+        self._hop_index = {}
+        # destinations written or removed since the last pop_changes()
+        self.changes = set()
+        # notified of every write and removal through route_changed(node, item) and route_removed(node)
+        self.observers = []
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+        for node, routing_table_item in self.items():
+            observer.route_changed(node, routing_table_item)
 
     def clear(self):
-        self.table.clear()
+        nodes = list(self)
+        self.changes.update(nodes)
+        for observer in self.observers:
+            for node in nodes:
+                observer.route_removed(node)
+        self.destinations = array(ADDRESS_TYPECODE)
+        self.lengths = None
+        self.distances = array(DISTANCE_TYPECODE)
+        self.hops = array('H')
+
+    def pop_changes(self):
+        changes, self.changes = self.changes, set()
+        return changes
+
+    def _lengths(self):
+        """
+        :return: the prefix length of every route
+        """
+        if self.lengths is None:
+            return array(LENGTH_TYPECODE, [ADDRESS_BITS]) * len(self.destinations)
+        return self.lengths
+
+    def _length(self, slot):
+        return ADDRESS_BITS if self.lengths is None else self.lengths[slot]
+
+    def _position(self, address, length):
+        """
+        :return: the index of the route to address/length in the arrays, or the one it would be inserted at
+        """
+        slot = bisect.bisect_left(self.destinations, address)
+        if self.lengths is not None:
+            count = len(self.destinations)
+            # a prefix sorts before the longer prefixes and the host route at the same address
+            while slot < count and self.destinations[slot] == address and self.lengths[slot] < length:
+                slot += 1
+        return slot
+
+    def _slot(self, address, length=ADDRESS_BITS):
+        """
+        :return: the index of the route to address/length in the arrays, or -1 if there is none
+        """
+        if self.lengths is None:
+            if length != ADDRESS_BITS:
+                return -1
+            slot = bisect.bisect_left(self.destinations, address)
+            return slot if slot < len(self.destinations) and self.destinations[slot] == address else -1
+        slot = self._position(address, length)
+        if slot < len(self.destinations) and self.destinations[slot] == address and self._length(slot) == length:
+            return slot
+        return -1
+
+    def _insert(self, slot, address, length, distance, hop):
+        if self.lengths is None and length != ADDRESS_BITS:
+            self.lengths = self._lengths()
+        self.destinations.insert(slot, address)
+        if self.lengths is not None:
+            self.lengths.insert(slot, length)
+        self.distances.insert(slot, distance)
+        self.hops.insert(slot, hop)
+
+    def _match(self, address, length=ADDRESS_BITS):
+        """
+        :return: the index of the most specific route covering address/length, or -1 if there is none
+        """
+        for prefix_length in range(length, -1, -1):
+            slot = self._slot(address & _mask(prefix_length), prefix_length)
+            if slot >= 0:
+                return slot
+        return -1
+
+    def lookup(self, node):
+        """
+        Longest-prefix match, as forwarding does it.
+        :param node: an address or prefix, as a string
+        :return: the RoutingTableItem of the most specific route covering node, or None
+        """
+        address, length = parse_destination(node)
+        slot = self._slot(address, length) if self.lengths is None else self._match(address, length)
+        return self._item(slot) if slot >= 0 else None
+
+    def _intern_hop(self, forwarding_interface):
+        index = self._hop_index.get(forwarding_interface)
+        if index is None:
+            index = self._hop_index[forwarding_interface] = len(self.hop_addresses)
+            self.hop_addresses.append(forwarding_interface)
+        return index
+
+    def _item(self, slot):
+        return RoutingTableItem(distance=self.distances[slot],
+                                forwarding_interface=self.hop_addresses[self.hops[slot]])
 
     def items(self):
-        return self.table.items()
+        return [(format_destination(address, length), self._item(slot))
+                for slot, (address, length) in enumerate(zip(self.destinations, self._lengths()))]
 
-    def get(self):
-        return self.table
+    def get(self, key, default=None):
+        try:
+            slot = self._slot(*parse_destination(key))
+        except (OSError, ValueError):
+            return default
+        return default if slot < 0 else self._item(slot)
 
     def __getitem__(self, key):
-        return self.table[key]
+        routing_table_item = self.get(key)
+        if routing_table_item is None:
+            raise KeyError(key)
+        return routing_table_item
 
     def __iter__(self):
-        return iter(self.table)
+        return iter([format_destination(address, length)
+                     for address, length in zip(self.destinations, self._lengths())])
 
     def __setitem__(self, key, value):
-        self.table[key] = value
+        address, length = parse_destination(key)
+        hop = self._intern_hop(value.forwarding_interface)
+        slot = self._position(address, length)
+        if slot < len(self.destinations) and self.destinations[slot] == address and self._length(slot) == length:
+            self.distances[slot] = value.distance
+            self.hops[slot] = hop
+        else:
+            self._insert(slot, address, length, value.distance, hop)
+        self.changes.add(key)
+        for observer in self.observers:
+            observer.route_changed(key, value)
 
     def __delitem__(self, key):
-        del self.table[key]
+        slot = self._slot(*parse_destination(key))
+        if slot < 0:
+            raise KeyError(key)
+        del self.destinations[slot]
+        if self.lengths is not None:
+            del self.lengths[slot]
+        del self.distances[slot]
+        del self.hops[slot]
+        self.changes.add(key)
+        for observer in self.observers:
+            observer.route_removed(key)
+
+    def merge(self, neighbor, via, infinity):
+        """
+        Lines a neighbor's table up with this one by destination; both are sorted, so with numpy
+        this is one searchsorted and a few comparisons over whole arrays, and without it a single
+        merge join. Nothing is changed: the result says which routes to update.
+        :param neighbor: the neighbor's table or the changed part of it
+        :param via: the my_virt_ip of the interface the neighbor is reached through
+        :return: a DistanceVectorMerge
+        """
+        via_hop = self._hop_index.get(via)
+        if numpy is not None and len(neighbor) >= VECTORIZE_THRESHOLD:
+            return self._merge_vectorized(neighbor, via_hop, infinity)
+        merge = DistanceVectorMerge()
+        destinations, lengths, distances, hops = self.destinations, self._lengths(), self.distances, self.hops
+        slot, count = 0, len(destinations)
+        for address, length, offered in zip(neighbor.destinations, neighbor._lengths(), neighbor.distances):
+            distance = min(offered + 1, infinity)
+            while slot < count and (destinations[slot] < address
+                                    or destinations[slot] == address and lengths[slot] < length):
+                slot += 1
+            if slot == count or destinations[slot] != address or lengths[slot] != length:
+                if distance < infinity:
+                    merge.improved.append((address, length, distance))
+                continue
+            current = distances[slot]
+            if current == 0:
+                continue
+            if hops[slot] == via_hop and current < infinity:
+                if distance >= infinity:
+                    merge.lost.append((address, length))
+                    continue
+                if distance != current:
+                    merge.updated.append((address, length, distance))
+                merge.refreshed.append((address, length))
+            elif distance < current:
+                merge.improved.append((address, length, distance))
+            elif distance == current < infinity:
+                merge.equal_cost.append((address, length))
+        return merge
+
+    def _sort_keys(self):
+        """
+        :return: the destinations and prefix lengths as one sorted numpy array of 64-bit keys
+        """
+        return (numpy.frombuffer(self.destinations, dtype=numpy.uint32).astype(numpy.uint64) << LENGTH_BITS) \
+            | numpy.frombuffer(self._lengths(), dtype=numpy.uint8)
+
+    def _merge_vectorized(self, neighbor, via_hop, infinity):
+        keys = neighbor._sort_keys()
+        addresses = numpy.frombuffer(neighbor.destinations, dtype=numpy.uint32)
+        lengths = numpy.frombuffer(neighbor._lengths(), dtype=numpy.uint8)
+        distances = numpy.minimum(numpy.frombuffer(neighbor.distances, dtype=numpy.uint16).astype(numpy.int32) + 1,
+                                  infinity)
+        if len(self.destinations):
+            ours = self._sort_keys()
+            slots = numpy.minimum(numpy.searchsorted(ours, keys), len(ours) - 1)
+            found = ours[slots] == keys
+            # a destination we have no route to compares as farther than unreachable
+            current = numpy.where(found, numpy.frombuffer(self.distances, dtype=numpy.uint16)[slots], infinity + 1)
+            through_neighbor = found & (numpy.frombuffer(self.hops, dtype=numpy.uint16)[slots] == via_hop) \
+                if via_hop is not None else numpy.zeros(len(addresses), dtype=bool)
+        else:
+            current = numpy.full(len(addresses), infinity + 1)
+            through_neighbor = numpy.zeros(len(addresses), dtype=bool)
+        through_neighbor &= (current > 0) & (current < infinity)
+        lost = through_neighbor & (distances >= infinity)
+        refreshed = through_neighbor & ~lost
+        updated = refreshed & (distances != current)
+        elsewhere = ~through_neighbor & (current != 0)
+        improved = elsewhere & (distances < current) & (distances < infinity)
+        equal_cost = elsewhere & (distances == current) & (current < infinity)
+        return DistanceVectorMerge(improved=list(zip(addresses[improved].tolist(), lengths[improved].tolist(),
+                                                     distances[improved].tolist())),
+                                   updated=list(zip(addresses[updated].tolist(), lengths[updated].tolist(),
+                                                    distances[updated].tolist())),
+                                   lost=list(zip(addresses[lost].tolist(), lengths[lost].tolist())),
+                                   refreshed=list(zip(addresses[refreshed].tolist(), lengths[refreshed].tolist())),
+                                   equal_cost=list(zip(addresses[equal_cost].tolist(),
+                                                       lengths[equal_cost].tolist())))
+
+    def update_many(self, routes, forwarding_interface):
+        """
+        Points every route in routes at forwarding_interface, writing the ones we have in place and
+        inserting the others in one pass.
+        :param routes: (address as int, prefix length, distance) sorted by address and length
+        :return: the destinations written, as strings
+        """
+        hop = self._intern_hop(forwarding_interface)
+        new = []
+        for address, length, distance in routes:
+            slot = self._slot(address, length)
+            if slot < 0:
+                new.append((address, length, distance))
+            else:
+                self.distances[slot] = distance
+                self.hops[slot] = hop
+        if new:
+            self._insert_many(new, hop)
+        written = set()
+        # observers only read the items, so routes at the same distance share one
+        items = {}
+        for address, length, distance in routes:
+            node = format_destination(address, length)
+            written.add(node)
+            routing_table_item = items.get(distance)
+            if routing_table_item is None:
+                routing_table_item = items[distance] = RoutingTableItem(distance=distance,
+                                                                        forwarding_interface=forwarding_interface)
+            for observer in self.observers:
+                observer.route_changed(node, routing_table_item)
+        self.changes |= written
+        return written
+
+    def _insert_many(self, routes, hop):
+        """
+        :param routes: (address as int, prefix length, distance) sorted by address and length, none of them
+                       in the table
+        """
+        if len(routes) <= MAX_SINGLE_INSERTS:
+            for address, length, distance in routes:
+                self._insert(self._position(address, length), address, length, distance, hop)
+            return
+        addresses, lengths, distances = zip(*routes)
+        if self.lengths is None and lengths.count(ADDRESS_BITS) != len(lengths):
+            self.lengths = self._lengths()
+        if numpy is not None:
+            keys = (numpy.array(addresses, dtype=numpy.uint64) << LENGTH_BITS) \
+                | numpy.array(lengths, dtype=numpy.uint64)
+            slots = numpy.searchsorted(self._sort_keys(), keys)
+            columns = [(self.destinations, addresses, numpy.uint32), (self.distances, distances, numpy.uint16),
+                       (self.hops, [hop] * len(routes), numpy.uint16)]
+            if self.lengths is not None:
+                columns.append((self.lengths, lengths, numpy.uint8))
+            merged = [numpy.insert(numpy.frombuffer(values, dtype=dtype), slots, numpy.array(inserted, dtype=dtype))
+                      for values, inserted, dtype in columns]
+            self.destinations, self.distances, self.hops, *lengths_column = (
+                array(values.typecode, column.tobytes()) for (values, _, _), column in zip(columns, merged))
+            if lengths_column:
+                self.lengths, = lengths_column
+            return
+        merged = sorted(chain(zip(self.destinations, self._lengths(), self.distances, self.hops),
+                              zip(addresses, lengths, distances, repeat(hop))))
+        self.destinations = array(ADDRESS_TYPECODE, [route[0] for route in merged])
+        if self.lengths is not None:
+            self.lengths = array(LENGTH_TYPECODE, [route[1] for route in merged])
+        self.distances = array(DISTANCE_TYPECODE, [route[2] for route in merged])
+        self.hops = array('H', [route[3] for route in merged])
+
+    def summarize(self, infinity):
+        """
+        Collapses routes through the same interface at the same distance into the CIDR prefixes that
+        cover them exactly, for advertising: two sibling blocks become their parent, which then pairs
+        with its own sibling, and so on. A neighbor that expands a prefix learns exactly the routes it
+        stands for, so summarizing never changes what the neighbor routes. Routes to our own addresses
+        and unreachable ones are kept.
+        :return: a new table, or this one if nothing collapsed
+        """
+        groups = {}
+        for address, length, distance, hop in zip(self.destinations, self._lengths(), self.distances, self.hops):
+            if 0 < distance < infinity:
+                groups.setdefault(hop, {})[(address, length)] = distance
+        existing = set(zip(self.destinations, self._lengths()))
+        summarized = {}
+        collapsed = False
+        for hop, routes in groups.items():
+            if len(routes) < 2:
+                continue
+            removed = _collapse(routes, existing)
+            if removed:
+                collapsed = True
+                summarized[hop] = (routes, removed)
+        if not collapsed:
+            return self
+
+        merged = []
+        for address, length, distance, hop in zip(self.destinations, self._lengths(), self.distances, self.hops):
+            routes, removed = summarized.get(hop, (None, ()))
+            if (address, length) in removed:
+                continue
+            if routes is None or not 0 < distance < infinity:
+                merged.append((address, length, distance, hop))
+        for hop, (routes, removed) in summarized.items():
+            merged.extend((address, length, distance, hop) for (address, length), distance in routes.items())
+        merged.sort()
+
+        summary = RoutingTable()
+        summary.destinations = array(ADDRESS_TYPECODE, [route[0] for route in merged])
+        summary.lengths = array(LENGTH_TYPECODE, [route[1] for route in merged])
+        summary.distances = array(DISTANCE_TYPECODE, [route[2] for route in merged])
+        summary.hops = array('H', [route[3] for route in merged])
+        summary.hop_addresses = list(self.hop_addresses)
+        summary._hop_index = dict(self._hop_index)
+        return summary
+
+    def host_routes(self, nodes):
+        """
+        Resolves every address covered by one of nodes through longest-prefix match, which is how a
+        prefix a neighbor summarized its routes into is merged: as the host routes it stands for.
+        :param nodes: destinations, as strings
+        :return: a table of the resolved host routes, and the addresses no route covers as dotted-quad strings
+        :raise ValueError: if nodes cover more than MAX_EXPANDED_ROUTES addresses
+        """
+        blocks = [parse_destination(node) for node in nodes]
+        if sum(1 << (ADDRESS_BITS - length) for _, length in blocks) > MAX_EXPANDED_ROUTES:
+            raise ValueError(f"prefixes cover more than {MAX_EXPANDED_ROUTES} addresses")
+        addresses = set()
+        for address, length in blocks:
+            addresses.update(range(address, address + (1 << (ADDRESS_BITS - length))))
+        slots = []
+        unreachable = []
+        for address in sorted(addresses):
+            slot = self._slot(address) if self.lengths is None else self._match(address)
+            if slot < 0:
+                unreachable.append(int_to_ip(address))
+            else:
+                slots.append((address, slot))
+        routes = RoutingTable()
+        routes.destinations = array(ADDRESS_TYPECODE, [address for address, _ in slots])
+        routes.distances = array(DISTANCE_TYPECODE, [self.distances[slot] for _, slot in slots])
+        routes.hops = array('H', [self.hops[slot] for _, slot in slots])
+        routes.hop_addresses = list(self.hop_addresses)
+        routes._hop_index = dict(self._hop_index)
+        return routes, unreachable
+
+    def expanded(self):
+        """
+        :return: the host routes this table stands for; the table itself if it has no prefixes
+        """
+        return self.host_routes(self)[0] if self.has_prefixes() else self
+
+    def has_prefixes(self):
+        return self.lengths is not None and self.lengths.count(ADDRESS_BITS) != len(self.lengths)
+
+    def __contains__(self, key):
+        try:
+            return self._slot(*parse_destination(key)) >= 0
+        except (OSError, ValueError):
+            return False
+
+    def __len__(self):
+        return len(self.destinations)
+
+    def memory_size(self):
+        """
+        :return: an estimate of the bytes held by the table
+        """
+        return sys.getsizeof(self.destinations) + sys.getsizeof(self.distances) + sys.getsizeof(self.hops) \
+               + (sys.getsizeof(self.lengths) if self.lengths is not None else 0) \
+               + sys.getsizeof(self.hop_addresses) + sys.getsizeof(self._hop_index) \
+               + sum(sys.getsizeof(address) for address in self.hop_addresses)
+
+    def to_bytes(self, poisoned_interface=None, infinity=None):
+        """
+        The header is followed by the interned forwarding interfaces, then the destinations, the
+        positions and lengths of the prefixes among them (or every length, if that is shorter),
+        distances and interface indexes as arrays in network byte order. Indexes take one byte while
+        there are at most 256 interfaces.
+        :param poisoned_interface: routes learned through this interface are written with distance infinity
+                                   (split horizon with poisoned reverse)
+        """
+        distances = self.distances
+        poisoned = self._hop_index.get(poisoned_interface)
+        if poisoned is not None:
+            distances = array(DISTANCE_TYPECODE, distances)
+            for slot, hop in enumerate(self.hops):
+                if hop == poisoned and distances[slot] > 0:
+                    distances[slot] = infinity
+        hop_addresses = array(ADDRESS_TYPECODE, [ip_to_int(address) for address in self.hop_addresses])
+        hops = array('B', self.hops) if len(self.hop_addresses) <= 256 else self.hops
+        lengths = self._lengths()
+        prefixes = _prefixes(lengths)
+        return RoutingTable.HEADER_FORMAT.pack(len(self.destinations), len(self.hop_addresses), len(prefixes)) \
+               + _to_network_order(hop_addresses) \
+               + _to_network_order(self.destinations) \
+               + _pack_prefixes(prefixes, lengths) \
+               + _to_network_order(distances) \
+               + _to_network_order(hops)
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        header_size = cls.HEADER_FORMAT.size
+        if len(buffer) < header_size:
+            raise ValueError("truncated routing table")
+        count, hop_count, prefix_count = cls.HEADER_FORMAT.unpack_from(buffer)
+        hop_typecode = 'B' if hop_count <= 256 else 'H'
+        sizes = [4 * hop_count, 4 * count, _prefixes_size(prefix_count, count), 2 * count,
+                 array(hop_typecode).itemsize * count]
+        if len(buffer) != header_size + sum(sizes):
+            raise ValueError("truncated routing table")
+        offset = header_size
+        parts = []
+        for typecode, size in zip((ADDRESS_TYPECODE, ADDRESS_TYPECODE, None, DISTANCE_TYPECODE, hop_typecode), sizes):
+            parts.append(buffer[offset:offset + size] if typecode is None
+                         else _from_network_order(typecode, buffer[offset:offset + size]))
+            offset += size
+        hop_addresses, destinations, prefixes, distances, hops = parts
+        lengths = _unpack_prefixes(prefixes, prefix_count, count)
+        if count and max(hops) >= hop_count:
+            raise ValueError("routing table entry refers to a missing interface")
+        if lengths is None:
+            out_of_order = any(destinations[slot] >= destinations[slot + 1] for slot in range(count - 1))
+        else:
+            out_of_order = any((destinations[slot], lengths[slot]) >= (destinations[slot + 1], lengths[slot + 1])
+                               for slot in range(count - 1))
+        if out_of_order:
+            raise ValueError("routing table entries out of order")
+
+        routing_table = cls()
+        routing_table.destinations = destinations
+        routing_table.lengths = lengths
+        routing_table.distances = distances
+        routing_table.hops = hops if hop_typecode == 'H' else array('H', hops)
+        routing_table.hop_addresses = [int_to_ip(address) for address in hop_addresses]
+        routing_table._hop_index = {address: index for index, address in enumerate(routing_table.hop_addresses)}
+        return routing_table
 
     def __str__(self):
         retval = "DEST\t\tDISTANCE\tFORWARDING INTERFACE\n"
         retval += "\n".join([f"{node}\t\t{routing_table_item.distance}\t{routing_table_item.forwarding_interface}"
-                             for node, routing_table_item in self.table.items()])
+                             for node, routing_table_item in self.items()])
         return retval
+
+
+def _collapse(routes, existing):
+    """
+    Replaces sibling blocks at the same distance in routes with their parent, longest prefixes first,
+    then drops routes covered by a shorter prefix at the same distance.
+    :param routes: (address, length) -> distance of routes through one interface; changed in place
+    :param existing: (address, length) of every route in the table; a block that has a route through
+                     another interface is not collapsed
+    :return: the keys that were removed from routes
+    """
+    removed = set()
+    by_length = {}
+    for address, length in routes:
+        by_length.setdefault(length, set()).add(address)
+    for length in range(ADDRESS_BITS, MIN_PREFIX_LENGTH, -1):
+        addresses = by_length.get(length)
+        if not addresses:
+            continue
+        bit = 1 << (ADDRESS_BITS - length)
+        for address in sorted(addresses):
+            sibling = address | bit
+            parent = (address, length - 1)
+            if address & bit or sibling not in addresses or parent in existing and parent not in routes:
+                continue
+            distance = routes[(address, length)]
+            if routes[(sibling, length)] != distance or routes.get(parent, distance) != distance:
+                continue
+            del routes[(address, length)], routes[(sibling, length)]
+            removed.update(((address, length), (sibling, length)))
+            removed.discard(parent)
+            routes[parent] = distance
+            by_length.setdefault(length - 1, set()).add(address)
+    shorter = sorted(by_length)
+    for (address, length), distance in list(routes.items()):
+        for covering in shorter:
+            if covering >= length:
+                break
+            if routes.get((address & _mask(covering), covering)) == distance:
+                del routes[(address, length)]
+                removed.add((address, length))
+                break
+    return removed
+
+
+def _prefixes(lengths):
+    """
+    :return: the positions of the routes in lengths that are not host routes
+    """
+    if lengths.count(ADDRESS_BITS) == len(lengths):
+        return []
+    return [slot for slot, length in enumerate(lengths) if length != ADDRESS_BITS]
+
+
+def _prefixes_size(prefix_count, count):
+    """
+    :return: the bytes the prefix lengths of count routes take on the wire when prefix_count of them are not
+             host routes: their positions and lengths while that is smaller than one length for every route
+    """
+    return min(PREFIX_SIZE * prefix_count, count)
+
+
+def _pack_prefixes(prefixes, lengths):
+    if _prefixes_size(len(prefixes), len(lengths)) == len(lengths):
+        return lengths.tobytes()
+    return _to_network_order(array('H', prefixes)) + bytes(lengths[slot] for slot in prefixes)
+
+
+def _unpack_prefixes(buffer, prefix_count, count):
+    """
+    :return: the prefix length of each of count routes, or None if they are all host routes
+    """
+    if not prefix_count:
+        return None
+    if _prefixes_size(prefix_count, count) == count:
+        lengths = _from_network_order(LENGTH_TYPECODE, buffer)
+    else:
+        lengths = array(LENGTH_TYPECODE, [ADDRESS_BITS]) * count
+        slots = _from_network_order('H', buffer[:2 * prefix_count])
+        for slot, length in zip(slots, buffer[2 * prefix_count:]):
+            if slot >= count:
+                raise ValueError("routing table entry has an invalid prefix length")
+            lengths[slot] = length
+    if count and not MIN_PREFIX_LENGTH <= min(lengths) <= max(lengths) <= ADDRESS_BITS:
+        raise ValueError("routing table entry has an invalid prefix length")
+    return lengths
+
+
+class RoutingTableDelta:
+    # sequence number, number of withdrawn destinations, number of those that are prefixes
+    HEADER_FORMAT = struct.Struct('!IHH')
+
+    def __init__(self, sequence, changed, withdrawn):
+        """
+        :param sequence: the per-neighbor sequence number of this advertisement
+        :param changed: a RoutingTable holding only the entries that changed since the previous advertisement
+        :param withdrawn: destinations that are no longer in the table, as strings
+        """
+        self.sequence = sequence
+        self.changed = changed
+        self.withdrawn = withdrawn
+
+    def to_bytes(self, poisoned_interface=None, infinity=None):
+        withdrawn = [parse_destination(node) for node in self.withdrawn]
+        lengths = array(LENGTH_TYPECODE, [length for _, length in withdrawn])
+        # like in the table, the positions and lengths of prefixes follow the addresses
+        prefixes = _prefixes(lengths)
+        return RoutingTableDelta.HEADER_FORMAT.pack(self.sequence, len(withdrawn), len(prefixes)) \
+               + _to_network_order(array(ADDRESS_TYPECODE, [address for address, _ in withdrawn])) \
+               + _pack_prefixes(prefixes, lengths) \
+               + self.changed.to_bytes(poisoned_interface, infinity)
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        if len(buffer) < cls.HEADER_FORMAT.size:
+            raise ValueError("truncated routing table delta")
+        sequence, withdrawn_count, prefix_count = cls.HEADER_FORMAT.unpack_from(buffer)
+        start = cls.HEADER_FORMAT.size
+        prefixes_start = start + 4 * withdrawn_count
+        end = prefixes_start + _prefixes_size(prefix_count, withdrawn_count)
+        if len(buffer) < end:
+            raise ValueError("truncated routing table delta")
+        lengths = _unpack_prefixes(buffer[prefixes_start:end], prefix_count, withdrawn_count) \
+            or [ADDRESS_BITS] * withdrawn_count
+        addresses = _from_network_order(ADDRESS_TYPECODE, buffer[start:prefixes_start])
+        withdrawn = [format_destination(address, length) for address, length in zip(addresses, lengths)]
+        return cls(sequence, RoutingTable.from_bytes(buffer[end:]), withdrawn)
@@ -0,0 +1,147 @@
+import math
+import time
+
+
+class Timer:
+    __slots__ = ('deadline', 'tick', 'interval', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, tick, interval, callback, args):
+        self.deadline = deadline
+        self.tick = tick
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return f"Timer({getattr(self.callback, '__name__', self.callback)} at {self.deadline:.3f})"
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: timers are hashed into slots by the tick they expire on, so scheduling and
+    cancelling are O(1) and advancing the clock only touches the slots that came due.
+    Timers fire no earlier than their deadline and at most one tick late.
+    """
+
+    DEFAULT_TICK = 0.05
+    DEFAULT_SLOTS = 2048
+
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.start = clock()
+        self.slot_count = slots
+        # slot index -> set of timers; empty slots are dropped so that idle wheels stay small
+        self.slots = {}
+        self.current_tick = 0
+        self.pending = 0
+        # a lower bound on the earliest scheduled tick; None when it has to be searched for
+        self._earliest_tick = None
+
+    def call_later(self, delay, callback, *args):
+        return self._schedule(self.clock() + max(delay, 0), None, callback, args)
+
+    def call_every(self, interval, callback, *args):
+        return self._schedule(self.clock() + interval, interval, callback, args)
+
+    def _schedule(self, deadline, interval, callback, args):
+        tick = max(self.current_tick + 1, math.ceil((deadline - self.start) / self.tick))
+        timer = Timer(deadline, tick, interval, callback, args)
+        self._slot(tick).add(timer)
+        self.pending += 1
+        if self._earliest_tick is not None and tick < self._earliest_tick:
+            self._earliest_tick = tick
+        return timer
+
+    def cancel(self, timer):
+        if timer.cancelled:
+            return
+        timer.cancel()
+        index = timer.tick % self.slot_count
+        slot = self.slots.get(index)
+        if slot is not None and timer in slot:
+            slot.discard(timer)
+            self.pending -= 1
+            if not slot:
+                del self.slots[index]
+
+    def _slot(self, tick):
+        index = tick % self.slot_count
+        slot = self.slots.get(index)
+        if slot is None:
+            slot = self.slots[index] = set()
+        return slot
+
+    def next_deadline(self):
+        """
+        :return: the clock time at which run_due() next has work to do, or None if nothing is scheduled
+        """
+        if not self.pending:
+            return None
+        if self._earliest_tick is None:
+            self._earliest_tick = self._find_earliest_tick()
+        return self.start + self._earliest_tick * self.tick
+
+    def next_timeout(self):
+        deadline = self.next_deadline()
+        return None if deadline is None else max(deadline - self.clock(), 0)
+
+    def _find_earliest_tick(self):
+        if len(self.slots) * 8 < self.slot_count:
+            return min(timer.tick for slot in self.slots.values() for timer in slot)
+        for tick in range(self.current_tick + 1, self.current_tick + 1 + self.slot_count):
+            slot = self.slots.get(tick % self.slot_count)
+            if slot and any(timer.tick == tick for timer in slot):
+                return tick
+        return min(timer.tick for slot in self.slots.values() for timer in slot)
+
+    def run_due(self, now=None):
+        """
+        Fires every timer whose deadline has passed, in deadline order.
+        :return: the number of timers fired
+        """
+        now = self.clock() if now is None else now
+        # the epsilon keeps float rounding from leaving a timer due exactly at next_deadline() unfired
+        target_tick = math.floor((now - self.start) / self.tick + 1e-9)
+        if target_tick <= self.current_tick:
+            return 0
+
+        due = []
+        if target_tick - self.current_tick >= self.slot_count or len(self.slots) < target_tick - self.current_tick:
+            indexes = list(self.slots)
+        else:
+            indexes = [tick % self.slot_count for tick in range(self.current_tick + 1, target_tick + 1)]
+        for index in indexes:
+            slot = self.slots.get(index)
+            if not slot:
+                continue
+            expired = [timer for timer in slot if timer.tick <= target_tick]
+            slot.difference_update(expired)
+            if not slot:
+                del self.slots[index]
+            due.extend(expired)
+        self.current_tick = target_tick
+        self.pending -= len(due)
+        self._earliest_tick = None
+
+        due.sort(key=lambda timer: timer.deadline)
+        for timer in due:
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:
+                self._reschedule(timer, now)
+            timer.callback(*timer.args)
+        return len(due)
+
+    def _reschedule(self, timer, now):
+        # intervals missed while the clock was not advanced are skipped rather than replayed
+        timer.deadline += timer.interval
+        if timer.deadline <= now:
+            timer.deadline = now + timer.interval
+        timer.tick = max(self.current_tick + 1, math.ceil((timer.deadline - self.start) / self.tick))
+        self._slot(timer.tick).add(timer)
+        self.pending += 1
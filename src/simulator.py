@@ -0,0 +1,357 @@
+import contextlib
+import heapq
+import io
+import os
+import random
+import sys
+from collections import Counter
+
+from address import Address
+from fib import int_to_ip, ip_to_int
+from interface import Interface
+from ip import IPHeader
+from node import Node
+
+SIMULATOR_HOST = 'localhost'
+FIRST_PORT = 5000
+FIRST_VIRTUAL_IP = '192.168.0.1'
+DEFAULT_LINK_DELAY = 0.001
+
+
+def parse_net_file(path):
+    """
+    :param path: a .net file with "node <name> <host>" and "<name> <-> <name>" lines
+    :return: the node names in file order and the list of links as (name, name) pairs
+    """
+    names = []
+    links = []
+    with open(path) as f:
+        for line in f:
+            words = line.split()
+            if len(words) >= 2 and words[0] == 'node':
+                names.append(words[1])
+            elif len(words) == 3 and words[1] == '<->':
+                links.append((words[0], words[2]))
+    known = set(names)
+    for a, b in links:
+        if a not in known or b not in known:
+            raise ValueError(f"link {a} <-> {b} names an undeclared node")
+    return names, links
+
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+class NetworkStats:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.messages_by_protocol = Counter()
+        self.bytes_by_protocol = Counter()
+        # the longest chain of messages each triggered by the delivery of the one before it
+        self.rounds = 0
+        # the most memory the routing tables of all nodes held at once, neighbors' tables included
+        self.peak_table_bytes = 0
+
+    def reset(self):
+        self.__init__()
+
+    def as_dict(self):
+        return {
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'dropped': self.dropped,
+            'rounds': self.rounds,
+            'peak_table_bytes': self.peak_table_bytes,
+            'messages_by_protocol': dict(self.messages_by_protocol),
+            'bytes_by_protocol': dict(self.bytes_by_protocol),
+        }
+
+
+class MemoryTransport:
+    """
+    Stands in for a node's UDP socket: sendto() hands the datagram to the simulated network.
+    """
+
+    def __init__(self, network, address):
+        """
+        :param address: the (host, port) of the node using it, which receivers see as the sender
+        """
+        self.network = network
+        self.address = address
+
+    def sendto(self, data, address):
+        self.network.transmit(bytes(data), address, self.address)
+
+
+class Simulator:
+    """
+    Runs many Nodes in one process over an in-memory network and a shared virtual clock.
+    Datagrams and timers are processed strictly in time order, so a run is fully determined by
+    the topology, the link delay and the seed.
+    """
+
+    def __init__(self, names, links, link_delay=DEFAULT_LINK_DELAY, seed=0, quiet=True, **node_options):
+        """
+        :param node_options: passed on to every Node (e.g. incremental_updates, infinity)
+        """
+        random.seed(seed)
+        self.clock = VirtualClock()
+        self.link_delay = link_delay
+        self.output = open(os.devnull, 'w') if quiet else sys.stdout
+        self.stats = NetworkStats()
+        self.nodes = {}
+        self._nodes_by_port = {}
+        # (delivery time, order, port, data, sender, round)
+        self._in_flight = []
+        # (deadline, order, node name); stale entries are skipped when popped
+        self._timers = []
+        self._order = 0
+        self._round = 0
+        self._table_bytes = {}
+        self.table_bytes = 0
+        self.node_options = node_options
+        # name -> (port, [(peer port, my virtual ip, peer virtual ip)]) to start the node from again
+        self._node_links = {}
+
+        ports = {name: FIRST_PORT + index for index, name in enumerate(names)}
+        self._node_links = {name: (ports[name], []) for name in names}
+        next_ip = ip_to_int(FIRST_VIRTUAL_IP)
+        for a, b in links:
+            ip_a, ip_b = int_to_ip(next_ip), int_to_ip(next_ip + 1)
+            next_ip += 2
+            self._node_links[a][1].append((ports[b], ip_a, ip_b))
+            self._node_links[b][1].append((ports[a], ip_b, ip_a))
+
+        for name in names:
+            self._start(name)
+        for node in self.nodes.values():
+            self._after_event(node)
+
+    def _start(self, name, **options):
+        port, links = self._node_links[name]
+        interfaces = [Interface(SIMULATOR_HOST, peer_port, my_ip, peer_ip) for peer_port, my_ip, peer_ip in links]
+        with self._output():
+            node = Node(name, clock=self.clock,
+                        links=(Address(SIMULATOR_HOST, port), interfaces),
+                        transport=MemoryTransport(self, (SIMULATOR_HOST, port)),
+                        **dict(self.node_options, **options))
+            node.register_default_handlers()
+        self.nodes[name] = node
+        self._nodes_by_port[port] = node
+        return node
+
+    @classmethod
+    def from_net_file(cls, path, **options):
+        names, links = parse_net_file(path)
+        return cls(names, links, **options)
+
+    def _output(self):
+        return contextlib.redirect_stdout(self.output)
+
+    def transmit(self, data, address, sender):
+        _, port = address
+        self._order += 1
+        heapq.heappush(self._in_flight,
+                       (self.clock.now + self.link_delay, self._order, port, data, sender, self._round + 1))
+        self.stats.messages += 1
+        self.stats.bytes += len(data)
+        if len(data) > IPHeader.PROTOCOL_OFFSET:
+            protocol = IPHeader.peek_protocol(data)
+            self.stats.messages_by_protocol[protocol] += 1
+            self.stats.bytes_by_protocol[protocol] += len(data)
+
+    def reset_stats(self):
+        self.stats.reset()
+        self.stats.peak_table_bytes = self.table_bytes
+
+    def _after_event(self, node):
+        self._watch_timers(node)
+        table_bytes = node.routing_table.memory_size() \
+                      + sum(table.memory_size() for table in node.neighbor_tables.values())
+        self.table_bytes += table_bytes - self._table_bytes.get(node.name, 0)
+        self._table_bytes[node.name] = table_bytes
+        self.stats.peak_table_bytes = max(self.stats.peak_table_bytes, self.table_bytes)
+
+    def _watch_timers(self, node):
+        deadline = node.scheduler.next_deadline()
+        if deadline is not None:
+            self._order += 1
+            heapq.heappush(self._timers, (deadline, self._order, node.name))
+
+    def _next_timer(self):
+        while self._timers:
+            deadline, _, name = self._timers[0]
+            node = self.nodes.get(name)
+            if node is not None and node.scheduler.next_deadline() == deadline:
+                return deadline
+            heapq.heappop(self._timers)
+        return None
+
+    @property
+    def pending_messages(self):
+        return len(self._in_flight)
+
+    def step(self):
+        """
+        Processes the next event: a datagram arrival or the due timers of one node.
+        :return: False if there was nothing left to do
+        """
+        timer_deadline = self._next_timer()
+        if self._in_flight and (timer_deadline is None or self._in_flight[0][0] <= timer_deadline):
+            delivery_time, _, port, data, sender, message_round = heapq.heappop(self._in_flight)
+            self.clock.now = max(self.clock.now, delivery_time)
+            node = self._nodes_by_port.get(port)
+            if node is None:
+                self.stats.dropped += 1
+                return True
+            self._round = message_round
+            self.stats.rounds = max(self.stats.rounds, message_round)
+            with self._output():
+                node.process_packet(data, sender)
+            self._round = 0
+            self._after_event(node)
+            return True
+        if timer_deadline is None:
+            return False
+        _, _, name = heapq.heappop(self._timers)
+        node = self.nodes[name]
+        self.clock.now = max(self.clock.now, timer_deadline)
+        with self._output():
+            node.scheduler.run_due(self.clock.now)
+        self._after_event(node)
+        return True
+
+    def run_until(self, time):
+        while True:
+            timer_deadline = self._next_timer()
+            next_event = min(t for t in (timer_deadline, self._in_flight[0][0] if self._in_flight else None)
+                             if t is not None) if (timer_deadline is not None or self._in_flight) else None
+            if next_event is None or next_event > time:
+                break
+            self.step()
+        self.clock.now = max(self.clock.now, time)
+
+    def run_until_quiet(self, max_events=None):
+        """
+        Processes events until no datagram is in flight, which for the routing protocols means the
+        network has converged; timers that come due along the way are run too.
+        :return: the number of events processed
+        """
+        events = 0
+        while self._in_flight and (max_events is None or events < max_events):
+            self.step()
+            events += 1
+        return events
+
+    def command(self, name, line):
+        """
+        Runs a CLI command on a node, e.g. command("A", "down 1").
+        :return: whatever the node printed
+        """
+        output = io.StringIO()
+        cmd, *args = line.split()
+        with contextlib.redirect_stdout(output):
+            self.nodes[name].cmd_handler(cmd, args)
+        self._after_event(self.nodes[name])
+        return output.getvalue()
+
+    def find_interface(self, name, peer):
+        """
+        :return: the interface of node name that faces node peer
+        """
+        peer_port = self.nodes[peer].addr.port
+        for interface in self.nodes[name].interfaces:
+            if interface.addr.port == peer_port:
+                return interface
+        raise KeyError(f"{name} and {peer} are not linked")
+
+    def link_down(self, name, peer):
+        return self.command(name, f"down {self.find_interface(name, peer).my_virt_ip}")
+
+    def link_up(self, name, peer):
+        return self.command(name, f"up {self.find_interface(name, peer).my_virt_ip}")
+
+    def remove_node(self, name):
+        """
+        Shuts a node down as the q command would, without exiting the process.
+        """
+        node = self.nodes.pop(name)
+        with self._output():
+            node.shutdown()
+        del self._nodes_by_port[node.addr.port]
+        self.table_bytes -= self._table_bytes.pop(name, 0)
+
+    def crash_node(self, name):
+        """
+        Stops a node without a word to its neighbors, as if its process was killed.
+        """
+        node = self.nodes.pop(name)
+        del self._nodes_by_port[node.addr.port]
+        self.table_bytes -= self._table_bytes.pop(name, 0)
+
+    def restart_node(self, name, **options):
+        """
+        Starts a node that crashed or quit again, with the links it had.
+        :param options: Node options for this node only, e.g. snapshot_path
+        """
+        self._after_event(self._start(name, **options))
+
+    def reachable_destinations(self, name):
+        node = self.nodes[name]
+        return {destination for destination, routing_table_item in node.routing_table.items()
+                if routing_table_item.distance < node.infinity}
+
+    def _live_links(self):
+        """
+        :return: {name: [(local interface, peer name)]} for links that are up at both ends
+        """
+        names_by_port = {node.addr.port: name for name, node in self.nodes.items()}
+        up_addresses = {interface.my_virt_ip for node in self.nodes.values() for interface in node.up_interfaces}
+        live = {name: [] for name in self.nodes}
+        for name, node in self.nodes.items():
+            for interface in node.up_interfaces:
+                peer = names_by_port.get(interface.addr.port)
+                if peer is not None and interface.peer_virt_ip in up_addresses:
+                    live[name].append((interface, peer))
+        return live
+
+    def is_converged(self):
+        """
+        :return: True if every node reaches exactly the addresses of the live links in its part of the network
+        """
+        live = self._live_links()
+        component_of = {}
+        for start in self.nodes:
+            if start in component_of:
+                continue
+            component_of[start] = start
+            frontier = [start]
+            while frontier:
+                name = frontier.pop()
+                for _, peer in live[name]:
+                    if peer not in component_of:
+                        component_of[peer] = start
+                        frontier.append(peer)
+        addresses = {}
+        for name, links in live.items():
+            addresses.setdefault(component_of[name], set()).update(interface.my_virt_ip for interface, _ in links)
+        return all(self.reachable_destinations(name) == addresses[component_of[name]] for name in self.nodes)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Run as follows: py simulator.py <file.net>")
+        exit(0)
+
+    simulator = Simulator.from_net_file(sys.argv[1])
+    simulator.run_until_quiet()
+    print(f"Converged={simulator.is_converged()} at t={simulator.clock.now:.3f}s "
+          f"after {simulator.stats.messages} messages, {simulator.stats.bytes} bytes, {simulator.stats.rounds} rounds")
+    for name in simulator.nodes:
+        print(simulator.command(name, "routes"), end="")
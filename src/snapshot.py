@@ -0,0 +1,99 @@
+import mmap
+import os
+import socket
+import struct
+import time
+
+from routing_table import RoutingTable
+
+# seconds between snapshots of a running node
+SNAPSHOT_INTERVAL = 30
+# routes from an older snapshot are ignored; the network has likely moved on
+MAX_SNAPSHOT_AGE = 300
+
+
+class Snapshot:
+    """
+    The state a node restarts from: which interfaces were up, its routing table and the sequence
+    number of its last link state advertisement. The file is a fixed header, the interfaces, then
+    the routing table in the compact RoutingTable.to_bytes() form, so loading it is reading a
+    memory map with the same code that parses a neighbor's table.
+    """
+
+    MAGIC = b'RTSN'
+    VERSION = 2
+    # magic, version, written at (seconds since the epoch), link state sequence, number of interfaces
+    HEADER_FORMAT = struct.Struct('!4sHdIH')
+    # local virtual ip, is up
+    INTERFACE_FORMAT = struct.Struct('!4s?')
+
+    def __init__(self, interfaces, routing_table, link_state_sequence=0, written_at=None):
+        """
+        :param interfaces: {my_virt_ip: is up}
+        """
+        self.interfaces = interfaces
+        self.routing_table = routing_table
+        self.link_state_sequence = link_state_sequence
+        self.written_at = time.time() if written_at is None else written_at
+
+    @property
+    def age(self):
+        return time.time() - self.written_at
+
+    def to_bytes(self):
+        return Snapshot.HEADER_FORMAT.pack(Snapshot.MAGIC, Snapshot.VERSION, self.written_at,
+                                           self.link_state_sequence, len(self.interfaces)) \
+               + b"".join(Snapshot.INTERFACE_FORMAT.pack(socket.inet_aton(ip), is_up)
+                          for ip, is_up in self.interfaces.items()) \
+               + self.routing_table.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        if len(buffer) < cls.HEADER_FORMAT.size:
+            raise ValueError("truncated snapshot")
+        magic, version, written_at, link_state_sequence, interface_count = cls.HEADER_FORMAT.unpack_from(buffer)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a routing snapshot of this version")
+        offset = cls.HEADER_FORMAT.size
+        if len(buffer) < offset + interface_count * cls.INTERFACE_FORMAT.size:
+            raise ValueError("truncated snapshot")
+        interfaces = {}
+        for _ in range(interface_count):
+            ip, is_up = cls.INTERFACE_FORMAT.unpack_from(buffer, offset)
+            interfaces[socket.inet_ntoa(ip)] = is_up
+            offset += cls.INTERFACE_FORMAT.size
+        routing_table = RoutingTable.from_bytes(buffer[offset:])
+        return cls(interfaces, routing_table, link_state_sequence, written_at)
+
+    def save(self, path):
+        """
+        Writes the snapshot next to path and renames it into place, so a crash never leaves half a file.
+        """
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(self.to_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: the snapshot at path, or None if there is none
+        :raise ValueError: if the file is not a valid snapshot
+        """
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("empty snapshot")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    try:
+                        return cls.from_bytes(view)
+                    except ValueError as e:
+                        # the traceback holds slices of the map, which must be gone before it closes
+                        error = str(e)
+        raise ValueError(error)
@@ -0,0 +1,109 @@
+"""
+Generators for benchmark topologies. Each returns (names, links) in the form the Simulator takes,
+with links as (name, name) pairs; write_net_file() saves one in the nets/*.net format.
+"""
+import random
+
+
+def _names(count):
+    return [f"n{index}" for index in range(count)]
+
+
+def ring(count):
+    names = _names(count)
+    if count < 2:
+        return names, []
+    if count == 2:
+        return names, [(names[0], names[1])]
+    return names, [(names[index], names[(index + 1) % count]) for index in range(count)]
+
+
+def line(count):
+    names = _names(count)
+    return names, [(names[index], names[index + 1]) for index in range(count - 1)]
+
+
+def grid(rows, columns=None):
+    columns = rows if columns is None else columns
+    names = [f"n{row}_{column}" for row in range(rows) for column in range(columns)]
+    links = []
+    for row in range(rows):
+        for column in range(columns):
+            name = names[row * columns + column]
+            if column + 1 < columns:
+                links.append((name, names[row * columns + column + 1]))
+            if row + 1 < rows:
+                links.append((name, names[(row + 1) * columns + column]))
+    return names, links
+
+
+def tree(count, branching=2):
+    names = _names(count)
+    return names, [(names[(index - 1) // branching], names[index]) for index in range(1, count)]
+
+
+def random_graph(count, average_degree=4, seed=0):
+    """
+    A random spanning tree plus random extra links up to the requested average degree,
+    so the graph is always connected.
+    """
+    rng = random.Random(seed)
+    names = _names(count)
+    links = set()
+    for index in range(1, count):
+        links.add((names[rng.randrange(index)], names[index]))
+    wanted = max(count * average_degree // 2, len(links))
+    attempts = 0
+    while len(links) < wanted and attempts < 10 * wanted:
+        attempts += 1
+        a, b = rng.sample(range(count), 2)
+        if (names[a], names[b]) not in links and (names[b], names[a]) not in links:
+            links.add((names[a], names[b]))
+    return names, sorted(links)
+
+
+def scale_free(count, links_per_node=2, seed=0):
+    """
+    Barabasi-Albert preferential attachment: every new node links to links_per_node existing nodes
+    picked with probability proportional to their degree.
+    """
+    rng = random.Random(seed)
+    names = _names(count)
+    links = []
+    # every node appears here once per link it has, which makes a uniform pick degree-proportional
+    endpoints = []
+    for index in range(1, count):
+        targets = set()
+        wanted = min(links_per_node, index)
+        while len(targets) < wanted:
+            targets.add(rng.choice(endpoints) if endpoints else 0)
+        for target in sorted(targets):
+            links.append((names[target], names[index]))
+            endpoints.extend((target, index))
+    return names, links
+
+
+# name -> f(node count, seed)
+GENERATORS = {
+    'ring': lambda count, seed: ring(count),
+    'line': lambda count, seed: line(count),
+    # rounded to the nearest square
+    'grid': lambda count, seed: grid(max(round(count ** 0.5), 1)),
+    'tree': lambda count, seed: tree(count),
+    'random': lambda count, seed: random_graph(count, seed=seed),
+    'scale-free': lambda count, seed: scale_free(count, seed=seed),
+}
+
+
+def generate(kind, count, seed=0):
+    if kind not in GENERATORS:
+        raise ValueError(f"unknown topology {kind}, expected one of {', '.join(GENERATORS)}")
+    return GENERATORS[kind](count, seed)
+
+
+def write_net_file(path, names, links, host='localhost'):
+    with open(path, 'w') as f:
+        for name in names:
+            f.write(f"node {name} {host}\n")
+        for a, b in links:
+            f.write(f"{a} <-> {b}\n")
@@ -0,0 +1,118 @@
+import struct
+
+# traceroute id, probe sequence number
+PROBE_FORMAT = struct.Struct('!HH')
+PROBES_PER_HOP = 3
+MAX_OUTSTANDING_PROBES = 12
+# seconds a probe may go unanswered before its hop is shown as *
+PROBE_TIMEOUT = 2.0
+
+
+class Traceroute:
+    """
+    One run of traceroute by TTL probing. Probe n is sent with TTL n // probes_per_hop + 1, so it
+    expires at that hop, which answers with a time exceeded message, unless the probe reaches the
+    destination first, which answers it directly. Up to max_outstanding probes are in flight at
+    once; each is timed on the node's scheduler. Probes past the hop the destination answered
+    from are never sent.
+    """
+
+    def __init__(self, identifier, destination, send_probe, scheduler, report, max_hops,
+                 probes_per_hop=PROBES_PER_HOP, max_outstanding=MAX_OUTSTANDING_PROBES, timeout=PROBE_TIMEOUT):
+        """
+        :param send_probe: send_probe(ttl, payload) sends one probe towards destination
+        :param report: called with the Traceroute once every probe it needs was answered or timed out
+        """
+        self.identifier = identifier
+        self.destination = destination
+        self.send_probe = send_probe
+        self.scheduler = scheduler
+        self.clock = scheduler.clock
+        self.report = report
+        self.max_hops = max_hops
+        self.probes_per_hop = probes_per_hop
+        self.max_outstanding = max_outstanding
+        self.timeout = timeout
+        self._next_sequence = 0
+        # sequence -> (sent at, timeout timer)
+        self._outstanding = {}
+        # ttl -> [(responding address, round-trip time in seconds) or None for every probe]
+        self.hops = {}
+        # the lowest TTL the destination itself answered at
+        self.reached_at = None
+        self.finished = False
+
+    def start(self):
+        self._send_more()
+
+    def _last_ttl(self):
+        return self.reached_at if self.reached_at is not None else self.max_hops
+
+    def _send_more(self):
+        while len(self._outstanding) < self.max_outstanding:
+            ttl = self._next_sequence // self.probes_per_hop + 1
+            if ttl > self._last_ttl():
+                break
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            timer = self.scheduler.call_later(self.timeout, self._expire, sequence)
+            self._outstanding[sequence] = (self.clock(), timer)
+            self.send_probe(ttl, PROBE_FORMAT.pack(self.identifier, sequence))
+        if not self._outstanding:
+            self.finished = True
+            self.report(self)
+
+    def answer(self, sequence, address, reached):
+        """
+        Records the reply to a probe.
+        :param address: the address the reply came from
+        :param reached: True if the destination answered, False for a time exceeded message
+        """
+        probe = self._outstanding.pop(sequence, None)
+        if probe is None or self.finished:
+            return
+        sent_at, timer = probe
+        self.scheduler.cancel(timer)
+        ttl = sequence // self.probes_per_hop + 1
+        self._record(ttl, (address, self.clock() - sent_at))
+        if reached and (self.reached_at is None or ttl < self.reached_at):
+            self.reached_at = ttl
+            self._discard_beyond(ttl)
+        self._send_more()
+
+    def _expire(self, sequence):
+        if self._outstanding.pop(sequence, None) is None or self.finished:
+            return
+        self._record(sequence // self.probes_per_hop + 1, None)
+        self._send_more()
+
+    def _record(self, ttl, result):
+        self.hops.setdefault(ttl, []).append(result)
+
+    def _discard_beyond(self, ttl):
+        for sequence in [sequence for sequence in self._outstanding if sequence // self.probes_per_hop + 1 > ttl]:
+            _, timer = self._outstanding.pop(sequence)
+            self.scheduler.cancel(timer)
+        for later in [later for later in self.hops if later > ttl]:
+            del self.hops[later]
+
+    @staticmethod
+    def parse_probe(payload):
+        """
+        :return: (traceroute id, sequence) of a probe payload or the start of one quoted in an error
+        """
+        if len(payload) < PROBE_FORMAT.size:
+            raise ValueError("truncated traceroute probe")
+        return PROBE_FORMAT.unpack_from(payload)
+
+    def lines(self):
+        lines = []
+        for ttl in range(1, self._last_ttl() + 1):
+            results = self.hops.get(ttl, [])
+            addresses = []
+            for result in results:
+                if result is not None and result[0] not in addresses:
+                    addresses.append(result[0])
+            times = "  ".join("*" if result is None else f"{result[1] * 1000:.3f} ms" for result in results)
+            lines.append(f"{ttl} {', '.join(addresses) or '*'}  {times}")
+        return lines
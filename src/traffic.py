@@ -0,0 +1,156 @@
+import struct
+
+from ip import IPHeader
+from metrics import Histogram
+
+# flow id, sequence number within the flow, send time in nanoseconds on the sender's clock
+TRAFFIC_FORMAT = struct.Struct('!HIQ')
+MIN_PACKET_SIZE = IPHeader.LENGTH + TRAFFIC_FORMAT.size
+# seconds between two bursts of generated packets
+SEND_INTERVAL = 0.01
+# a gap in a flow's sequence numbers longer than this is counted as lost right away instead of tracked
+MAX_TRACKED_GAP = 1 << 16
+
+
+class TrafficGenerator:
+    """
+    Sends packets of a fixed size to one destination at a fixed rate, numbering them per flow.
+    Packets go out in bursts every SEND_INTERVAL (or every scheduler tick if that is longer), as
+    many as keep the average at the requested rate.
+    """
+
+    def __init__(self, destination, rate, size, flows, duration, send, scheduler, on_finished=None):
+        """
+        :param rate: packets per second over all flows
+        :param size: bytes per packet, IP header included
+        :param send: send(payload) sends one packet's payload to destination
+        :param on_finished: called with the generator once duration has passed
+        """
+        if rate <= 0 or flows <= 0 or duration <= 0:
+            raise ValueError("rate, flows and duration must be positive")
+        if size < MIN_PACKET_SIZE:
+            raise ValueError(f"packets must be at least {MIN_PACKET_SIZE} bytes")
+        self.destination = destination
+        self.rate = rate
+        self.size = size
+        self.flows = flows
+        self.duration = duration
+        self.send = send
+        self.scheduler = scheduler
+        self.clock = scheduler.clock
+        self.on_finished = on_finished
+        self._padding = bytes(size - MIN_PACKET_SIZE)
+        self._next_sequence = [0] * flows
+        self.sent = 0
+        self.started_at = None
+        self.finished = False
+
+    def start(self):
+        self.started_at = self.clock()
+        self._send_due()
+
+    def stop(self):
+        if not self.finished:
+            self.finished = True
+            if self.on_finished is not None:
+                self.on_finished(self)
+
+    def _send_due(self):
+        if self.finished:
+            return
+        elapsed = min(self.clock() - self.started_at, self.duration)
+        due = int(elapsed * self.rate)
+        while self.sent < due:
+            flow = self.sent % self.flows
+            sequence = self._next_sequence[flow]
+            self._next_sequence[flow] = sequence + 1
+            self.send(TRAFFIC_FORMAT.pack(flow, sequence, int(self.clock() * 1e9)) + self._padding)
+            self.sent += 1
+        if elapsed >= self.duration:
+            self.stop()
+        else:
+            self.scheduler.call_later(SEND_INTERVAL, self._send_due)
+
+    def summary(self):
+        return f"Sent {self.sent} packets of {self.size} bytes to {self.destination} " \
+               f"in {self.flows} flows over {self.duration}s"
+
+
+class FlowCounters:
+    __slots__ = ('received', 'highest', 'missing', 'lost', 'reordered', 'duplicates')
+
+    def __init__(self):
+        self.received = 0
+        self.highest = -1
+        # sequence numbers skipped over that may still arrive late
+        self.missing = set()
+        # sequence numbers given up on because the gap they were in was too long to track
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+
+
+class TrafficSink:
+    """
+    Counts the generated packets that reach this node: per flow, which sequence numbers are
+    missing, which arrived after a later one (reordered) and which arrived twice, and the one-way
+    latency of every packet. Latency is only meaningful when sender and sink share a clock, as
+    nodes on one host or in one simulator do.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        # (source ip, flow id) -> FlowCounters
+        self.flows = {}
+        self.latency = Histogram()
+        self.malformed = 0
+
+    def receive(self, source_ip, payload):
+        if len(payload) < TRAFFIC_FORMAT.size:
+            self.malformed += 1
+            return
+        flow, sequence, sent_at = TRAFFIC_FORMAT.unpack_from(payload)
+        self.latency.observe(max(int(self.clock() * 1e9) - sent_at, 0) // 1000)
+        counters = self.flows.get((source_ip, flow))
+        if counters is None:
+            counters = self.flows[(source_ip, flow)] = FlowCounters()
+        if sequence > counters.highest:
+            gap = sequence - counters.highest - 1
+            if gap > MAX_TRACKED_GAP:
+                counters.lost += gap
+            else:
+                counters.missing.update(range(counters.highest + 1, sequence))
+            counters.highest = sequence
+            counters.received += 1
+        elif sequence in counters.missing:
+            counters.missing.discard(sequence)
+            counters.reordered += 1
+            counters.received += 1
+        else:
+            counters.duplicates += 1
+
+    def reset(self):
+        self.__init__(self.clock)
+
+    def as_dict(self):
+        received = sum(counters.received for counters in self.flows.values())
+        return {
+            'flows': len(self.flows),
+            'received': received,
+            'lost': sum(len(counters.missing) + counters.lost for counters in self.flows.values()),
+            'reordered': sum(counters.reordered for counters in self.flows.values()),
+            'duplicates': sum(counters.duplicates for counters in self.flows.values()),
+            'malformed': self.malformed,
+            'latency_us': self.latency.as_dict(),
+        }
+
+    def __str__(self):
+        stats = self.as_dict()
+        p50, p90, p99 = (self._format_latency(self.latency.percentile(q)) for q in (0.5, 0.9, 0.99))
+        return f"Received {stats['received']} packets in {stats['flows']} flows: {stats['lost']} lost, " \
+               f"{stats['reordered']} reordered, {stats['duplicates']} duplicates\n" \
+               f"One-way latency: p50 <= {p50}, p90 <= {p90}, p99 <= {p99}"
+
+    @staticmethod
+    def _format_latency(microseconds):
+        return "n/a" if microseconds is None else f"{microseconds}us"
@@ -1,4 +1,6 @@
 from interface import Interface
+import socket
+import struct
 import sys
 
 
@@ -16,3 +18,25 @@ class Util:
         print("---------------------------------")
         print("> ", end="")
         sys.stdout.flush()
+
+    @staticmethod
+    def pack_addresses(addresses):
+        """
+        :param addresses: a list of dotted-quad ip strings
+        :return: a one-byte count followed by the 4-byte form of each address
+        """
+        return struct.pack('!B', len(addresses)) + b"".join(socket.inet_aton(address) for address in addresses)
+
+    @staticmethod
+    def unpack_addresses(buffer):
+        """
+        :param buffer: bytes produced by pack_addresses, possibly followed by more data
+        :return: the list of addresses and the number of bytes consumed
+        """
+        if not buffer:
+            raise ValueError("truncated address list")
+        count = buffer[0]
+        end = 1 + 4 * count
+        if len(buffer) < end:
+            raise ValueError("truncated address list")
+        return [socket.inet_ntoa(buffer[offset:offset + 4]) for offset in range(1, end, 4)], end
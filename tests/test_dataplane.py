@@ -0,0 +1,57 @@
+import contextlib
+import io
+import socket
+import time
+
+from address import Address
+from interface import Interface
+from ip import IPPacket
+from node import Node
+from protocols import ROUTE_PROTOCOL
+from routing_table import RoutingTableItem
+
+DESTINATION = '192.168.0.9'
+
+
+def bound_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    return sock
+
+
+def test_workers_forward_and_count_promptly():
+    # A sits between the neighbors behind these sockets, which stand in for B and C
+    neighbor_b, neighbor_c = bound_socket(), bound_socket()
+    with contextlib.closing(bound_socket()) as placeholder:
+        address = Address('127.0.0.1', placeholder.getsockname()[1])
+    interfaces = [Interface('127.0.0.1', neighbor_b.getsockname()[1], '192.168.0.2', '192.168.0.1'),
+                  Interface('127.0.0.1', neighbor_c.getsockname()[1], '192.168.0.3', '192.168.0.4')]
+    with contextlib.redirect_stdout(io.StringIO()):
+        node = Node('A', links=(address, interfaces), workers=2)
+    try:
+        node.routing_table[DESTINATION] = RoutingTableItem(1, '192.168.0.3')
+        node.data_plane.publish()
+        # the kernel spreads senders over the workers and A's own socket, which nothing reads here
+        senders = [bound_socket() for _ in range(16)]
+        for sender in senders:
+            sender.sendto(IPPacket('192.168.0.1', DESTINATION, ROUTE_PROTOCOL, b"x").to_bytes(), address.to_tuple())
+        neighbor_c.settimeout(1.0)
+        forwarded = 0
+        with contextlib.suppress(socket.timeout):
+            while True:
+                # A also told C that their link is up
+                forwarded += IPPacket.from_bytes(neighbor_c.recv(2048)).header.protocol == ROUTE_PROTOCOL
+                neighbor_c.settimeout(0.2)
+        assert forwarded > 0
+        deadline = time.monotonic() + 0.5
+        while sum(worker['forwarded'] for worker in node.data_plane.stats()) < forwarded \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sum(worker['forwarded'] for worker in node.data_plane.stats()) == forwarded
+        for sender in senders:
+            sender.close()
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            node.shutdown()
+        neighbor_b.close()
+        neighbor_c.close()
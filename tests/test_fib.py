@@ -0,0 +1,80 @@
+import pytest
+
+from fib import ForwardingTable, PrefixTrie, parse_prefix
+from routing_table import RoutingTableItem
+
+INFINITY = 16
+
+
+def make_table():
+    # interfaces are stood in for by the local address they are named by
+    return ForwardingTable(resolve_interface=lambda my_virt_ip: my_virt_ip, infinity=INFINITY)
+
+
+def test_parse_prefix_clears_host_bits():
+    assert parse_prefix('10.1.2.3/16') == (0x0A010000, 16)
+    assert parse_prefix('10.1.2.3') == (0x0A010203, 32)
+    with pytest.raises(ValueError):
+        parse_prefix('10.0.0.0/33')
+
+
+def test_trie_prefers_the_longest_prefix():
+    trie = PrefixTrie()
+    for prefix, value in (('0.0.0.0/0', 'default'), ('10.0.0.0/8', 'eight'), ('10.1.0.0/16', 'sixteen')):
+        trie.insert(*parse_prefix(prefix), value)
+
+    assert trie.longest_match(parse_prefix('10.1.2.3')[0]) == 'sixteen'
+    assert trie.longest_match(parse_prefix('10.2.0.1')[0]) == 'eight'
+    assert trie.longest_match(parse_prefix('11.0.0.1')[0]) == 'default'
+    assert sorted(value for _, _, value in trie.items()) == ['default', 'eight', 'sixteen']
+
+
+def test_trie_removal_falls_back_to_the_shorter_prefix():
+    trie = PrefixTrie()
+    trie.insert(*parse_prefix('10.0.0.0/8'), 'eight')
+    trie.insert(*parse_prefix('10.1.0.0/16'), 'sixteen')
+
+    trie.remove(*parse_prefix('10.1.0.0/16'))
+    trie.remove(*parse_prefix('10.1.0.0/16'))
+    assert trie.size == 1
+    assert trie.longest_match(parse_prefix('10.1.2.3')[0]) == 'eight'
+
+    trie.remove(*parse_prefix('10.0.0.0/8'))
+    assert trie.size == 0 and trie.root == [None, None, None]
+    assert trie.longest_match(parse_prefix('10.1.2.3')[0]) is None
+
+
+def test_host_route_beats_covering_prefix():
+    table = make_table()
+    table.route_changed('10.0.0.0/8', RoutingTableItem(2, 'prefix-hop'))
+    table.route_changed('10.0.0.5', RoutingTableItem(1, 'host-hop'))
+
+    assert table.lookup('10.0.0.5') == 'host-hop'
+    assert table.lookup('10.0.0.6') == 'prefix-hop'
+    assert table.lookup('192.168.0.1') is None
+    assert len(table) == 2
+
+
+def test_unreachable_route_is_withdrawn():
+    table = make_table()
+    table.route_changed('10.0.0.0/24', RoutingTableItem(1, 'hop'))
+    version = table.version
+
+    table.route_changed('10.0.0.0/24', RoutingTableItem(INFINITY, 'hop'))
+    assert table.lookup('10.0.0.1') is None and len(table) == 0
+    assert table.version > version
+
+
+def test_slash_32_prefix_is_stored_as_a_host_route():
+    table = make_table()
+    table.route_changed('10.0.0.7/32', RoutingTableItem(1, 'hop'))
+    assert table.hosts == {'10.0.0.7': 'hop'}
+
+    table.route_removed('10.0.0.7/32')
+    assert table.lookup('10.0.0.7') is None
+
+
+def test_malformed_destination_has_no_route():
+    table = make_table()
+    table.route_changed('0.0.0.0/0', RoutingTableItem(1, 'default'))
+    assert table.lookup('not an address') is None
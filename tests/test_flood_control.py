@@ -0,0 +1,56 @@
+from flood_control import FloodControl
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_event_is_new_once():
+    flood_control = FloodControl('10.0.0.1', clock=FakeClock())
+    assert flood_control.is_new('10.0.0.2', 7)
+    assert not flood_control.is_new('10.0.0.2', 7)
+    assert flood_control.is_new('10.0.0.2', 8)
+    assert flood_control.duplicates == 1
+
+
+def test_originated_event_is_already_seen():
+    flood_control = FloodControl('10.0.0.1', clock=FakeClock())
+    event = flood_control.originate()
+    assert event[0] == '10.0.0.1'
+    assert not flood_control.is_new(*event)
+    assert flood_control.originate()[1] == (event[1] + 1) & 0xFFFFFFFF
+
+
+def test_per_link_events_are_told_apart_by_link():
+    flood_control = FloodControl('10.0.0.1', clock=FakeClock())
+    assert flood_control.is_new('10.0.0.2', 7, via='192.168.0.2')
+    assert flood_control.is_new('10.0.0.2', 7, via='192.168.0.4')
+    assert not flood_control.is_new('10.0.0.2', 7, via='192.168.0.4')
+    assert flood_control.is_new('10.0.0.2', 7)
+
+
+def test_events_are_forgotten_after_ttl():
+    clock = FakeClock()
+    flood_control = FloodControl('10.0.0.1', clock=clock, ttl=60)
+    flood_control.is_new('10.0.0.2', 7)
+    clock.now = 61
+    assert flood_control.is_new('10.0.0.2', 7)
+    assert flood_control.as_dict()['remembered'] == 1
+
+
+def test_oldest_events_are_evicted_at_capacity():
+    flood_control = FloodControl('10.0.0.1', clock=FakeClock(), capacity=2)
+    for sequence in range(3):
+        flood_control.is_new('10.0.0.2', sequence)
+    assert len(flood_control) == 2
+    assert flood_control.evictions == 1
+    assert flood_control.is_new('10.0.0.2', 0)
+
+
+def test_event_round_trip():
+    packed = FloodControl.pack_event('10.0.0.2', 0xFFFFFFFF) + b"rest"
+    assert FloodControl.unpack_event(packed) == (('10.0.0.2', 0xFFFFFFFF), FloodControl.EVENT_FORMAT.size)
@@ -0,0 +1,69 @@
+import pytest
+
+from fragmentation import Reassembler
+from ip import IPHeader, IPPacket
+from simulator import Simulator
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fragments_of(payload, mtu=100, identification=1):
+    packet = IPPacket('192.168.0.1', '192.168.0.2', 0, payload)
+    return [IPPacket.from_bytes(datagram) for datagram in packet.to_fragments(mtu, identification)]
+
+
+def test_fragments_fit_the_mtu_and_reassemble_in_any_order():
+    payload = bytes(range(256)) * 2
+    datagrams = IPPacket('192.168.0.1', '192.168.0.2', 0, payload).to_fragments(100, 7)
+    assert len(datagrams) > 1 and all(len(datagram) <= 100 for datagram in datagrams)
+
+    reassembler = Reassembler(clock=FakeClock())
+    fragments = [IPPacket.from_bytes(datagram) for datagram in reversed(datagrams)]
+    results = [reassembler.add(fragment.header, fragment.payload) for fragment in fragments]
+    assert results == [None] * (len(fragments) - 1) + [payload]
+    assert reassembler.reassembled == 1 and not reassembler.pending
+
+
+def test_packet_over_the_maximum_datagram_size_is_refused():
+    packet = IPPacket('192.168.0.1', '192.168.0.2', 0, bytes(IPHeader.MAX_TOTAL_LENGTH))
+    with pytest.raises(ValueError):
+        packet.to_fragments(1400, 1)
+
+
+def test_overlapping_fragment_drops_the_datagram():
+    first, second = fragments_of(bytes(200))[:2]
+    overlapping = IPHeader(second.header.src_addr, second.header.dst_addr, second.header.protocol,
+                           identification=second.header.identification, more_fragments=True,
+                           fragment_offset=second.header.fragment_offset - 8)
+    reassembler = Reassembler(clock=FakeClock())
+    assert reassembler.add(first.header, first.payload) is None
+    assert reassembler.add(overlapping, second.payload) is None
+    assert reassembler.overlapping_datagrams == 1
+    assert not reassembler.pending and reassembler.buffered_bytes == 0
+
+
+def test_incomplete_datagram_times_out():
+    clock = FakeClock()
+    reassembler = Reassembler(clock=clock)
+    first = fragments_of(bytes(200))[0]
+    reassembler.add(first.header, first.payload)
+    clock.now = reassembler.timeout
+    reassembler.expire()
+    assert reassembler.timed_out_datagrams == 1 and not reassembler.pending
+
+
+def test_oversize_packet_is_dropped_and_counted():
+    simulator = Simulator(['A', 'B'], [('A', 'B')])
+    simulator.run_until_quiet()
+    node = simulator.nodes['A']
+    interface = node.interfaces[0]
+    packet = IPPacket(interface.my_virt_ip, interface.peer_virt_ip, 0, bytes(IPHeader.MAX_TOTAL_LENGTH))
+    node._send_packet(packet, interface)
+    assert node.metrics.drops['oversize'] == 1
+    assert simulator.pending_messages == 0
@@ -0,0 +1,59 @@
+import pytest
+
+from ip import IPHeader, IPPacket, MalformedPacketError
+from protocols import ROUTE_PROTOCOL, TRAFFIC_PROTOCOL
+from traffic import TRAFFIC_FORMAT
+
+SRC = '192.168.0.1'
+DST = '192.168.0.9'
+
+
+def test_packet_round_trips_through_the_wire_format():
+    packet = IPPacket.from_bytes(IPPacket(SRC, DST, ROUTE_PROTOCOL, b"hello", ttl=7).to_bytes())
+    assert (packet.header.src_addr, packet.header.dst_addr, packet.header.protocol, packet.header.ttl) \
+        == (SRC, DST, ROUTE_PROTOCOL, 7)
+    assert packet.payload == b"hello"
+
+
+def test_decremented_ttl_keeps_the_checksum_valid():
+    datagram = bytearray(IPPacket(SRC, DST, ROUTE_PROTOCOL, b"hello", ttl=7).to_bytes())
+    IPHeader.decrement_ttl(datagram)
+    assert IPHeader.is_valid(memoryview(datagram))
+    assert IPPacket.from_bytes(datagram).header.ttl == 6
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda datagram: datagram[:IPHeader.LENGTH - 1],
+    lambda datagram: bytes([0x65]) + datagram[1:],
+    lambda datagram: datagram[:IPHeader.SRC_OFFSET] + b"\x0a" + datagram[IPHeader.SRC_OFFSET + 1:],
+    lambda datagram: datagram + b"trailing",
+])
+def test_malformed_header_is_rejected(corrupt):
+    datagram = IPPacket(SRC, DST, ROUTE_PROTOCOL, b"hello").to_bytes()
+    with pytest.raises(MalformedPacketError):
+        IPPacket.from_bytes(corrupt(datagram))
+
+
+def traffic_payload(flow, sequence):
+    return TRAFFIC_FORMAT.pack(flow, sequence, 0)
+
+
+def test_peeked_flow_hash_matches_the_computed_one():
+    for protocol, payload in ((ROUTE_PROTOCOL, b"hello"), (TRAFFIC_PROTOCOL, traffic_payload(3, 0))):
+        datagram = IPPacket(SRC, DST, protocol, payload).to_bytes()
+        assert IPHeader.peek_flow_hash(memoryview(datagram)) == IPHeader.flow_hash(SRC, DST, protocol, payload)
+
+
+def test_traffic_flows_hash_apart_and_stay_together():
+    hashes = {IPHeader.flow_hash(SRC, DST, TRAFFIC_PROTOCOL, traffic_payload(flow, 0)) for flow in range(8)}
+    assert len(hashes) == 8
+    assert IPHeader.flow_hash(SRC, DST, TRAFFIC_PROTOCOL, traffic_payload(5, 0)) \
+        == IPHeader.flow_hash(SRC, DST, TRAFFIC_PROTOCOL, traffic_payload(5, 99))
+    # other protocols have no flow id, so their payload does not move them between paths
+    assert IPHeader.flow_hash(SRC, DST, ROUTE_PROTOCOL, b"a") == IPHeader.flow_hash(SRC, DST, ROUTE_PROTOCOL, b"b")
+
+
+def test_fragments_hash_without_the_flow_id():
+    packet = IPPacket(SRC, DST, TRAFFIC_PROTOCOL, traffic_payload(5, 0) + bytes(100))
+    hashes = {IPHeader.peek_flow_hash(memoryview(fragment)) for fragment in packet.to_fragments(60, 1)}
+    assert hashes == {IPHeader.flow_hash(SRC, DST, TRAFFIC_PROTOCOL)}
@@ -0,0 +1,65 @@
+import pytest
+
+import topologies
+from link_state import LSA_MAX_AGE, LinkStateAdvertisement
+from simulator import Simulator
+
+
+def ring(count=6):
+    names, links = topologies.generate('ring', count, 0)
+    simulator = Simulator(names, links, link_state=True)
+    simulator.run_until_quiet()
+    return simulator, names
+
+
+def test_advertisements_round_trip():
+    advertisements = [LinkStateAdvertisement('192.168.0.1', 3, {'192.168.0.1': ('192.168.0.2', 1),
+                                                                '192.168.0.3': ('192.168.0.4', 2)}),
+                      LinkStateAdvertisement('192.168.0.5', 1, {})]
+    payload = LinkStateAdvertisement.pack_all(advertisements)
+    received = LinkStateAdvertisement.unpack_all(payload)
+    assert [(lsa.origin, lsa.sequence, lsa.links) for lsa in received] \
+        == [(lsa.origin, lsa.sequence, lsa.links) for lsa in advertisements]
+    with pytest.raises(ValueError):
+        LinkStateAdvertisement.unpack_all(payload[:-1])
+
+
+def test_every_lsa_is_flooded_to_every_node():
+    simulator, names = ring()
+    assert simulator.is_converged()
+    router_ids = {simulator.nodes[name].link_state.router_id for name in names}
+    for name in names:
+        assert set(simulator.nodes[name].link_state.database) == router_ids
+
+    simulator.link_down('n2', 'n3')
+    simulator.run_until_quiet()
+    origin = simulator.nodes['n2'].link_state
+    assert {simulator.nodes[name].link_state.database[origin.router_id].sequence for name in names} \
+        == {origin.sequence}
+
+
+def test_shortest_paths_follow_a_lost_link():
+    simulator, names = ring()
+    source = simulator.nodes['n0']
+    router_id = {name: simulator.nodes[name].link_state.router_id for name in names}
+    assert [source.link_state.distances[router_id[name]] for name in names] == [0, 1, 2, 3, 2, 1]
+
+    simulator.link_down('n0', 'n1')
+    simulator.run_until_quiet()
+    assert simulator.is_converged()
+    assert [source.link_state.distances[router_id[name]] for name in names] == [0, 5, 4, 3, 2, 1]
+    # everything now leaves through n5
+    assert {item.forwarding_interface for _, item in source.routing_table.items()} \
+        == {simulator.find_interface('n0', 'n5').my_virt_ip}
+
+
+def test_lsa_of_a_crashed_node_ages_out():
+    simulator, names = ring()
+    victim = simulator.nodes['n3'].link_state.router_id
+    simulator.crash_node('n3')
+    simulator.run_until(simulator.clock.now + LSA_MAX_AGE + 1)
+    assert simulator.is_converged()
+    for name in names:
+        if name != 'n3':
+            assert victim not in simulator.nodes[name].link_state.database
+            assert victim not in simulator.nodes[name].link_state.distances
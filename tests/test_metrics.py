@@ -0,0 +1,17 @@
+from metrics import Histogram, Metrics
+
+
+def test_percentiles_are_described_by_bucket_bound():
+    histogram = Histogram(bounds=(10, 100))
+    for value in (3, 4, 50, 1000):
+        histogram.observe(value)
+    assert histogram.describe(0.5) == "<= 10"
+    assert histogram.describe(0.75) == "<= 100"
+    assert histogram.describe(1.0) == ">100"
+    assert histogram.as_dict()['p99'] == ">100"
+
+
+def test_latency_without_packets_is_not_reported_as_none():
+    text = str(Metrics([], clock=lambda: 0.0))
+    assert "Forwarding latency: no packets" in text
+    assert "None" not in text
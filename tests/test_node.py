@@ -0,0 +1,266 @@
+import topologies
+from ip import IPHeader, IPPacket
+from node import ROUTE_TIMEOUT, UPDATE_INTERVAL
+from protocols import (DOWN_PROTOCOL, ROUTE_PROTOCOL, ROUTING_TABLE_DELTA_PROTOCOL, ROUTING_TABLE_REQUEST_PROTOCOL,
+                       ROUTING_TABLE_UPDATE_PROTOCOL, TIME_EXCEEDED_PROTOCOL, UP_PROTOCOL)
+from routing_table import MAX_EXPANDED_ROUTES, MIN_PREFIX_LENGTH, RoutingTable, RoutingTableItem
+from simulator import Simulator
+
+
+def test_up_over_parallel_link_brings_it_up():
+    simulator = Simulator(['A', 'B', 'C'], [('A', 'B'), ('A', 'B'), ('B', 'C')])
+    simulator.run_until_quiet()
+    simulator.command('A', 'down 192.168.0.3')
+    simulator.run_until_quiet()
+    simulator.command('A', 'up 192.168.0.3')
+    simulator.run_until(500)
+    interface = next(i for i in simulator.nodes['B'].interfaces if i.my_virt_ip == '192.168.0.4')
+    assert interface.is_up
+    assert simulator.is_converged()
+
+
+def test_up_repeated_over_the_same_link_is_a_duplicate(monkeypatch):
+    simulator = Simulator(['A', 'B'], [('A', 'B')])
+    simulator.run_until_quiet()
+    simulator.command('A', 'down 192.168.0.1')
+    simulator.run_until_quiet()
+    sent = []
+    transmit = simulator.transmit
+
+    def capture(data, address, sender):
+        sent.append((data, sender))
+        transmit(data, address, sender)
+
+    monkeypatch.setattr(simulator, 'transmit', capture)
+    simulator.command('A', 'up 192.168.0.1')
+    simulator.run_until_quiet()
+    up = next((data, sender) for data, sender in sent if IPHeader.peek_protocol(data) == UP_PROTOCOL)
+    node = simulator.nodes['B']
+    duplicates = node.flood_control.duplicates
+    sent.clear()
+    node.process_packet(*up)
+    assert node.flood_control.duplicates == duplicates + 1
+    assert not sent
+
+
+def test_link_down_does_not_count_to_infinity():
+    rounds = []
+    for infinity in (16, 40):
+        names, links = topologies.generate('scale-free', 24)
+        simulator = Simulator(names, links, infinity=infinity)
+        simulator.run_until_quiet()
+        link = links[len(links) // 2]
+        simulator.reset_stats()
+        simulator.link_down(*link)
+        simulator.run_until_quiet()
+        assert simulator.is_converged()
+        rounds.append(simulator.stats.rounds)
+        # the hold-down on the link's addresses ends when it comes back
+        simulator.link_up(*link)
+        simulator.run_until_quiet()
+        assert simulator.is_converged()
+    assert rounds[0] == rounds[1]
+
+
+def test_table_too_large_for_one_datagram_is_sent_in_chunks():
+    simulator = Simulator(['A', 'B', 'C'], [('A', 'B'), ('B', 'C')])
+    simulator.run_until_quiet()
+    node = simulator.nodes['A']
+    interface = node.interfaces[0]
+    # hosts that no two of which can be summarized into a prefix
+    destinations = [f"10.{i // 256}.{i % 256}.1" for i in range(12000)]
+    for destination in destinations:
+        node.routing_table[destination] = RoutingTableItem(distance=0, forwarding_interface=interface.my_virt_ip)
+    assert len(node._routing_table_payload(interface, node.routing_table)) > 1
+
+    node._broadcast_routing_table_to_neighbors(ROUTING_TABLE_UPDATE_PROTOCOL)
+    simulator.run_until_quiet()
+    assert all(destination in simulator.nodes['C'].routing_table for destination in destinations)
+    assert not any(other.metrics.drops for other in simulator.nodes.values())
+
+    simulator.link_down('B', 'C')
+    simulator.run_until_quiet()
+    simulator.link_up('B', 'C')
+    simulator.run_until_quiet()
+    assert simulator.nodes['C'].routing_table[destinations[-1]].distance == 2
+
+
+def test_table_expanding_into_too_many_routes_is_dropped():
+    simulator = Simulator(['A', 'B'], [('A', 'B')])
+    simulator.run_until_quiet()
+    sender = simulator.nodes['B']
+    interface = sender.interfaces[0]
+    routes = RoutingTable()
+    for i in range(MAX_EXPANDED_ROUTES // (1 << (32 - MIN_PREFIX_LENGTH)) + 1):
+        routes[f"10.{i}.0.0/{MIN_PREFIX_LENGTH}"] = RoutingTableItem(1, interface.my_virt_ip)
+    sender._send_routing_table(interface, ROUTING_TABLE_UPDATE_PROTOCOL, routes)
+    simulator.run_until_quiet()
+    receiver = simulator.nodes['A']
+    assert receiver.metrics.drops['malformed'] == 1
+    assert len(receiver.routing_table) == 2
+
+
+def test_parallel_links_count_received_packets_separately():
+    simulator = Simulator(['A', 'B'], [('A', 'B'), ('A', 'B')])
+    simulator.run_until_quiet()
+    counters = simulator.nodes['A'].metrics.interfaces
+    assert counters['192.168.0.1'].rx_packets == counters['192.168.0.3'].rx_packets > 0
+
+
+def test_neighbor_that_crashed_silently_is_taken_down():
+    names, links = topologies.generate('ring', 8, 0)
+    simulator = Simulator(names, links)
+    simulator.run_until_quiet()
+    victim = names[len(names) // 2]
+    neighbor = next(a if b == victim else b for a, b in links if victim in (a, b))
+    interface = simulator.find_interface(neighbor, victim)
+    simulator.crash_node(victim)
+    simulator.run_until(simulator.clock.now + ROUTE_TIMEOUT + UPDATE_INTERVAL)
+    assert not interface.is_up
+    assert simulator.is_converged()
+    simulator.restart_node(victim)
+    simulator.run_until(simulator.clock.now + UPDATE_INTERVAL)
+    assert simulator.is_converged()
+
+
+def test_generated_flows_spread_over_equal_cost_paths():
+    names, links = topologies.generate('grid', 9, 0)
+    simulator = Simulator(names, links)
+    simulator.run_until_quiet()
+    source = simulator.nodes[names[0]]
+    destination_ip = simulator.nodes[names[-1]].interfaces[0].my_virt_ip
+    sent_before = {ip: counters.tx_packets for ip, counters in source.metrics.interfaces.items()}
+    simulator.command(names[0], f"traffic {destination_ip} 1000 100 8 0.5")
+    simulator.run_until(simulator.clock.now + 2)
+    sent = [counters.tx_packets - sent_before[ip] for ip, counters in source.metrics.interfaces.items()]
+    assert len(sent) == 2 and min(sent) > 100
+
+
+DIAMOND = (['A', 'B', 'C', 'D'], [('A', 'B'), ('A', 'C'), ('B', 'D'), ('C', 'D')])
+
+
+def next_hops_used(node, destination_ip):
+    return {node.fib.lookup(destination_ip, flow_hash).my_virt_ip for flow_hash in range(4)}
+
+
+def test_equal_cost_paths_are_both_used_and_follow_link_changes():
+    simulator = Simulator(*DIAMOND)
+    simulator.run_until_quiet()
+    source = simulator.nodes['A']
+    via_b, via_c = (simulator.find_interface('A', peer).my_virt_ip for peer in ('B', 'C'))
+    destinations = [interface.my_virt_ip for interface in simulator.nodes['D'].interfaces]
+    for destination_ip in destinations:
+        assert next_hops_used(source, destination_ip) == {via_b, via_c}
+
+    simulator.link_down('B', 'D')
+    simulator.run_until_quiet()
+    assert not source.multipath.paths
+    # D's address on the downed link is gone, the other one is only reachable through C
+    assert source.fib.lookup(simulator.find_interface('D', 'B').my_virt_ip) is None
+    assert next_hops_used(source, simulator.find_interface('D', 'C').my_virt_ip) == {via_c}
+
+    simulator.link_up('B', 'D')
+    simulator.run_until_quiet()
+    for destination_ip in destinations:
+        assert next_hops_used(source, destination_ip) == {via_b, via_c}
+
+
+def test_single_path_when_multipath_is_off():
+    simulator = Simulator(*DIAMOND, max_paths=1)
+    simulator.run_until_quiet()
+    source = simulator.nodes['A']
+    assert not source.multipath.paths
+    for interface in simulator.nodes['D'].interfaces:
+        assert len(next_hops_used(source, interface.my_virt_ip)) == 1
+
+
+def test_traceroute_without_a_valid_address_is_bad_input():
+    simulator = Simulator(['A', 'B'], [('A', 'B')])
+    simulator.run_until_quiet()
+    for line in ("traceroute", "traceroute not-an-address", "traceroute 192.168.0.2 192.168.0.1"):
+        assert "Bad input" in simulator.command('A', line)
+    assert "Traceroute to 192.168.0.2" in simulator.command('A', "traceroute 192.168.0.2")
+
+
+def test_packet_whose_ttl_runs_out_is_dropped_and_reported():
+    names, links = topologies.generate('line', 4, 0)
+    simulator = Simulator(names, links)
+    simulator.run_until_quiet()
+    source = simulator.nodes[names[0]]
+    destination_ip = simulator.nodes[names[-1]].interfaces[0].my_virt_ip
+    simulator.reset_stats()
+
+    source._send_towards(IPPacket(source.interfaces[0].my_virt_ip, destination_ip, ROUTE_PROTOCOL, b"x", ttl=2))
+    simulator.run_until_quiet()
+    assert simulator.nodes[names[2]].metrics.drops['ttl_exceeded'] == 1
+    assert simulator.nodes[names[-1]].metrics.drops['ttl_exceeded'] == 0
+    assert simulator.stats.messages_by_protocol[TIME_EXCEEDED_PROTOCOL] == 2
+
+
+def test_traceroute_lists_every_hop(capsys):
+    names, links = topologies.generate('line', 4, 0)
+    # the result is printed once the last probe is answered, so output is not discarded
+    simulator = Simulator(names, links, quiet=False)
+    simulator.run_until_quiet()
+    destination_ip = simulator.nodes[names[-1]].interfaces[0].my_virt_ip
+    simulator.command(names[0], f"traceroute {destination_ip}")
+    simulator.run_until_quiet()
+
+    output = capsys.readouterr().out
+    assert "Traceroute finished in 3 hops" in output
+    for hop, name in enumerate(names[1:], start=1):
+        addresses = [interface.my_virt_ip for interface in simulator.nodes[name].interfaces]
+        line, = [line for line in output.splitlines() if line.startswith(f"{hop} ")]
+        assert any(address in line for address in addresses) and "*" not in line
+    assert not simulator.nodes[names[0]].traceroutes
+
+
+def test_garbled_control_payloads_are_dropped():
+    simulator = Simulator(['A', 'B'], [('A', 'B')])
+    simulator.run_until_quiet()
+    node = simulator.nodes['B']
+    interface = node.interfaces[0]
+    sender = simulator.nodes['A'].addr.to_tuple()
+    for protocol in (ROUTING_TABLE_UPDATE_PROTOCOL, ROUTING_TABLE_DELTA_PROTOCOL, DOWN_PROTOCOL, UP_PROTOCOL):
+        for payload in (b"", b"xx", b"\xff" * 40):
+            node.process_packet(IPPacket(interface.peer_virt_ip, interface.my_virt_ip, protocol, payload).to_bytes(),
+                                sender)
+    assert node.metrics.drops['malformed'] == 12
+    simulator.run_until_quiet()
+    assert simulator.is_converged()
+
+
+def test_corrupted_header_is_dropped_before_any_handler():
+    simulator = Simulator(['A', 'B'], [('A', 'B')])
+    simulator.run_until_quiet()
+    node = simulator.nodes['B']
+    interface = node.interfaces[0]
+    datagram = bytearray(IPPacket(interface.peer_virt_ip, interface.my_virt_ip, ROUTE_PROTOCOL, b"x").to_bytes())
+    datagram[IPHeader.TTL_OFFSET] ^= 0xFF
+    node.process_packet(bytes(datagram), simulator.nodes['A'].addr.to_tuple())
+    assert node.metrics.drops == {'malformed': 1}
+
+
+def test_lost_delta_is_recovered_with_a_full_table(monkeypatch):
+    simulator = Simulator(['A', 'B'], [('A', 'B')])
+    simulator.run_until_quiet()
+    sender, receiver = simulator.nodes['B'], simulator.nodes['A']
+    interface = sender.interfaces[0]
+    protocols = []
+    transmit = simulator.transmit
+
+    def lose_first_delta(data, address, sender):
+        protocol = IPHeader.peek_protocol(data)
+        protocols.append(protocol)
+        if protocol != ROUTING_TABLE_DELTA_PROTOCOL or protocols.count(protocol) > 1:
+            transmit(data, address, sender)
+
+    monkeypatch.setattr(simulator, 'transmit', lose_first_delta)
+    for destination in ("10.0.0.1", "10.0.0.2"):
+        sender.routing_table[destination] = RoutingTableItem(0, interface.my_virt_ip)
+        sender._advertise_changes()
+        simulator.run_until_quiet()
+    # the second delta shows a gap, so the receiver asks for the whole table
+    assert protocols[:4] == [ROUTING_TABLE_DELTA_PROTOCOL, ROUTING_TABLE_DELTA_PROTOCOL,
+                             ROUTING_TABLE_REQUEST_PROTOCOL, ROUTING_TABLE_UPDATE_PROTOCOL]
+    assert receiver.routing_table["10.0.0.1"].distance == receiver.routing_table["10.0.0.2"].distance == 1
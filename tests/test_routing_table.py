@@ -0,0 +1,106 @@
+import pytest
+
+import routing_table
+from routing_table import (MAX_EXPANDED_ROUTES, MIN_PREFIX_LENGTH, VECTORIZE_THRESHOLD, RoutingTable,
+                           RoutingTableDelta, RoutingTableItem)
+
+INFINITY = 16
+VIA = "192.168.0.1"
+OTHER = "192.168.0.3"
+
+
+def build_tables():
+    ours, neighbor = RoutingTable(), RoutingTable()
+    ours["10.0.0.0"] = RoutingTableItem(0, "10.0.0.0")
+    for i in range(VECTORIZE_THRESHOLD):
+        destination = f"10.0.{i // 256}.{i % 256 + 1}"
+        # we route a third through the neighbor, a third elsewhere, and lack the rest
+        if i % 3 == 0:
+            ours[destination] = RoutingTableItem(i % 5 + 1, VIA)
+        elif i % 3 == 1:
+            ours[destination] = RoutingTableItem(i % 7 + 1 if i % 4 else INFINITY, OTHER)
+        # every fourth destination is advertised as unreachable
+        neighbor[destination] = RoutingTableItem(INFINITY if i % 4 == 0 else i % 6, VIA)
+    neighbor["10.0.0.0"] = RoutingTableItem(1, VIA)
+    return ours, neighbor
+
+
+def merged(monkeypatch, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(routing_table, "numpy", None)
+    ours, neighbor = build_tables()
+    merge = ours.merge(neighbor, VIA, INFINITY)
+    monkeypatch.undo()
+    for address, length in merge.lost:
+        del ours[routing_table.format_destination(address, length)]
+    ours.update_many(sorted(merge.updated + merge.improved), VIA)
+    return merge, [(node, item.distance, item.forwarding_interface) for node, item in ours.items()]
+
+
+def test_vectorized_merge_matches_merge_join(monkeypatch):
+    pytest.importorskip("numpy")
+    vectorized, vectorized_table = merged(monkeypatch, vectorized=True)
+    joined, joined_table = merged(monkeypatch, vectorized=False)
+    for field in ("improved", "updated", "lost", "refreshed", "equal_cost"):
+        assert getattr(vectorized, field) == getattr(joined, field), field
+    assert vectorized_table == joined_table
+
+
+def test_summarized_table_expands_into_the_routes_it_stands_for():
+    table = RoutingTable()
+    table["10.0.0.0"] = RoutingTableItem(0, "10.0.0.0")
+    for i in range(8, 16):
+        table[f"10.0.1.{i}"] = RoutingTableItem(2, VIA)
+    table["10.0.1.16"] = RoutingTableItem(3, VIA)
+    summary = table.summarize(INFINITY)
+    assert [node for node, _ in summary.items()] == ["10.0.0.0", "10.0.1.8/29", "10.0.1.16"]
+
+    received = RoutingTable.from_bytes(summary.to_bytes())
+    assert [(node, item.distance) for node, item in received.expanded().items()] \
+        == [(node, item.distance) for node, item in table.items()]
+
+
+def test_prefixes_shorter_than_accepted_are_malformed():
+    table = RoutingTable()
+    table[f"10.0.0.0/{MIN_PREFIX_LENGTH - 1}"] = RoutingTableItem(1, VIA)
+    with pytest.raises(ValueError):
+        RoutingTable.from_bytes(table.to_bytes())
+
+
+def test_expansion_is_capped():
+    table = RoutingTable()
+    covered_by_each = 1 << (32 - MIN_PREFIX_LENGTH)
+    for i in range(MAX_EXPANDED_ROUTES // covered_by_each + 1):
+        table[f"10.{i}.0.0/{MIN_PREFIX_LENGTH}"] = RoutingTableItem(1, VIA)
+    with pytest.raises(ValueError):
+        table.expanded()
+
+
+def distances_of(table):
+    return {node: item.distance for node, item in table.items()}
+
+
+def test_routes_learned_through_the_neighbor_are_poisoned_back_to_it():
+    table = RoutingTable()
+    table["10.0.0.0"] = RoutingTableItem(0, "10.0.0.0")
+    table["10.0.0.1"] = RoutingTableItem(1, VIA)
+    table["10.0.0.2"] = RoutingTableItem(2, OTHER)
+
+    received = RoutingTable.from_bytes(table.to_bytes(poisoned_interface=VIA, infinity=INFINITY))
+    assert distances_of(received) == {"10.0.0.0": 0, "10.0.0.1": INFINITY, "10.0.0.2": 2}
+    # poisoning only changes what is sent
+    assert table["10.0.0.1"].distance == 1
+
+    received = RoutingTable.from_bytes(table.to_bytes(poisoned_interface=OTHER, infinity=INFINITY))
+    assert distances_of(received) == {"10.0.0.0": 0, "10.0.0.1": 1, "10.0.0.2": INFINITY}
+
+
+def test_delta_is_poisoned_like_the_table():
+    changed = RoutingTable()
+    changed["10.0.0.1"] = RoutingTableItem(1, VIA)
+    changed["10.0.0.2"] = RoutingTableItem(3, OTHER)
+    delta = RoutingTableDelta(7, changed, ["10.0.0.3", "10.0.1.0/24"])
+
+    received = RoutingTableDelta.from_bytes(delta.to_bytes(poisoned_interface=VIA, infinity=INFINITY))
+    assert received.sequence == 7 and received.withdrawn == ["10.0.0.3", "10.0.1.0/24"]
+    assert distances_of(received.changed) == {"10.0.0.1": INFINITY, "10.0.0.2": 3}
@@ -0,0 +1,101 @@
+from scheduler import TimerWheel
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_wheel(slots=TimerWheel.DEFAULT_SLOTS):
+    clock = FakeClock()
+    return TimerWheel(tick=0.1, slots=slots, clock=clock), clock
+
+
+def test_timer_fires_after_its_deadline_and_within_a_tick():
+    wheel, clock = make_wheel()
+    fired = []
+    wheel.call_later(1.0, fired.append, 'a')
+
+    assert wheel.run_due(0.95) == 0 and not fired
+    assert 1.0 <= wheel.next_deadline() <= 1.1
+    assert wheel.run_due(wheel.next_deadline()) == 1
+    assert fired == ['a'] and wheel.pending == 0 and wheel.next_deadline() is None
+
+
+def test_due_timers_fire_in_deadline_order():
+    wheel, clock = make_wheel()
+    fired = []
+    for delay in (3.0, 0.5, 2.0, 0.51, 1.0):
+        wheel.call_later(delay, fired.append, delay)
+
+    assert wheel.run_due(5.0) == 5
+    assert fired == [0.5, 0.51, 1.0, 2.0, 3.0]
+
+
+def test_cancelled_timer_does_not_fire():
+    wheel, clock = make_wheel()
+    fired = []
+    timer = wheel.call_later(1.0, fired.append, 'cancelled')
+    wheel.call_later(2.0, fired.append, 'kept')
+
+    wheel.cancel(timer)
+    wheel.cancel(timer)
+    assert wheel.pending == 1
+    assert wheel.next_deadline() >= 2.0
+
+    wheel.run_due(3.0)
+    assert fired == ['kept']
+
+
+def test_repeating_timer_skips_missed_intervals():
+    wheel, clock = make_wheel()
+    fired = []
+    timer = wheel.call_every(1.0, lambda: fired.append(clock.now))
+
+    for now in (1.0, 2.0, 3.0):
+        clock.now = now
+        wheel.run_due()
+    assert fired == [1.0, 2.0, 3.0]
+
+    # a long stall fires the timer once, not once per interval that was missed
+    clock.now = 10.0
+    assert wheel.run_due() == 1
+    assert len(fired) == 4 and wheel.next_deadline() >= 11.0
+
+    wheel.cancel(timer)
+    clock.now = 20.0
+    assert wheel.run_due() == 0 and len(fired) == 4
+
+
+def test_timers_further_out_than_one_revolution_wait_their_turn():
+    wheel, clock = make_wheel(slots=8)
+    fired = []
+    # 0.3 and 1.1 hash into the same slot of an 8 slot wheel with 0.1 ticks
+    wheel.call_later(0.3, fired.append, 'near')
+    wheel.call_later(1.1, fired.append, 'far')
+
+    wheel.run_due(0.5)
+    assert fired == ['near']
+    assert 1.1 <= wheel.next_deadline() <= 1.2
+    wheel.run_due(1.2)
+    assert fired == ['near', 'far']
+
+
+def test_timer_scheduled_from_a_callback_waits_for_the_next_run():
+    wheel, clock = make_wheel()
+    fired = []
+
+    def first():
+        fired.append('first')
+        wheel.call_later(0, fired.append, 'second')
+
+    wheel.call_later(0.5, first)
+    clock.now = 0.5
+    wheel.run_due()
+    assert fired == ['first']
+    clock.now = 0.7
+    wheel.run_due()
+    assert fired == ['first', 'second']
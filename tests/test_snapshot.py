@@ -0,0 +1,95 @@
+import pytest
+
+import topologies
+from routing_table import RoutingTable, RoutingTableItem
+from simulator import Simulator
+from snapshot import Snapshot
+
+
+def distances(routing_table):
+    return {node: item.distance for node, item in routing_table.items()}
+
+
+def test_snapshot_round_trips_through_a_file(tmp_path):
+    routing_table = RoutingTable()
+    routing_table["192.168.0.1"] = RoutingTableItem(0, "192.168.0.1")
+    routing_table["192.168.0.4"] = RoutingTableItem(2, "192.168.0.1")
+    routing_table["10.0.0.0/24"] = RoutingTableItem(3, "192.168.0.1")
+    snapshot = Snapshot({"192.168.0.1": True, "192.168.0.5": False}, routing_table, link_state_sequence=9,
+                        written_at=1234.5)
+    path = tmp_path / "node.snapshot"
+    snapshot.save(path)
+
+    loaded = Snapshot.load(path)
+    assert loaded.interfaces == snapshot.interfaces
+    assert distances(loaded.routing_table) == distances(routing_table)
+    assert (loaded.link_state_sequence, loaded.written_at) == (9, 1234.5)
+    assert not (tmp_path / "node.snapshot.tmp").exists()
+
+
+def test_missing_snapshot_is_none_and_a_broken_one_is_refused(tmp_path):
+    path = tmp_path / "node.snapshot"
+    assert Snapshot.load(path) is None
+    for contents in (b"", b"RTSN", b"XXXX" + bytes(40)):
+        path.write_bytes(contents)
+        with pytest.raises(ValueError):
+            Snapshot.load(path)
+
+
+def restarted_from_snapshot(tmp_path, while_crashed=None):
+    names, links = topologies.generate('line', 3, 0)
+    simulator = Simulator(names, links)
+    simulator.run_until_quiet()
+    node = simulator.nodes['n0']
+    node.snapshot_path = str(tmp_path / "n0.snapshot")
+    node.save_snapshot()
+    saved = distances(node.routing_table)
+
+    simulator.crash_node('n0')
+    if while_crashed is not None:
+        while_crashed(simulator)
+    simulator.restart_node('n0', snapshot_path=node.snapshot_path)
+    return simulator, simulator.nodes['n0'], saved
+
+
+def test_restart_starts_from_the_saved_routes(tmp_path):
+    simulator, node, saved = restarted_from_snapshot(tmp_path)
+    assert distances(node.routing_table) == saved
+    assert node._provisional_routes
+
+    simulator.run_until_quiet()
+    assert simulator.is_converged()
+    assert not node._provisional_routes and distances(node.routing_table) == saved
+
+
+def test_saved_route_the_neighbor_no_longer_offers_is_invalidated(tmp_path):
+    def lose_far_link(simulator):
+        simulator.link_down('n1', 'n2')
+        simulator.run_until_quiet()
+
+    simulator, node, saved = restarted_from_snapshot(tmp_path, lose_far_link)
+    far_address = simulator.find_interface('n2', 'n1').my_virt_ip
+    assert far_address in node.routing_table
+
+    simulator.run_until_quiet()
+    assert simulator.is_converged()
+    assert far_address not in simulator.reachable_destinations('n0')
+
+
+def test_link_taken_down_before_the_restart_stays_down(tmp_path):
+    names, links = topologies.generate('line', 3, 0)
+    simulator = Simulator(names, links)
+    simulator.run_until_quiet()
+    simulator.link_down('n1', 'n0')
+    simulator.run_until_quiet()
+    node = simulator.nodes['n1']
+    node.snapshot_path = str(tmp_path / "n1.snapshot")
+    node.save_snapshot()
+    downed = simulator.find_interface('n1', 'n0').my_virt_ip
+
+    simulator.crash_node('n1')
+    simulator.restart_node('n1', snapshot_path=node.snapshot_path)
+    simulator.run_until_quiet()
+    restarted = simulator.nodes['n1']
+    assert [interface.is_up for interface in restarted.interfaces if interface.my_virt_ip == downed] == [False]
+    assert simulator.is_converged()